@@ -1,49 +1,117 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
-from ..services.alerts_service import AlertsService
-from ..services.leads_service import LeadsService
-from ..services.sales_service import SalesService
+from typing import Dict, List, Optional
+import asyncio
 from ..core.config import settings
+from ..core.tracing import TimedRoute
+from ..core.services import services
 
-router = APIRouter(prefix="/api/alerts", tags=["alerts"])
+router = APIRouter(prefix="/api/alerts", tags=["alerts"], route_class=TimedRoute)
 
-# Initialize services
-leads_service = LeadsService(
-    domain=settings.BITRIX24_DOMAIN,
-    user_id=settings.BITRIX24_USER_ID,
-    leads_token=settings.BITRIX24_TOKEN_LEADS,
-    users_token=settings.BITRIX24_TOKEN_USERS,
-    status_token=settings.BITRIX24_TOKEN_STATUS
-)
 
-sales_service = SalesService(
-    domain=settings.BITRIX24_DOMAIN,
-    user_id=settings.BITRIX24_USER_ID,
-    deals_token=settings.BITRIX24_TOKEN_DEALS,
-    users_token=settings.BITRIX24_TOKEN_USERS
-)
+def evaluate_range(start_date: str, end_date: str, observe: bool = False) -> List[Dict]:
+    """
+    Rule, plan and anomaly alerts of every day of the range, from one load of the aggregates
+    (the day before the range is the baseline of its first day). With `observe` the days are
+    also folded into the anomaly baselines, otherwise only compared with them.
+    """
+    from ..services.report_engine import daily_frames
 
-alerts_service = AlertsService()
+    baseline = (datetime.strptime(start_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    merged = services.report_engine.load_merged(baseline, end_date)
+    users_df = services.leads_service.get_users()
+    managers, totals = daily_frames(merged, users_df, baseline, end_date)
+    periods = list(totals.loc[totals['period'] >= start_date, 'period'])
+
+    plans = [plan for period in periods for plan in services.plan_progress_service.get_alert_inputs(period)]
+    alerts = services.alerts_service.evaluate_periods(managers, totals, periods=periods, plans=plans)
+    alerts.extend(alert.to_dict() for alert in services.anomaly_detector.observe_range(merged, periods, update=observe))
+    return alerts
+
+
+def record_range(start_date: str, end_date: str) -> int:
+    """Evaluate the days of the range into the anomaly baselines and alert history; returns number of alerts"""
+    alerts = evaluate_range(start_date, end_date, observe=True)
+    periods = [day.strftime('%Y-%m-%d') for day in _days(start_date, end_date)]
+    services.alert_store.save(alerts, periods)
+    return len(alerts)
+
+
+def _days(start_date: str, end_date: str):
+    day = datetime.strptime(start_date, '%Y-%m-%d')
+    while day <= datetime.strptime(end_date, '%Y-%m-%d'):
+        yield day
+        day += timedelta(days=1)
+
+
+_recorder = None
+
+
+async def _record_daily():
+    while True:
+        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        try:
+            total = await run_in_threadpool(record_range, yesterday, yesterday)
+            print(f"[Alerts] Recorded {total} alerts of {yesterday}")
+        except Exception as e:
+            print(f"[Alerts] Could not record {yesterday}: {str(e)}")
+        now = datetime.now()
+        next_run = (now + timedelta(days=1)).replace(hour=0, minute=10, second=0, microsecond=0)
+        await asyncio.sleep((next_run - now).total_seconds())
+
+
+def start_recorder():
+    """Record yesterday's alerts now and after every midnight (on app startup, when enabled)"""
+    global _recorder
+    if settings.ALERT_HISTORY_DAILY and _recorder is None:
+        _recorder = asyncio.ensure_future(_record_daily())
+
+
+def stop_recorder():
+    """Stop the daily recorder (on app shutdown)"""
+    global _recorder
+    if _recorder is not None:
+        _recorder.cancel()
+        _recorder = None
 
 
 @router.get("/")
 async def get_current_alerts():
-    """Get current alerts for yesterday"""
+    """Get current alerts for yesterday (read-only: history and baselines are written by the daily recorder)"""
     yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    day_before = (datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d')
 
-    # Get current metrics
-    current_leads = leads_service.get_full_report(yesterday, yesterday)
-    current_sales = sales_service.get_full_report(yesterday, yesterday)
+    # One load for yesterday and the day before: rules compare them by manager ID,
+    # anomalies compare yesterday with its weekday baselines
+    alerts = await run_in_threadpool(evaluate_range, yesterday, yesterday)
 
-    # Get previous day metrics for comparison
-    previous_leads = leads_service.get_full_report(day_before, day_before)
+    return {"alerts": alerts}
 
-    # Generate alerts
-    alerts = alerts_service.get_all_alerts(
-        current_leads_metrics=current_leads,
-        current_sales_metrics=current_sales,
-        previous_leads_metrics=previous_leads
-    )
 
-    return {"alerts": alerts}
+@router.get("/history")
+async def get_alerts_history(
+    start: Optional[str] = Query(None, description="Start date in YYYY-MM-DD format"),
+    end: Optional[str] = Query(None, description="End date in YYYY-MM-DD format"),
+    manager_id: Optional[int] = Query(None, description="Filter by manager ID"),
+    severity: Optional[str] = Query(None, description="critical, warning or info")
+):
+    """Get stored alerts for a period (see app.commands.backfill_alerts to fill past days)"""
+    if not end:
+        end = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    if not start:
+        start = (datetime.strptime(end, '%Y-%m-%d') - timedelta(days=29)).strftime('%Y-%m-%d')
+
+    try:
+        datetime.strptime(start, '%Y-%m-%d')
+        datetime.strptime(end, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+    alerts = await run_in_threadpool(services.alert_store.query, start, end, manager_id=manager_id, severity=severity)
+
+    return {
+        'start': start,
+        'end': end,
+        'total': len(alerts),
+        'alerts': alerts
+    }
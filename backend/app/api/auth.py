@@ -1,9 +1,7 @@
 from fastapi import APIRouter, HTTPException, Header
 from typing import Optional
-import hmac
-import hashlib
-import json
-from urllib.parse import parse_qs
+from ..core.config import settings
+from ..core.security import TelegramAuth, telegram_auth
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
@@ -13,37 +11,8 @@ def validate_telegram_web_app_data(init_data: str, bot_token: str) -> bool:
     Validate Telegram Mini App init data
     https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
     """
-    try:
-        parsed_data = parse_qs(init_data)
-        hash_value = parsed_data.get('hash', [''])[0]
-
-        if not hash_value:
-            return False
-
-        # Remove hash from data
-        data_check_string = '\n'.join(
-            [f"{k}={v[0]}" for k, v in sorted(parsed_data.items()) if k != 'hash']
-        )
-
-        # Create secret key
-        secret_key = hmac.new(
-            key=b"WebAppData",
-            msg=bot_token.encode(),
-            digestmod=hashlib.sha256
-        ).digest()
-
-        # Calculate hash
-        calculated_hash = hmac.new(
-            key=secret_key,
-            msg=data_check_string.encode(),
-            digestmod=hashlib.sha256
-        ).hexdigest()
-
-        return calculated_hash == hash_value
-
-    except Exception as e:
-        print(f"[Auth Error] {str(e)}")
-        return False
+    auth = telegram_auth if bot_token == settings.TELEGRAM_BOT_TOKEN else TelegramAuth(bot_token)
+    return auth.verify(init_data) is not None
 
 
 @router.post("/telegram")
@@ -54,10 +23,11 @@ async def validate_telegram_init_data(
     if not x_telegram_init_data:
         raise HTTPException(status_code=401, detail="Missing Telegram init data")
 
-    # For development, you can skip validation
-    # In production, uncomment this:
-    # from ..core.config import settings
-    # if not validate_telegram_web_app_data(x_telegram_init_data, settings.TELEGRAM_BOT_TOKEN):
-    #     raise HTTPException(status_code=401, detail="Invalid Telegram init data")
+    if not settings.TELEGRAM_AUTH_ENABLED:
+        return {"status": "authenticated"}
+
+    user = telegram_auth.verify(x_telegram_init_data)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid Telegram init data")
 
-    return {"status": "authenticated"}
+    return {"status": "authenticated", "user": user}
@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from typing import List
+from ..core.services import services
+
+router = APIRouter(prefix="/api/live", tags=["live"])
+
+
+async def notify(days: List[str]):
+    """Event worker callback; until someone opens the stream there is no hub to update"""
+    live_hub = services.peek('live_hub')
+    if live_hub is not None:
+        await live_hub.notify(days)
+
+
+@router.get("/today")
+async def stream_today():
+    """Today's counters as Server-Sent Events: `snapshot` on connect, then `delta` on every change"""
+    return StreamingResponse(
+        services.live_hub.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/today/snapshot")
+async def get_today_snapshot():
+    """Current snapshot of today (for clients without EventSource)"""
+    live_hub = services.live_hub
+    if live_hub.snapshot is None:
+        await live_hub.refresh()
+    return {"version": live_hub.version, **live_hub.snapshot}
@@ -1,214 +1,484 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse
 from datetime import datetime, timedelta
 from typing import Optional
+from ..core.tracing import TimedRoute
+from ..core.admission import run_report, user_key
 from ..core.config import settings
-from ..services.leads_service import LeadsService
-from ..services.sales_service import SalesService
-from ..services.alerts_service import AlertsService
+from ..core.services import services
 
-router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+router = APIRouter(prefix="/api/metrics", tags=["metrics"], route_class=TimedRoute)
 
-# Initialize services
-leads_service = LeadsService(
-    domain=settings.BITRIX24_DOMAIN,
-    user_id=settings.BITRIX24_USER_ID,
-    leads_token=settings.BITRIX24_TOKEN_LEADS,
-    users_token=settings.BITRIX24_TOKEN_USERS,
-    status_token=settings.BITRIX24_TOKEN_STATUS
-)
 
-sales_service = SalesService(
-    domain=settings.BITRIX24_DOMAIN,
-    user_id=settings.BITRIX24_USER_ID,
-    deals_token=settings.BITRIX24_TOKEN_DEALS,
-    users_token=settings.BITRIX24_TOKEN_USERS
-)
+def build_leads_metrics(date: str, manager_id: Optional[int]) -> dict:
+    # Service modules (and pandas) are imported on first use, see core/services.py
+    from ..services.schema import to_records, value_counts_dict
 
-alerts_service = AlertsService()
+    leads_df = services.leads_service.get_leads_data(date, date)
+    users_df = services.leads_service.get_users()
+    statuses_df = services.leads_service.get_statuses()
+
+    if leads_df.empty:
+        return {
+            'total_leads': 0,
+            'by_source': {},
+            'by_manager': {},
+            'by_status': {},
+            'details': []
+        }
+
+    # Filter by manager if specified
+    if manager_id:
+        leads_df = leads_df[leads_df['ASSIGNED_BY_ID'] == manager_id]
+
+    # Merge with users and statuses
+    leads_with_users = leads_df.merge(users_df, left_on='ASSIGNED_BY_ID', right_on='ID', how='inner')
+    full_data = leads_with_users.merge(statuses_df, on='STATUS_ID', how='inner')
+
+    # Aggregations
+    by_source = value_counts_dict(full_data['UTM_SOURCE'])
+    by_manager = value_counts_dict(full_data['FULL_NAME'])
+    by_status = value_counts_dict(full_data['NAME'])
+
+    # Details for drill-down
+    details = to_records(full_data[['ID_x', 'DATE_CREATE', 'UTM_SOURCE', 'FULL_NAME', 'NAME', 'taken_in_work', 'time_taken_in_work']])
+
+    return {
+        'date': date,
+        'total_leads': len(leads_df),
+        'by_source': by_source,
+        'by_manager': by_manager,
+        'by_status': by_status,
+        'details': details
+    }
 
 
 @router.get("/leads")
 async def get_leads_metrics(
     date: Optional[str] = Query(None, description="Date in YYYY-MM-DD format"),
-    manager_id: Optional[str] = Query(None, description="Filter by manager ID")
+    manager_id: Optional[int] = Query(None, description="Filter by manager ID"),
+    key: str = Depends(user_key)
 ):
     """Get leads metrics with drill-down capability"""
     try:
         if not date:
             date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+        metrics, cache = await run_report(
+            ('leads_metrics', date, manager_id), key, date, date,
+            lambda: build_leads_metrics(date, manager_id), period_type='daily'
+        )
+        return {**metrics, 'cache': cache}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting metrics: {str(e)}")
 
-        leads_df = leads_service.get_leads_data(date, date)
-        users_df = leads_service.get_users()
-        statuses_df = leads_service.get_statuses()
 
-        if leads_df.empty:
-            return {
-                'total_leads': 0,
-                'by_source': {},
-                'by_manager': {},
-                'by_status': {},
-                'details': []
-            }
+def build_sales_metrics(date: str, manager_id: Optional[int]) -> dict:
+    from ..services.schema import to_records
 
-        # Filter by manager if specified
-        if manager_id:
-            leads_df = leads_df[leads_df['ASSIGNED_BY_ID'] == manager_id]
+    deals_df = services.sales_service.get_deals_data(date, date)
+    users_df = services.sales_service.get_users()
 
-        # Merge with users and statuses
-        leads_with_users = leads_df.merge(users_df, left_on='ASSIGNED_BY_ID', right_on='ID', how='inner')
-        full_data = leads_with_users.merge(statuses_df, on='STATUS_ID', how='inner')
+    if deals_df.empty:
+        return {
+            'total_amount': 0,
+            'total_contracts': 0,
+            'by_source': {},
+            'by_manager': {},
+            'details': []
+        }
 
-        # Aggregations
-        by_source = full_data['UTM_SOURCE'].value_counts().to_dict()
-        by_manager = full_data['FULL_NAME'].value_counts().to_dict()
-        by_status = full_data['NAME'].value_counts().to_dict()
+    # Filter by manager if specified
+    if manager_id:
+        deals_df = deals_df[deals_df['ASSIGNED_BY_ID'] == manager_id]
 
-        # Details for drill-down
-        details = full_data[['ID_x', 'DATE_CREATE', 'UTM_SOURCE', 'FULL_NAME', 'NAME', 'taken_in_work', 'time_taken_in_work']].to_dict('records')
+    # Merge with users
+    full_data = deals_df.merge(users_df, how='inner', left_on='ASSIGNED_BY_ID', right_on='ID')
 
-        return {
-            'date': date,
-            'total_leads': len(leads_df),
-            'by_source': by_source,
-            'by_manager': by_manager,
-            'by_status': by_status,
-            'details': details
-        }
+    # Aggregations
+    by_source = full_data.groupby('UTM_SOURCE', observed=True)['OPPORTUNITY'].sum().to_dict()
+    by_manager = full_data.groupby('FULL_NAME', observed=True)['OPPORTUNITY'].sum().to_dict()
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error getting metrics: {str(e)}")
+    return {
+        'date': date,
+        'total_amount': float(full_data['OPPORTUNITY'].sum()),
+        'total_contracts': len(full_data),
+        'by_source': by_source,
+        'by_manager': by_manager,
+        'details': to_records(full_data[['ID_x', 'OPPORTUNITY', 'FULL_NAME', 'UTM_SOURCE', 'CLOSEDATE']])
+    }
 
 
 @router.get("/sales")
 async def get_sales_metrics(
     date: Optional[str] = Query(None, description="Date in YYYY-MM-DD format"),
-    manager_id: Optional[str] = Query(None, description="Filter by manager ID")
+    manager_id: Optional[int] = Query(None, description="Filter by manager ID"),
+    key: str = Depends(user_key)
 ):
     """Get sales metrics with drill-down capability"""
     try:
         if not date:
             date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+        metrics, cache = await run_report(
+            ('sales_metrics', date, manager_id), key, date, date,
+            lambda: build_sales_metrics(date, manager_id), period_type='daily'
+        )
+        return {**metrics, 'cache': cache}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting metrics: {str(e)}")
 
-        deals_df = sales_service.get_deals_data(date, date)
-        users_df = sales_service.get_users()
-
-        if deals_df.empty:
-            return {
-                'total_amount': 0,
-                'total_contracts': 0,
-                'by_source': {},
-                'by_manager': {},
-                'details': []
-            }
-
-        # Filter by manager if specified
-        if manager_id:
-            deals_df = deals_df[deals_df['ASSIGNED_BY_ID'] == manager_id]
-
-        # Merge with users
-        full_data = deals_df.merge(users_df, how='inner', left_on='ASSIGNED_BY_ID', right_on='ID')
-        full_data["OPPORTUNITY"] = full_data["OPPORTUNITY"].astype(float)
 
-        # Aggregations
-        by_source = full_data.groupby('UTM_SOURCE')['OPPORTUNITY'].sum().to_dict()
-        by_manager = full_data.groupby('FULL_NAME')['OPPORTUNITY'].sum().to_dict()
+def build_conversion_metrics(start_date: str, end_date: str) -> dict:
+    leads_df = services.leads_service.get_leads_data(start_date, end_date)
+    deals_df = services.leads_service.get_deals_data(start_date, end_date)
+    users_df = services.leads_service.get_users()
 
+    if leads_df.empty:
         return {
-            'date': date,
-            'total_amount': float(full_data['OPPORTUNITY'].sum()),
-            'total_contracts': len(full_data),
-            'by_source': by_source,
-            'by_manager': by_manager,
-            'details': full_data[['ID_x', 'OPPORTUNITY', 'FULL_NAME', 'UTM_SOURCE', 'CLOSEDATE']].to_dict('records')
+            'total_cr': 0,
+            'by_manager': []
         }
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error getting metrics: {str(e)}")
+    metrics = services.leads_service.calculate_metrics(leads_df, deals_df, users_df)
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'total_leads': metrics['total_leads'],
+        'total_deals': metrics['total_deals'],
+        'total_cr': round((metrics['total_deals'] / metrics['total_leads'] * 100) if metrics['total_leads'] > 0 else 0, 2),
+        'department_median': metrics['department_median'],
+        'department_p90': metrics['department_p90'],
+        'department_p95': metrics['department_p95'],
+        'by_manager': metrics['by_manager']
+    }
 
 
 @router.get("/conversion")
 async def get_conversion_metrics(
     start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
-    end_date: str = Query(..., description="End date in YYYY-MM-DD format")
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    key: str = Depends(user_key)
 ):
     """Get conversion metrics for period"""
     try:
-        leads_df = leads_service.get_leads_data(start_date, end_date)
-        deals_df = leads_service.get_deals_data(start_date, end_date)
-        users_df = leads_service.get_users()
+        metrics, cache = await run_report(
+            ('conversion', start_date, end_date), key, start_date, end_date,
+            lambda: build_conversion_metrics(start_date, end_date)
+        )
+        return {**metrics, 'cache': cache}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting conversion metrics: {str(e)}")
+
+
+def build_manager_detail(manager_id: int, start_date: str, end_date: str) -> dict:
+    from ..services.schema import to_records, value_counts_dict
+
+    # Get leads for this manager
+    leads_df = services.leads_service.get_leads_data(start_date, end_date)
+    deals_df = services.leads_service.get_deals_data(start_date, end_date)
+    users_df = services.leads_service.get_users()
+    statuses_df = services.leads_service.get_statuses()
+
+    # Filter by manager
+    manager_leads = leads_df[leads_df['ASSIGNED_BY_ID'] == manager_id]
+    manager_deals = deals_df[deals_df['ASSIGNED_BY_ID'] == manager_id] if not deals_df.empty else deals_df
+
+    # Get manager name
+    manager_info = users_df[users_df['ID'] == manager_id]
+    manager_name = manager_info.iloc[0]['FULL_NAME'] if not manager_info.empty else 'Unknown'
+
+    # Calculate metrics
+    total_leads = len(manager_leads)
+    total_deals = len(manager_deals) if not manager_deals.empty else 0
+    cr = round((total_deals / total_leads * 100) if total_leads > 0 else 0, 2)
+
+    # Reaction time
+    leads_with_time = manager_leads[manager_leads['time_taken_in_work'].notna()]
+    avg_reaction_time = leads_with_time['time_taken_in_work'].mean() if not leads_with_time.empty else None
+
+    # By status
+    manager_leads_full = manager_leads.merge(statuses_df, on='STATUS_ID', how='inner')
+    by_status = value_counts_dict(manager_leads_full['NAME'])
+
+    # By source
+    by_source = value_counts_dict(manager_leads['UTM_SOURCE'])
+
+    return {
+        'manager_id': manager_id,
+        'manager_name': manager_name,
+        'start_date': start_date,
+        'end_date': end_date,
+        'total_leads': total_leads,
+        'total_deals': total_deals,
+        'cr_percent': cr,
+        'avg_reaction_time': str(avg_reaction_time) if avg_reaction_time else None,
+        'by_status': by_status,
+        'by_source': by_source,
+        'leads_list': to_records(manager_leads[['ID', 'DATE_CREATE', 'UTM_SOURCE', 'STATUS_ID', 'taken_in_work']])
+    }
+
+
+@router.get("/manager/{manager_id}")
+async def get_manager_detail(
+    manager_id: int,
+    start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    key: str = Depends(user_key)
+):
+    """Get detailed metrics for specific manager"""
+    try:
+        detail, cache = await run_report(
+            ('manager', manager_id, start_date, end_date), key, start_date, end_date,
+            lambda: build_manager_detail(manager_id, start_date, end_date)
+        )
+        return {**detail, 'cache': cache}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting manager details: {str(e)}")
+
 
-        if leads_df.empty:
-            return {
-                'total_cr': 0,
-                'by_manager': []
-            }
+def build_heatmap(rows: str, columns: str, start_date: str, end_date: str) -> dict:
+    from ..services.heatmap import sparse_heatmap
 
-        metrics = leads_service.calculate_metrics(leads_df, deals_df, users_df)
+    users_df = services.leads_service.get_users()
+    statuses_df = services.leads_service.get_statuses()
+    if 'hour' in (rows, columns):
+        # Hours need per-lead timestamps
+        leads_df = services.leads_service.get_leads_data(start_date, end_date, reaction_time=False)
+        weights = None
+    else:
+        # Daily aggregates carry manager, source, status and day
+        leads_df = services.report_engine.load_merged(start_date, end_date).get('leads')
+        weights = 'number_of_leads'
 
+    if leads_df is None or leads_df.empty:
         return {
             'start_date': start_date,
             'end_date': end_date,
-            'total_leads': metrics['total_leads'],
-            'total_deals': metrics['total_deals'],
-            'total_cr': round((metrics['total_deals'] / metrics['total_leads'] * 100) if metrics['total_leads'] > 0 else 0, 2),
-            'by_manager': metrics['by_manager']
+            'rows': {'dimension': rows, 'keys': [], 'labels': []},
+            'columns': {'dimension': columns, 'keys': [], 'labels': []},
+            'cells': []
         }
 
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        **sparse_heatmap(leads_df, rows, columns, users_df, statuses_df, weights=weights)
+    }
+
+
+@router.get("/heatmap")
+async def get_heatmap(
+    start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    rows: str = Query("manager", description="manager, status, source, hour or weekday"),
+    columns: str = Query("status", description="manager, status, source, hour or weekday"),
+    key: str = Depends(user_key)
+):
+    """Lead counts over two dimensions as sparse [row, column, count] cells with label tables"""
+    from ..services.heatmap import DIMENSIONS
+
+    try:
+        try:
+            datetime.strptime(start_date, '%Y-%m-%d')
+            datetime.strptime(end_date, '%Y-%m-%d')
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+        if rows not in DIMENSIONS or columns not in DIMENSIONS or rows == columns:
+            raise HTTPException(
+                status_code=400,
+                detail=f"rows and columns must be two different dimensions of: {', '.join(DIMENSIONS)}"
+            )
+
+        heatmap, cache = await run_report(
+            ('heatmap', rows, columns, start_date, end_date), key, start_date, end_date,
+            lambda: build_heatmap(rows, columns, start_date, end_date)
+        )
+        return {**heatmap, 'cache': cache}
+
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error getting conversion metrics: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting heatmap: {str(e)}")
 
 
-@router.get("/manager/{manager_id}")
-async def get_manager_detail(
-    manager_id: str,
+@router.get("/timeseries")
+async def get_timeseries(
     start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
-    end_date: str = Query(..., description="End date in YYYY-MM-DD format")
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    grain: str = Query("daily", description="daily, weekly or monthly"),
+    breakdown: Optional[str] = Query(None, description="manager or source (default: department totals)"),
+    key: str = Depends(user_key)
 ):
-    """Get detailed metrics for specific manager"""
+    """Leads, sales, revenue, CR% and median reaction per day, week or month from stored daily aggregates"""
+    try:
+        try:
+            start = datetime.strptime(start_date, '%Y-%m-%d')
+            end = datetime.strptime(end_date, '%Y-%m-%d')
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+        if start > end:
+            raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+        if grain not in ('daily', 'weekly', 'monthly'):
+            raise HTTPException(status_code=400, detail="grain must be daily, weekly or monthly")
+        if breakdown not in (None, 'manager', 'source'):
+            raise HTTPException(status_code=400, detail="breakdown must be manager or source")
+
+        timeseries, cache = await run_report(
+            ('timeseries', start_date, end_date, grain, breakdown), key, start_date, end_date,
+            lambda: services.report_engine.get_timeseries(start_date, end_date, grain, breakdown)
+        )
+        # Plain JSON values already: skips jsonable_encoder, which dominates for daily per-manager series
+        return JSONResponse({'start_date': start_date, 'end_date': end_date, **timeseries, 'cache': cache})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting time series: {str(e)}")
+
+
+def build_cohorts(start_date: str, end_date: str, grain: str, breakdown: Optional[str]) -> dict:
+    from ..services.cohorts import build_cohorts as cohorts
+
+    # Leads of the range and deals closed since its start; only days not mirrored yet are fetched
+    today = datetime.now().strftime('%Y-%m-%d')
+    services.entity_sync.mirror_range('lead', start_date, end_date)
+    services.entity_sync.mirror_range('deal', start_date, max(today, end_date))
+
+    users_df = services.leads_service.get_users() if breakdown == 'manager' else None
+    outcomes = services.entity_store.lead_outcomes(start_date, end_date)
+    return cohorts(outcomes, grain, breakdown, users_df)
+
+
+@router.get("/cohorts")
+async def get_cohorts(
+    start_date: str = Query(..., description="First lead creation date (YYYY-MM-DD)"),
+    end_date: str = Query(..., description="Last lead creation date (YYYY-MM-DD)"),
+    grain: str = Query("monthly", description="Cohort period: daily, weekly or monthly"),
+    breakdown: Optional[str] = Query(None, description="manager or source"),
+    key: str = Depends(user_key)
+):
+    """Conversion of leads to won deals by lead creation cohort, with lead-to-close time percentiles"""
     try:
-        # Get leads for this manager
-        leads_df = leads_service.get_leads_data(start_date, end_date)
-        deals_df = leads_service.get_deals_data(start_date, end_date)
-        users_df = leads_service.get_users()
-        statuses_df = leads_service.get_statuses()
+        try:
+            start = datetime.strptime(start_date, '%Y-%m-%d')
+            end = datetime.strptime(end_date, '%Y-%m-%d')
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+        if start > end:
+            raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+        if grain not in ('daily', 'weekly', 'monthly'):
+            raise HTTPException(status_code=400, detail="grain must be daily, weekly or monthly")
+        if breakdown not in (None, 'manager', 'source'):
+            raise HTTPException(status_code=400, detail="breakdown must be manager or source")
+
+        cohorts, cache = await run_report(
+            ('cohorts', start_date, end_date, grain, breakdown), key, start_date, end_date,
+            lambda: build_cohorts(start_date, end_date, grain, breakdown)
+        )
+        return {'start_date': start_date, 'end_date': end_date, **cohorts, 'cache': cache}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting cohorts: {str(e)}")
+
 
-        # Filter by manager
-        manager_leads = leads_df[leads_df['ASSIGNED_BY_ID'] == manager_id]
-        manager_deals = deals_df[deals_df['ASSIGNED_BY_ID'] == manager_id] if not deals_df.empty else pd.DataFrame()
+def build_stage_report(report: str, kind: str, start_date: str, end_date: str, breakdown: Optional[str]) -> dict:
+    from ..services.stage_history import range_bounds, stage_conversion, stage_names, stays, time_in_status
 
-        # Get manager name
-        manager_info = users_df[users_df['ID'] == manager_id]
-        manager_name = manager_info.iloc[0]['FULL_NAME'] if not manager_info.empty else 'Unknown'
+    if not services.stage_sync.ingested(kind):
+        raise HTTPException(
+            status_code=503,
+            detail=f"Stage history of {kind}s is not ingested yet (python -m app.commands.sync_stage_history)",
+            headers={"Retry-After": "300"}
+        )
+    # New history records first (one request when nothing moved), then owners' managers if needed
+    services.stage_sync.sync(kind, max_pages=settings.STAGE_HISTORY_REQUEST_PAGES, wait=False)
+    start_ts, end_ts = range_bounds(start_date, end_date)
+    if breakdown == 'manager':
+        services.stage_sync.attach_managers(kind, start_ts, end_ts)
 
-        # Calculate metrics
-        total_leads = len(manager_leads)
-        total_deals = len(manager_deals) if not manager_deals.empty else 0
-        cr = round((total_deals / total_leads * 100) if total_leads > 0 else 0, 2)
+    transitions = services.stage_store.transitions(kind, start_ts, end_ts, managers=breakdown == 'manager')
+    users_df = services.leads_service.get_users() if breakdown == 'manager' else None
+    build = time_in_status if report == 'time_in_status' else stage_conversion
+    names = stage_names(services.leads_service.get_status_list(), kind)
+    result = build(stays(transitions, start_ts, end_ts), breakdown, users_df, names)
+    return {'kind': kind, **result, 'synced_at': services.stage_store.synced_at(kind)}
 
-        # Reaction time
-        leads_with_time = manager_leads[manager_leads['time_taken_in_work'].notna()]
-        avg_reaction_time = leads_with_time['time_taken_in_work'].mean() if not leads_with_time.empty else None
 
-        # By status
-        manager_leads_full = manager_leads.merge(statuses_df, on='STATUS_ID', how='inner')
-        by_status = manager_leads_full['NAME'].value_counts().to_dict()
+async def stage_report(report: str, kind: str, start_date: str, end_date: str, breakdown: Optional[str], key: str) -> dict:
+    try:
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if start > end:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    if kind not in ('lead', 'deal'):
+        raise HTTPException(status_code=400, detail="kind must be lead or deal")
+    if breakdown not in (None, 'manager'):
+        raise HTTPException(status_code=400, detail="breakdown must be manager")
+
+    result, cache = await run_report(
+        (report, kind, start_date, end_date, breakdown), key, start_date, end_date,
+        lambda: build_stage_report(report, kind, start_date, end_date, breakdown)
+    )
+    return {'start_date': start_date, 'end_date': end_date, **result, 'cache': cache}
+
+
+@router.get("/stages/time-in-status")
+async def get_time_in_status(
+    start_date: str = Query(..., description="First day stays began (YYYY-MM-DD)"),
+    end_date: str = Query(..., description="Last day stays began (YYYY-MM-DD)"),
+    kind: str = Query("lead", description="lead (statuses) or deal (stages)"),
+    breakdown: Optional[str] = Query(None, description="manager"),
+    key: str = Depends(user_key)
+):
+    """Time spent in each status or stage (p50-p95, hours) and stays still open, from stage history"""
+    try:
+        return await stage_report('time_in_status', kind, start_date, end_date, breakdown, key)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting time in status: {str(e)}")
 
-        # By source
-        by_source = manager_leads['UTM_SOURCE'].value_counts().to_dict()
 
-        return {
-            'manager_id': manager_id,
-            'manager_name': manager_name,
-            'start_date': start_date,
-            'end_date': end_date,
-            'total_leads': total_leads,
-            'total_deals': total_deals,
-            'cr_percent': cr,
-            'avg_reaction_time': str(avg_reaction_time) if avg_reaction_time else None,
-            'by_status': by_status,
-            'by_source': by_source,
-            'leads_list': manager_leads[['ID', 'DATE_CREATE', 'UTM_SOURCE', 'STATUS_ID', 'taken_in_work']].to_dict('records')
-        }
+@router.get("/stages/conversion")
+async def get_stage_conversion(
+    start_date: str = Query(..., description="First day stays began (YYYY-MM-DD)"),
+    end_date: str = Query(..., description="Last day stays began (YYYY-MM-DD)"),
+    kind: str = Query("lead", description="lead (statuses) or deal (stages)"),
+    breakdown: Optional[str] = Query(None, description="manager"),
+    key: str = Depends(user_key)
+):
+    """Where entities move from each status or stage, and the share that reached success afterwards"""
+    try:
+        return await stage_report('stage_conversion', kind, start_date, end_date, breakdown, key)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error getting manager details: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting stage conversion: {str(e)}")
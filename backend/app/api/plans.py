@@ -1,64 +1,124 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
-from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+from datetime import datetime, timedelta
+from ..core.tracing import TimedRoute
+from ..core.services import services
 
-router = APIRouter(prefix="/api/plans", tags=["plans"])
+router = APIRouter(prefix="/api/plans", tags=["plans"], route_class=TimedRoute)
 
-# In-memory storage for plans (without database)
-# In future, replace with database storage
-plans_storage = []
+
+# Values services.plan_progress evaluates; anything else would never match
+MetricType = Literal['leads', 'sales', 'revenue', 'conversion']  # sales = number of contracts
+PeriodType = Literal['daily', 'weekly', 'monthly']
+
+
+class PlanIn(BaseModel):
+    manager_id: int  # 0 = department
+    metric_type: MetricType
+    period_type: PeriodType
+    target_value: float
+    start_date: str
+    end_date: str
+
+
+def validate_range(start_date: str, end_date: str):
+    try:
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if start > end:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
 
 
 @router.get("/")
-async def get_plans():
-    """Get all plans"""
-    return {"plans": plans_storage}
+def get_plans(
+    manager_id: Optional[int] = Query(None, description="Filter by manager ID"),
+    period_type: Optional[PeriodType] = Query(None, description="daily, weekly or monthly"),
+    metric_type: Optional[MetricType] = Query(None, description="leads, sales, revenue or conversion"),
+    active_on: Optional[str] = Query(None, description="Only plans active on this date (YYYY-MM-DD)")
+):
+    """Get plans"""
+    if active_on:
+        validate_range(active_on, active_on)
+    plans = services.plan_store.find(manager_id=manager_id, period_type=period_type, metric_type=metric_type, active_on=active_on)
+    return {"plans": plans}
+
+
+@router.get("/progress")
+async def get_plans_progress(
+    date: Optional[str] = Query(None, description="Progress as of this date (YYYY-MM-DD), default yesterday"),
+    manager_id: Optional[int] = Query(None, description="Filter by manager ID (0 = department)")
+):
+    """Plan vs actual of plans active on a date, with projection to period end"""
+    if not date:
+        date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    validate_range(date, date)
+
+    try:
+        progress = await run_in_threadpool(services.plan_progress_service.get_progress, date, manager_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error calculating plan progress: {str(e)}")
+
+    return {
+        'date': date,
+        'total': len(progress),
+        'on_track': sum(1 for plan in progress if plan['on_track']),
+        'plans': progress
+    }
 
 
 @router.post("/")
-async def create_plan(
-    manager_id: str,
-    metric_type: str,
-    period_type: str,
+def create_plan(
+    manager_id: int,
+    metric_type: MetricType,
+    period_type: PeriodType,
     target_value: float,
     start_date: str,
     end_date: str
 ):
-    """Create a new plan"""
-    plan = {
-        "id": len(plans_storage) + 1,
-        "manager_id": manager_id,
-        "metric_type": metric_type,  # 'leads', 'sales', 'conversion'
-        "period_type": period_type,  # 'daily', 'weekly', 'monthly'
-        "target_value": target_value,
-        "start_date": start_date,
-        "end_date": end_date,
-        "created_at": datetime.now().isoformat()
-    }
+    """Create a new plan; 409 if the manager already has one for this metric and period (see PUT and /bulk)"""
+    validate_range(start_date, end_date)
+    plan = PlanIn(
+        manager_id=manager_id,
+        metric_type=metric_type,
+        period_type=period_type,
+        target_value=target_value,
+        start_date=start_date,
+        end_date=end_date
+    )
+    created = services.plan_store.create(plan.model_dump())
+    if created is None:
+        existing = services.plan_store.find_by_key(plan.model_dump())
+        raise HTTPException(status_code=409, detail=f"Plan already exists (id {existing['id']}), update it with PUT")
+    return {"plan": created}
 
-    plans_storage.append(plan)
 
-    return {"plan": plan}
+@router.post("/bulk")
+def upsert_plans(plans: List[PlanIn]):
+    """Create or update many plans at once, e.g. a team's monthly targets"""
+    for plan in plans:
+        validate_range(plan.start_date, plan.end_date)
+    saved = services.plan_store.upsert_many([plan.model_dump() for plan in plans])
+    return {"total": len(saved), "plans": saved}
 
 
 @router.put("/{plan_id}")
-async def update_plan(
+def update_plan(
     plan_id: int,
     target_value: float
 ):
     """Update a plan"""
-    for plan in plans_storage:
-        if plan["id"] == plan_id:
-            plan["target_value"] = target_value
-            plan["updated_at"] = datetime.now().isoformat()
-            return {"plan": plan}
-
-    raise HTTPException(status_code=404, detail="Plan not found")
+    plan = services.plan_store.update_target(plan_id, target_value)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return {"plan": plan}
 
 
 @router.delete("/{plan_id}")
-async def delete_plan(plan_id: int):
+def delete_plan(plan_id: int):
     """Delete a plan"""
-    global plans_storage
-    plans_storage = [p for p in plans_storage if p["id"] != plan_id]
+    services.plan_store.delete(plan_id)
     return {"status": "deleted"}
@@ -1,40 +1,57 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, List, Optional
 from ..core.config import settings
-from ..services.leads_service import LeadsService
-from ..services.sales_service import SalesService, FinmapService
-from ..services.alerts_service import AlertsService
+from ..core.tracing import TimedRoute
+from ..core.admission import run_report, user_key
+from ..core.services import services
 
-router = APIRouter(prefix="/api/reports", tags=["reports"])
+router = APIRouter(prefix="/api/reports", tags=["reports"], route_class=TimedRoute)
 
-# Initialize services
-leads_service = LeadsService(
-    domain=settings.BITRIX24_DOMAIN,
-    user_id=settings.BITRIX24_USER_ID,
-    leads_token=settings.BITRIX24_TOKEN_LEADS,
-    users_token=settings.BITRIX24_TOKEN_USERS,
-    status_token=settings.BITRIX24_TOKEN_STATUS
-)
+BATCH_SECTIONS = ('leads', 'sales')
 
-sales_service = SalesService(
-    domain=settings.BITRIX24_DOMAIN,
-    user_id=settings.BITRIX24_USER_ID,
-    deals_token=settings.BITRIX24_TOKEN_DEALS,
-    users_token=settings.BITRIX24_TOKEN_USERS
-)
 
-finmap_service = FinmapService(
-    api_key=settings.FINMAP_API_KEY,
-    company_id=settings.FINMAP_COMPANY_ID
-)
+class RangeIn(BaseModel):
+    start_date: str
+    end_date: str
+    label: Optional[str] = None  # echoed back, e.g. 'this week'
 
-alerts_service = AlertsService()
+
+class BatchIn(BaseModel):
+    ranges: List[RangeIn]
+    sections: List[str] = list(BATCH_SECTIONS)
+
+
+def build_daily_report(date: str):
+    """(leads_report, sales_report, finmap_data, alerts) of one day"""
+    # Get leads report
+    leads_report = services.leads_service.get_full_report(date, date)
+
+    # Get sales report
+    sales_report = services.sales_service.get_full_report(date, date)
+
+    # Get Finmap data
+    finmap_data = services.finmap_service.get_income_for_date(date)
+
+    # Get alerts
+    prev_date = (datetime.strptime(date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    prev_leads_report = services.leads_service.get_full_report(prev_date, prev_date)
+
+    alerts = services.alerts_service.get_all_alerts(
+        current_leads_metrics=leads_report,
+        current_sales_metrics=sales_report,
+        previous_leads_metrics=prev_leads_report,
+        plans=services.plan_progress_service.get_alert_inputs(date)
+    )
+
+    return leads_report, sales_report, finmap_data, alerts
 
 
 @router.get("/daily")
 async def get_daily_report(
-    date: Optional[str] = Query(None, description="Date in YYYY-MM-DD format")
+    date: Optional[str] = Query(None, description="Date in YYYY-MM-DD format"),
+    key: str = Depends(user_key)
 ):
     """Get daily report for specific date"""
     try:
@@ -48,23 +65,8 @@ async def get_daily_report(
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
-        # Get leads report
-        leads_report = leads_service.get_full_report(date, date)
-
-        # Get sales report
-        sales_report = sales_service.get_full_report(date, date)
-
-        # Get Finmap data
-        finmap_data = finmap_service.get_income_for_date(date)
-
-        # Get alerts
-        prev_date = (datetime.strptime(date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
-        prev_leads_report = leads_service.get_full_report(prev_date, prev_date)
-
-        alerts = alerts_service.get_all_alerts(
-            current_leads_metrics=leads_report,
-            current_sales_metrics=sales_report,
-            previous_leads_metrics=prev_leads_report
+        (leads_report, sales_report, finmap_data, alerts), cache = await run_report(
+            ('daily', date), key, date, date, lambda: build_daily_report(date), period_type='daily'
         )
 
         return {
@@ -73,9 +75,12 @@ async def get_daily_report(
             'leads': leads_report,
             'sales': sales_report,
             'finmap': finmap_data,
-            'alerts': alerts
+            'alerts': alerts,
+            'cache': cache
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
 
@@ -83,7 +88,8 @@ async def get_daily_report(
 @router.get("/weekly")
 async def get_weekly_report(
     start_date: Optional[str] = Query(None, description="Start date in YYYY-MM-DD format"),
-    end_date: Optional[str] = Query(None, description="End date in YYYY-MM-DD format")
+    end_date: Optional[str] = Query(None, description="End date in YYYY-MM-DD format"),
+    key: str = Depends(user_key)
 ):
     """Get weekly report for date range"""
     try:
@@ -94,20 +100,23 @@ async def get_weekly_report(
             start_date = start.strftime('%Y-%m-%d')
             end_date = end.strftime('%Y-%m-%d')
 
-        # Get leads report
-        leads_report = leads_service.get_full_report(start_date, end_date)
-
-        # Get sales report
-        sales_report = sales_service.get_full_report(start_date, end_date)
+        # Get leads and sales reports (off the event loop, long ranges in the process pool)
+        (leads_report, sales_report), cache = await run_report(
+            ('range', start_date, end_date), key, start_date, end_date,
+            lambda: services.report_engine.get_full_reports(start_date, end_date), period_type='weekly'
+        )
 
         return {
             'start_date': start_date,
             'end_date': end_date,
             'period': 'weekly',
             'leads': leads_report,
-            'sales': sales_report
+            'sales': sales_report,
+            'cache': cache
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
 
@@ -115,7 +124,8 @@ async def get_weekly_report(
 @router.get("/monthly")
 async def get_monthly_report(
     year: Optional[int] = Query(None, description="Year"),
-    month: Optional[int] = Query(None, description="Month (1-12)")
+    month: Optional[int] = Query(None, description="Month (1-12)"),
+    key: str = Depends(user_key)
 ):
     """Get monthly report"""
     try:
@@ -141,11 +151,11 @@ async def get_monthly_report(
         end_date_obj = datetime(end_year, end_month, 1) - timedelta(days=1)
         end_date = end_date_obj.strftime('%Y-%m-%d')
 
-        # Get leads report
-        leads_report = leads_service.get_full_report(start_date, end_date)
-
-        # Get sales report
-        sales_report = sales_service.get_full_report(start_date, end_date)
+        # Get leads and sales reports (off the event loop, long ranges in the process pool)
+        (leads_report, sales_report), cache = await run_report(
+            ('range', start_date, end_date), key, start_date, end_date,
+            lambda: services.report_engine.get_full_reports(start_date, end_date), period_type='monthly'
+        )
 
         return {
             'year': year,
@@ -154,9 +164,12 @@ async def get_monthly_report(
             'end_date': end_date,
             'period': 'monthly',
             'leads': leads_report,
-            'sales': sales_report
+            'sales': sales_report,
+            'cache': cache
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
 
@@ -164,7 +177,8 @@ async def get_monthly_report(
 @router.get("/custom")
 async def get_custom_report(
     start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
-    end_date: str = Query(..., description="End date in YYYY-MM-DD format")
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    key: str = Depends(user_key)
 ):
     """Get custom period report"""
     try:
@@ -175,19 +189,123 @@ async def get_custom_report(
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
-        # Get leads report
-        leads_report = leads_service.get_full_report(start_date, end_date)
-
-        # Get sales report
-        sales_report = sales_service.get_full_report(start_date, end_date)
+        # Get leads and sales reports (off the event loop, long ranges in the process pool)
+        (leads_report, sales_report), cache = await run_report(
+            ('range', start_date, end_date), key, start_date, end_date,
+            lambda: services.report_engine.get_full_reports(start_date, end_date), period_type='custom'
+        )
 
         return {
             'start_date': start_date,
             'end_date': end_date,
             'period': 'custom',
             'leads': leads_report,
-            'sales': sales_report
+            'sales': sales_report,
+            'cache': cache
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
+
+
+def build_comparison(start_date: str, end_date: str, baseline: str) -> Dict:
+    """Comparison of a range with its baseline period, both from stored daily aggregates"""
+    from ..services.comparison import baseline_range, compare_periods
+
+    baseline_start, baseline_end = baseline_range(start_date, end_date, baseline)
+    engine = services.report_engine
+    comparison = compare_periods(
+        engine.load_merged(start_date, end_date),
+        engine.load_merged(baseline_start, baseline_end),
+        services.leads_service.get_users()
+    )
+    return {
+        'baseline': {'type': baseline, 'start_date': baseline_start, 'end_date': baseline_end},
+        **comparison
+    }
+
+
+@router.get("/compare")
+async def get_comparison(
+    start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    baseline: str = Query("previous", description="previous (same length just before) or same_last_year"),
+    key: str = Depends(user_key)
+):
+    """Period vs baseline period: current, baseline and deltas per manager, source and contract type"""
+    try:
+        try:
+            start = datetime.strptime(start_date, '%Y-%m-%d')
+            end = datetime.strptime(end_date, '%Y-%m-%d')
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+        if start > end:
+            raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+        if baseline not in ('previous', 'same_last_year'):
+            raise HTTPException(status_code=400, detail="baseline must be previous or same_last_year")
+
+        comparison, cache = await run_report(
+            ('compare', start_date, end_date, baseline), key, start_date, end_date,
+            lambda: build_comparison(start_date, end_date, baseline)
+        )
+
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            **comparison,
+            'cache': cache
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error comparing periods: {str(e)}")
+
+
+@router.post("/batch")
+async def get_batch_report(batch: BatchIn, key: str = Depends(user_key)):
+    """Reports of several ranges (e.g. this week vs last week) from one fetch of their days"""
+    try:
+        if not batch.ranges:
+            raise HTTPException(status_code=400, detail="At least one range is required")
+        if len(batch.ranges) > settings.REPORT_BATCH_MAX_RANGES:
+            raise HTTPException(status_code=400, detail=f"At most {settings.REPORT_BATCH_MAX_RANGES} ranges per batch")
+        unknown = set(batch.sections) - set(BATCH_SECTIONS)
+        if unknown or not batch.sections:
+            raise HTTPException(status_code=400, detail=f"sections must be some of: {', '.join(BATCH_SECTIONS)}")
+        for item in batch.ranges:
+            try:
+                start = datetime.strptime(item.start_date, '%Y-%m-%d')
+                end = datetime.strptime(item.end_date, '%Y-%m-%d')
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+            if start > end:
+                raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+
+        ranges = tuple((item.start_date, item.end_date) for item in batch.ranges)
+        sections = tuple(section for section in BATCH_SECTIONS if section in batch.sections)
+        # Duplicate ranges are computed once
+        unique_ranges = list(dict.fromkeys(ranges))
+
+        reports, cache = await run_report(
+            ('batch', tuple(sorted(unique_ranges)), sections), key,
+            min(start for start, _ in ranges), max(end for _, end in ranges),
+            lambda: services.report_engine.get_batch_reports(unique_ranges, sections)
+        )
+        by_range = {(report['start_date'], report['end_date']): report for report in reports}
+
+        return {
+            'ranges': [
+                {'label': item.label, **by_range[(item.start_date, item.end_date)]}
+                for item in batch.ranges
+            ],
+            'sections': list(sections),
+            'cache': cache
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException, Request
+from urllib.parse import parse_qsl
+import asyncio
+import hmac
+from ..core.config import settings
+from ..core.services import services
+
+router = APIRouter(prefix="/api/webhooks", tags=["webhooks"])
+
+_worker = None
+
+
+def start_worker(on_change=None):
+    """Start the event worker (on app startup, when events are configured)"""
+    global _worker
+    if settings.BITRIX24_APP_TOKEN and _worker is None:
+        from ..services.entity_sync import run_worker
+        _worker = asyncio.ensure_future(run_worker(
+            services.event_queue, services.entity_sync, settings.BITRIX24_EVENT_BATCH_SECONDS, on_change=on_change
+        ))
+
+
+def stop_worker():
+    """Stop the event worker (on app shutdown)"""
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        _worker = None
+
+
+@router.post("/bitrix")
+async def receive_bitrix_event(request: Request):
+    """Outbound event handler for ONCRMLEAD*/ONCRMDEAL* (form-encoded body)"""
+    if not settings.BITRIX24_APP_TOKEN:
+        raise HTTPException(status_code=404, detail="Bitrix24 events are not configured")
+
+    fields = dict(parse_qsl((await request.body()).decode()))
+    token = fields.get('auth[application_token]', '')
+    if not hmac.compare_digest(token.encode(), settings.BITRIX24_APP_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid application token")
+
+    from ..services.entity_sync import EVENTS
+
+    kind = EVENTS.get(fields.get('event', '').upper())
+    if kind is None:
+        return {"status": "ignored"}
+
+    try:
+        entity_id = int(fields.get('data[FIELDS][ID]', ''))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Missing entity ID")
+
+    services.event_queue.add(kind, entity_id)
+    return {"status": "queued", "pending": services.event_queue.size()}
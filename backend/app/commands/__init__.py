@@ -0,0 +1 @@
+# Commands package (run with python -m app.commands.<name>)
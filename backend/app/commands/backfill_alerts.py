@@ -0,0 +1,45 @@
+"""
+Backfill alert history for past days.
+
+Missing days are fetched into the daily aggregate store in bulk (chunked,
+process pool), then all rules (plans included) are evaluated over the
+whole range in one pass and stored per day. Days already in the store
+cost no Bitrix24 calls.
+Anomaly baselines are updated day by day in chronological order, so a
+backfill over a few months also warms them up.
+
+Usage (from backend/):
+    python -m app.commands.backfill_alerts --start 2024-01-01 --end 2024-03-31
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+from ..api.alerts import record_range
+from ..core.services import services
+
+
+def backfill(start_date: str, end_date: str) -> int:
+    """Evaluate and store alerts for every day of the range; returns number of alerts"""
+    # The day before the range is the baseline of its first day
+    baseline = (datetime.strptime(start_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    fetched = services.report_engine.sync_days(baseline, end_date)
+    print(f'Fetched {fetched} missing days from Bitrix24')
+
+    # Same evaluation as the daily recorder of app.api.alerts, plan alerts included
+    return record_range(start_date, end_date)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--start', required=True, help='Start date in YYYY-MM-DD format')
+    parser.add_argument('--end', default=(datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d'),
+                        help='End date in YYYY-MM-DD format (default: yesterday)')
+    args = parser.parse_args()
+
+    total = backfill(args.start, args.end)
+    print(f'Stored {total} alerts for {args.start}..{args.end}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Ingest Bitrix24 stage history (crm.stagehistory.list) of leads and deals.
+
+The first run copies the whole history, up to 2500 records per batch
+request; the stage endpoints answer 503 until it has run for the kind.
+Later runs fetch only records above the stored watermark, as uncached
+stage report requests do (with a page cap). An interrupted run resumes from
+the last stored chunk.
+
+Usage (from backend/):
+    python -m app.commands.sync_stage_history [--kind lead|deal]
+"""
+
+import argparse
+
+from ..core.services import services
+from ..services.stage_history import KINDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kind', choices=list(KINDS), help='Only this kind (default: leads and deals)')
+    args = parser.parse_args()
+
+    for kind in [args.kind] if args.kind else list(KINDS):
+        stored = services.stage_sync.sync(kind)
+        print(f'{kind}: stored {stored} transitions, watermark {services.stage_store.watermark(kind)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Admission control for report endpoints.
+
+Requests are classified by cost: cached results are served without any
+queueing, uncached short ranges take a light slot, long ranges (upstream
+heavy: many Bitrix24 pages) take one of a few heavy slots. Light and heavy
+slots are separate pools, so a cheap request never waits behind a 12-month
+report. Each user may have a limited number of reports in flight; above
+that the request is rejected with 429 instead of queueing.
+
+Stale cached results are returned at once and refreshed in the
+background; there is at most one build or refresh per cache key, and
+concurrent requests for a missing report wait for that one build. If
+admission rejects that build with 429 (a limit of the user who started it),
+the waiting requests start their own build under their own limits.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+from .cache import CacheEntry, cache_policy, report_cache
+from .config import settings
+from .security import require_telegram_user
+from .telemetry import dropped_refreshes
+from .tracing import span
+
+
+class CostClass(str, Enum):
+    CACHED = "cached"
+    LIGHT = "light"
+    HEAVY = "heavy"
+
+
+def cost_class(days: int, cached: bool) -> CostClass:
+    """Cost of a report over `days` days"""
+    if cached:
+        return CostClass.CACHED
+    if days > settings.ADMISSION_HEAVY_DAYS:
+        return CostClass.HEAVY
+    return CostClass.LIGHT
+
+
+class AdmissionController:
+    """Per-user in-flight limits plus separate global slot pools per cost class"""
+
+    def __init__(
+        self,
+        user_concurrency: int = 2,
+        user_heavy: int = 1,
+        light_slots: int = 8,
+        heavy_slots: int = 2,
+        queue_timeout: float = 60
+    ):
+        self.user_concurrency = user_concurrency
+        self.user_heavy = user_heavy
+        self.queue_timeout = queue_timeout
+        self.slots = {
+            CostClass.LIGHT: asyncio.Semaphore(light_slots),
+            CostClass.HEAVY: asyncio.Semaphore(heavy_slots),
+        }
+        self.in_flight: Dict[str, int] = {}
+        self.heavy_in_flight: Dict[str, int] = {}
+
+    def _reject(self, detail: str):
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": "5"})
+
+    @asynccontextmanager
+    async def admit(self, user_key: str, cost: CostClass):
+        """Hold a slot of the cost class for the duration of the block"""
+        if cost == CostClass.CACHED:
+            yield
+            return
+
+        heavy = cost == CostClass.HEAVY
+        if self.in_flight.get(user_key, 0) >= self.user_concurrency:
+            self._reject("Too many reports in progress, try again shortly")
+        if heavy and self.heavy_in_flight.get(user_key, 0) >= self.user_heavy:
+            self._reject("A long-range report is already in progress")
+
+        self.in_flight[user_key] = self.in_flight.get(user_key, 0) + 1
+        if heavy:
+            self.heavy_in_flight[user_key] = self.heavy_in_flight.get(user_key, 0) + 1
+        try:
+            slot = self.slots[cost]
+            try:
+                with span('admission_wait'):
+                    await asyncio.wait_for(slot.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=503, detail="Server is busy, try again later", headers={"Retry-After": "30"})
+            try:
+                yield
+            finally:
+                slot.release()
+        finally:
+            self.in_flight[user_key] -= 1
+            if not self.in_flight[user_key]:
+                del self.in_flight[user_key]
+            if heavy:
+                self.heavy_in_flight[user_key] -= 1
+                if not self.heavy_in_flight[user_key]:
+                    del self.heavy_in_flight[user_key]
+
+    def stats(self) -> Dict:
+        return {
+            'users_in_flight': len(self.in_flight),
+            'requests_in_flight': sum(self.in_flight.values()),
+            'heavy_in_flight': sum(self.heavy_in_flight.values()),
+        }
+
+
+admission = AdmissionController(
+    user_concurrency=settings.ADMISSION_USER_CONCURRENCY,
+    user_heavy=settings.ADMISSION_USER_HEAVY,
+    light_slots=settings.ADMISSION_LIGHT_SLOTS,
+    heavy_slots=settings.ADMISSION_HEAVY_SLOTS,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT
+)
+
+
+async def user_key(request: Request, user: Optional[Dict] = Depends(require_telegram_user)) -> str:
+    """Who the request counts against: Telegram user, the service, or the client address"""
+    if user and user.get('service'):
+        return 'service'
+    if user and user.get('id'):
+        return f"tg:{user['id']}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def range_days(start_date: str, end_date: str) -> int:
+    return (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+
+
+# Admission key of background refreshes: at most `user_concurrency` run at once
+BACKGROUND_KEY = 'background'
+
+# Builds and refreshes in progress, one per cache key
+_in_flight: Dict[Hashable, asyncio.Task] = {}
+
+
+async def _build(cache_key: Hashable, key: str, days: int, period_type: str, build: Callable[[], Any]) -> CacheEntry:
+    async with admission.admit(key, cost_class(days, cached=False)):
+        result = await run_in_threadpool(build)
+    fresh, grace = cache_policy(period_type)
+    return report_cache.set(cache_key, result, fresh, grace)
+
+
+def _single_flight(cache_key: Hashable, start: Callable[[], Any], background: bool = False) -> asyncio.Task:
+    task = _in_flight.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(start())
+        _in_flight[cache_key] = task
+
+        def done(finished: asyncio.Task):
+            _in_flight.pop(cache_key, None)
+            error = None if finished.cancelled() else finished.exception()
+            if error is None:
+                return
+            if not isinstance(error, HTTPException):
+                print(f"[Report Cache] Build of {cache_key} failed: {error}")
+            elif background:
+                # Nobody awaits a refresh: the stale entry stays until a later request retries
+                dropped_refreshes.inc(status=str(error.status_code))
+                print(f"[Report Cache] Refresh of {cache_key} dropped: {error.status_code} {error.detail}")
+
+        task.add_done_callback(done)
+    return task
+
+
+async def run_report(
+    cache_key: Hashable,
+    key: str,
+    start_date: str,
+    end_date: str,
+    build: Callable[[], Any],
+    period_type: str = 'custom'
+) -> Tuple[Any, Dict]:
+    """(report, cache info): cached when fresh, stale + background refresh within grace, built otherwise"""
+    entry = report_cache.lookup(cache_key)
+    if entry is not None and entry.is_fresh:
+        return entry.value, entry.meta()
+
+    days = range_days(start_date, end_date)
+    if entry is not None:
+        _single_flight(cache_key, lambda: _build(cache_key, BACKGROUND_KEY, days, period_type, build), background=True)
+        return entry.value, entry.meta(refreshing=True)
+
+    while True:
+        leader = cache_key not in _in_flight
+        task = _single_flight(cache_key, lambda: _build(cache_key, key, days, period_type, build))
+        try:
+            # Shielded: a client going away does not cancel a build others may wait for
+            entry = await asyncio.shield(task)
+        except HTTPException as e:
+            # Another user's build was over their limit: build (or join the next build) under ours
+            if leader or e.status_code != 429:
+                raise
+            continue
+        return entry.value, entry.meta()
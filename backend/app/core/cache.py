@@ -0,0 +1,145 @@
+"""
+Report result cache with stale-while-revalidate windows.
+
+Every entry is fresh for `fresh_for` seconds, then stale but still served
+for `grace_for` more seconds while a background refresh runs, then gone.
+Windows come from REPORT_CACHE_POLICY per period type.
+
+Bitrix24 reference data (users, statuses) lives in a second cache, fresh
+for REFERENCE_CACHE_SECONDS. Both survive restarts through the warm-cache
+snapshot (see core/services.py).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from .config import settings
+from .telemetry import cache_evictions, cache_requests
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    fresh_for: float
+    grace_for: float
+    created: float = field(default_factory=time.monotonic)
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.created
+
+    @property
+    def is_fresh(self) -> bool:
+        return self.age <= self.fresh_for
+
+    @property
+    def is_usable(self) -> bool:
+        return self.age <= self.fresh_for + self.grace_for
+
+    def meta(self, refreshing: bool = False) -> Dict:
+        """Cache info attached to responses"""
+        return {
+            'age_seconds': round(self.age, 1),
+            'generated_at': self.created_at,
+            'stale': not self.is_fresh,
+            'refreshing': refreshing
+        }
+
+
+class ReportCache:
+    """Thread-safe LRU of CacheEntry"""
+
+    def __init__(self, max_entries: int = 256, name: str = 'report'):
+        self.max_entries = max_entries
+        self.name = name
+        self._entries: 'OrderedDict[Hashable, CacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key: Hashable) -> Optional[CacheEntry]:
+        """Usable (fresh or stale) entry, None when missing or past its grace window"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                cache_requests.inc(cache=self.name, result='miss')
+                return None
+            if not entry.is_usable:
+                del self._entries[key]
+                cache_evictions.inc(cache=self.name, reason='expired')
+                cache_requests.inc(cache=self.name, result='miss')
+                return None
+            self._entries.move_to_end(key)
+            cache_requests.inc(cache=self.name, result='hit' if entry.is_fresh else 'stale')
+            return entry
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.lookup(key)
+        return entry.value if entry is not None else None
+
+    def set(self, key: Hashable, value: Any, fresh_for: float, grace_for: float = 0) -> CacheEntry:
+        entry = CacheEntry(value, fresh_for, grace_for)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                cache_evictions.inc(cache=self.name, reason='lru')
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def dump(self) -> List[Tuple]:
+        """Usable entries, oldest first, as (key, value, fresh_for, grace_for, created epoch time, created_at)"""
+        now = time.time()
+        with self._lock:
+            return [
+                (key, entry.value, entry.fresh_for, entry.grace_for, now - entry.age, entry.created_at)
+                for key, entry in self._entries.items() if entry.is_usable
+            ]
+
+    def load(self, items: Iterable[Tuple]) -> int:
+        """Entries of dump() that are still usable (keys already cached win); returns how many were added"""
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, value, fresh_for, grace_for, created_time, created_at in items:
+                age = max(0.0, now - created_time)
+                if key in self._entries or age > fresh_for + grace_for:
+                    continue
+                self._entries[key] = CacheEntry(value, fresh_for, grace_for, time.monotonic() - age, created_at)
+                self._entries.move_to_end(key)
+                loaded += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                cache_evictions.inc(cache=self.name, reason='lru')
+        return loaded
+
+
+def cache_policy(period_type: str) -> Tuple[float, float]:
+    """(fresh, grace) seconds of a period type"""
+    policy = settings.report_cache_policy
+    fresh, grace = policy.get(period_type) or policy.get('custom') or (300, 0)
+    return float(fresh), float(grace)
+
+
+def get_or_compute(cache: Optional[ReportCache], key: Hashable, fresh_for: float, compute: Callable[[], Any]) -> Any:
+    """Fresh cached value of `key`, computed and stored otherwise (no caching without a cache or TTL)"""
+    if cache is None or fresh_for <= 0:
+        return compute()
+    entry = cache.lookup(key)
+    if entry is not None and entry.is_fresh:
+        return entry.value
+    return cache.set(key, compute(), fresh_for).value
+
+
+# Finished reports keyed by (kind, start_date, end_date)
+report_cache = ReportCache(settings.REPORT_CACHE_SIZE)
+
+# Bitrix24 users and lead statuses, shared by all services
+reference_cache = ReportCache(16, name='reference')
@@ -1,29 +1,95 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 import json
 
 
 class Settings(BaseSettings):
-    # Bitrix24
+    # Bitrix24 (a domain with a scheme, e.g. http://127.0.0.1:8900, is used as the base URL)
     BITRIX24_DOMAIN: str
     BITRIX24_USER_ID: int
     BITRIX24_TOKEN_LEADS: str
     BITRIX24_TOKEN_USERS: str
     BITRIX24_TOKEN_STATUS: str
     BITRIX24_TOKEN_DEALS: str
+    # Outbound events (ONCRMLEAD*/ONCRMDEAL* -> /api/webhooks/bitrix); empty = disabled
+    BITRIX24_APP_TOKEN: str = ""
+    BITRIX24_EVENT_BATCH_SECONDS: float = 2.0
+    BITRIX24_EVENT_LIVE_MINUTES: int = 15  # open days untouched by events this long are polled again
+
+    # Live "today" stream (/api/live/today, Server-Sent Events)
+    LIVE_POLL_SECONDS: int = 60  # re-fetch today while watched and events are not configured
+    LIVE_HEARTBEAT_SECONDS: int = 15
+    LIVE_RECENT_REACTIONS: int = 10
 
     # Finmap
     FINMAP_API_KEY: str = ""
     FINMAP_COMPANY_ID: str = ""
+    FINMAP_BASE_URL: str = "https://api.finmap.online/v2.2"
 
     # Telegram
     TELEGRAM_BOT_TOKEN: str
+    # Data endpoints require Mini App initData (X-Telegram-Init-Data) or the service token (X-Service-Token)
+    TELEGRAM_AUTH_ENABLED: bool = True
+    TELEGRAM_AUTH_MAX_AGE: int = 86400  # seconds since auth_date, 0 = no expiry
+    TELEGRAM_AUTH_CACHE_SIZE: int = 1024
+    SERVICE_TOKEN: str = ""
 
     # API
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
     API_CORS_ORIGINS: str = '["http://localhost:5173"]'
 
+    # Report engine (long ranges are split into chunks and computed in a process pool)
+    REPORT_WORKERS: int = 1  # pandas worker processes, ~50 MB each at peak
+    REPORT_CHUNK_DAYS: int = 7
+    REPORT_ENGINE_MIN_DAYS: int = 14
+    REPORT_BATCH_MAX_RANGES: int = 24  # ranges per /api/reports/batch request
+    # Stage history: history pages (50 records) a stage report request may fetch above the watermark;
+    # the first ingestion is app.commands.sync_stage_history
+    STAGE_HISTORY_REQUEST_PAGES: int = 500
+    # Report cache per period type: [fresh, grace] seconds. Stale results are
+    # served during grace while one background refresh runs.
+    REPORT_CACHE_POLICY: str = '{"daily": [300, 3600], "weekly": [600, 3600], "monthly": [1800, 21600], "custom": [600, 3600]}'
+    REPORT_CACHE_SIZE: int = 256
+
+    # Admission control of report endpoints
+    ADMISSION_USER_CONCURRENCY: int = 2  # reports in flight per user
+    ADMISSION_USER_HEAVY: int = 1  # long-range reports in flight per user
+    ADMISSION_LIGHT_SLOTS: int = 8
+    ADMISSION_HEAVY_SLOTS: int = 2
+    ADMISSION_HEAVY_DAYS: int = 14  # uncached ranges longer than this are heavy
+    ADMISSION_QUEUE_TIMEOUT: int = 60  # seconds waiting for a slot before 503
+
+    # Alerts: threshold overrides and teams (JSON)
+    # {"managers": {"<manager_id>": {"min_conversion": 8}}, "teams": {"<team>": {...}}}
+    ALERT_THRESHOLDS: str = '{}'
+    # {"<team>": [<manager_id>, ...]}
+    ALERT_TEAMS: str = '{}'
+    # Store yesterday's alerts in the history (and fold it into the anomaly baselines) on startup and daily
+    ALERT_HISTORY_DAILY: bool = True
+
+    # Anomaly alerts: same-weekday EWMA baselines
+    ANOMALY_ALPHA: float = 0.25  # weight of the newest week
+    ANOMALY_Z_THRESHOLD: float = 2.5
+    ANOMALY_MIN_HISTORY: int = 4  # weeks before a series can alert
+
+    # Prometheus metrics at /metrics; when set, scrapes must send "Authorization: Bearer <token>"
+    METRICS_TOKEN: str = ""
+    # Request timing: Server-Timing header with per-stage spans, and a JSON-lines
+    # log of requests slower than SLOW_REQUEST_SECONDS (0 = off; empty path = stdout)
+    SERVER_TIMING_ENABLED: bool = False
+    SLOW_REQUEST_SECONDS: float = 0
+    SLOW_REQUEST_LOG: str = "data/slow_requests.jsonl"
+
+    # Cold start: Bitrix24 users and statuses are cached for REFERENCE_CACHE_SECONDS
+    # (0 = fetched on every use). Recent reports and reference data are saved to
+    # SNAPSHOT_PATH on shutdown and loaded at startup (empty = off).
+    REFERENCE_CACHE_SECONDS: int = 3600
+    SNAPSHOT_PATH: str = "data/warm_snapshot.pkl"
+
+    # Embedded database (daily aggregates, alert history)
+    DATABASE_PATH: str = "data/analytics.db"
+
     # Redis (optional)
     REDIS_URL: str = ""
 
@@ -38,6 +104,30 @@ class Settings(BaseSettings):
         except:
             return ["http://localhost:5173"]
 
+    @property
+    def alert_thresholds(self) -> Dict:
+        """Parse alert threshold overrides from JSON string"""
+        try:
+            return json.loads(self.ALERT_THRESHOLDS)
+        except:
+            return {}
+
+    @property
+    def alert_teams(self) -> Dict[str, List[int]]:
+        """Parse alert teams from JSON string"""
+        try:
+            return json.loads(self.ALERT_TEAMS)
+        except:
+            return {}
+
+    @property
+    def report_cache_policy(self) -> Dict[str, List[float]]:
+        """Parse report cache windows from JSON string"""
+        try:
+            return json.loads(self.REPORT_CACHE_POLICY)
+        except:
+            return {}
+
     class Config:
         env_file = ".env"
         case_sensitive = True
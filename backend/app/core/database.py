@@ -0,0 +1,21 @@
+import os
+import sqlite3
+import threading
+from .config import settings
+
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Per-thread connection to the embedded SQLite database"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        directory = os.path.dirname(settings.DATABASE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(settings.DATABASE_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+    return conn
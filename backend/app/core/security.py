@@ -0,0 +1,133 @@
+"""
+Telegram Mini App authentication.
+
+initData is verified as described in
+https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+The WebAppData secret is derived from the bot token once, and verified
+initData strings are kept in a bounded LRU keyed by their hash, so a warm
+session costs one dict lookup and a constant-time compare per request.
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import parse_qsl
+
+from fastapi import Header, HTTPException, Query
+
+from .config import settings
+from .telemetry import cache_evictions, cache_requests
+
+
+class TelegramAuth:
+    """Verifies initData with a cached secret and an LRU of verified sessions"""
+
+    def __init__(self, bot_token: str, max_age: int = 86400, cache_size: int = 1024):
+        self.secret_key = hmac.new(key=b"WebAppData", msg=bot_token.encode(), digestmod=hashlib.sha256).digest()
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, auth_date: int) -> bool:
+        return bool(self.max_age) and time.time() - auth_date > self.max_age
+
+    def _verify(self, init_data: str) -> Optional[tuple]:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True))
+        hash_value = fields.pop('hash', '')
+        if not hash_value:
+            return None
+
+        data_check_string = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+        calculated_hash = hmac.new(
+            key=self.secret_key,
+            msg=data_check_string.encode(),
+            digestmod=hashlib.sha256
+        ).hexdigest()
+        if not hmac.compare_digest(calculated_hash.encode(), hash_value.encode()):
+            return None
+
+        try:
+            auth_date = int(fields.get('auth_date', 0))
+            user = json.loads(fields['user']) if fields.get('user') else {}
+        except ValueError:
+            return None
+        return hash_value, auth_date, user
+
+    def verify(self, init_data: str) -> Optional[Dict]:
+        """Telegram user of valid, unexpired initData, None otherwise"""
+        hash_value = init_data.rpartition('hash=')[2].split('&', 1)[0]
+
+        with self._lock:
+            cached = self._cache.get(hash_value)
+            if cached is not None:
+                self._cache.move_to_end(hash_value)
+
+        if cached is not None and hmac.compare_digest(cached[0].encode(), init_data.encode()):
+            cache_requests.inc(cache='telegram_auth', result='hit')
+            auth_date, user = cached[1], cached[2]
+        else:
+            cache_requests.inc(cache='telegram_auth', result='miss')
+            verified = self._verify(init_data)
+            if verified is None:
+                return None
+            hash_value, auth_date, user = verified
+            with self._lock:
+                self._cache[hash_value] = (init_data, auth_date, user)
+                self._cache.move_to_end(hash_value)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    cache_evictions.inc(cache='telegram_auth', reason='lru')
+
+        if self._expired(auth_date):
+            with self._lock:
+                if self._cache.pop(hash_value, None) is not None:
+                    cache_evictions.inc(cache='telegram_auth', reason='expired')
+            return None
+        return user
+
+
+telegram_auth = TelegramAuth(
+    settings.TELEGRAM_BOT_TOKEN,
+    max_age=settings.TELEGRAM_AUTH_MAX_AGE,
+    cache_size=settings.TELEGRAM_AUTH_CACHE_SIZE
+)
+
+
+def authenticate(init_data: Optional[str], service_token: Optional[str]) -> Optional[Dict]:
+    """Telegram user, the service marker, or None when auth is disabled; 401 otherwise"""
+    if not settings.TELEGRAM_AUTH_ENABLED:
+        return None
+
+    if service_token and settings.SERVICE_TOKEN and \
+            hmac.compare_digest(service_token.encode(), settings.SERVICE_TOKEN.encode()):
+        return {'service': True}
+
+    if not init_data:
+        raise HTTPException(status_code=401, detail="Missing Telegram init data")
+
+    user = telegram_auth.verify(init_data)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid Telegram init data")
+    return user
+
+
+async def require_telegram_user(
+    x_telegram_init_data: Optional[str] = Header(None),
+    x_service_token: Optional[str] = Header(None)
+) -> Optional[Dict]:
+    """Dependency of data endpoints: valid Mini App initData or the service token (bot)"""
+    return authenticate(x_telegram_init_data, x_service_token)
+
+
+async def require_stream_user(
+    init_data: Optional[str] = Query(None),
+    x_telegram_init_data: Optional[str] = Header(None),
+    x_service_token: Optional[str] = Header(None)
+) -> Optional[Dict]:
+    """Like require_telegram_user, also accepting initData as a query parameter (EventSource cannot set headers)"""
+    return authenticate(x_telegram_init_data or init_data, x_service_token)
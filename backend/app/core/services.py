@@ -0,0 +1,220 @@
+"""
+Shared services, built on first use.
+
+All routers use one set of services (Bitrix24 and Finmap clients, report
+engine, stores) instead of building their own at import time. Service
+modules, and with them pandas and requests, are imported on first use or
+by a warm-up in the background once the app is up, so it answers its health
+check quickly after a cold start.
+
+The warm-cache snapshot keeps recent reports and Bitrix24 reference data
+across restarts: the app's lifespan saves it to SNAPSHOT_PATH on shutdown
+and loads it at startup, so the first request after a wake-up is served
+from cache (stale results are refreshed in the background as usual).
+"""
+
+import os
+import pickle
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .cache import reference_cache, report_cache
+from .config import settings
+
+SNAPSHOT_VERSION = 1
+
+
+def lazy(build: Callable[['ServiceRegistry'], Any]) -> property:
+    """Registry property whose value is built once, on first access"""
+    name = build.__name__
+
+    def get(self: 'ServiceRegistry'):
+        service = self._services.get(name)
+        if service is None:
+            with self._lock:
+                service = self._services.get(name)
+                if service is None:
+                    service = self._services[name] = build(self)
+        return service
+
+    return property(get, doc=build.__doc__)
+
+
+class ServiceRegistry:
+    """Lazily built service instances shared by all routers"""
+
+    def __init__(self):
+        self._services: Dict[str, Any] = {}
+        # Re-entrant: builders use other services
+        self._lock = threading.RLock()
+
+    def peek(self, name: str) -> Optional[Any]:
+        """Service if it has been built, None otherwise (never builds it)"""
+        return self._services.get(name)
+
+    @lazy
+    def leads_service(self):
+        from ..services.leads_service import LeadsService
+        return LeadsService(
+            domain=settings.BITRIX24_DOMAIN,
+            user_id=settings.BITRIX24_USER_ID,
+            leads_token=settings.BITRIX24_TOKEN_LEADS,
+            users_token=settings.BITRIX24_TOKEN_USERS,
+            status_token=settings.BITRIX24_TOKEN_STATUS,
+            reference_cache=reference_cache,
+            reference_ttl=settings.REFERENCE_CACHE_SECONDS
+        )
+
+    @lazy
+    def sales_service(self):
+        from ..services.sales_service import SalesService
+        return SalesService(
+            domain=settings.BITRIX24_DOMAIN,
+            user_id=settings.BITRIX24_USER_ID,
+            deals_token=settings.BITRIX24_TOKEN_DEALS,
+            users_token=settings.BITRIX24_TOKEN_USERS,
+            reference_cache=reference_cache,
+            reference_ttl=settings.REFERENCE_CACHE_SECONDS
+        )
+
+    @lazy
+    def finmap_service(self):
+        from ..services.sales_service import FinmapService
+        return FinmapService(
+            api_key=settings.FINMAP_API_KEY,
+            company_id=settings.FINMAP_COMPANY_ID,
+            base_url=settings.FINMAP_BASE_URL
+        )
+
+    @lazy
+    def alerts_service(self):
+        from ..services.alerts_service import AlertsService
+        return AlertsService.from_settings(settings)
+
+    @lazy
+    def aggregate_store(self):
+        from ..models.aggregates import AggregateStore
+        return AggregateStore(live_minutes=settings.BITRIX24_EVENT_LIVE_MINUTES)
+
+    @lazy
+    def report_engine(self):
+        from ..services.report_engine import ReportEngine
+        return ReportEngine(
+            self.leads_service,
+            self.sales_service,
+            workers=settings.REPORT_WORKERS,
+            chunk_days=settings.REPORT_CHUNK_DAYS,
+            min_days=settings.REPORT_ENGINE_MIN_DAYS,
+            store=self.aggregate_store,
+            entities=self.entity_store
+        )
+
+    @lazy
+    def plan_store(self):
+        from ..models.plans import PlanStore
+        return PlanStore()
+
+    @lazy
+    def plan_progress_service(self):
+        from ..services.plan_progress import PlanProgressService
+        return PlanProgressService(self.plan_store, self.report_engine)
+
+    @lazy
+    def alert_store(self):
+        from ..models.alerts import AlertStore
+        return AlertStore()
+
+    @lazy
+    def anomaly_detector(self):
+        from ..models.baselines import BaselineStore
+        from ..services.baselines import AnomalyDetector
+        return AnomalyDetector.from_settings(BaselineStore(), settings)
+
+    @lazy
+    def entity_store(self):
+        from ..models.entities import EntityStore
+        return EntityStore()
+
+    @lazy
+    def entity_sync(self):
+        from ..services.entity_sync import EntitySync
+        return EntitySync(self.leads_service, self.sales_service, self.entity_store, self.aggregate_store)
+
+    @lazy
+    def stage_store(self):
+        from ..models.stage_history import StageHistoryStore
+        return StageHistoryStore()
+
+    @lazy
+    def stage_sync(self):
+        from ..services.stage_history import StageHistorySync
+        return StageHistorySync(self.leads_service, self.sales_service, self.stage_store, self.entity_sync)
+
+    @lazy
+    def event_queue(self):
+        from ..services.entity_sync import EventQueue
+        return EventQueue()
+
+    @lazy
+    def live_hub(self):
+        from ..services.live import LiveHub
+        # Polls Bitrix24 only when events are not configured
+        return LiveHub(
+            self.entity_sync,
+            poll_seconds=0 if settings.BITRIX24_APP_TOKEN else settings.LIVE_POLL_SECONDS,
+            heartbeat_seconds=settings.LIVE_HEARTBEAT_SECONDS,
+            recent_limit=settings.LIVE_RECENT_REACTIONS
+        )
+
+    def warm_up(self):
+        """Build the report services off the request path (imports pandas and the service modules)"""
+        try:
+            self.report_engine
+            self.plan_progress_service
+            self.finmap_service
+            self.alerts_service
+        except Exception as e:
+            print(f"[Services] Warm-up failed: {str(e)}")
+
+    def close(self):
+        """Release what the services hold (on app shutdown)"""
+        if self.peek('report_engine') is not None:
+            from ..services.report_engine import shutdown_pool
+            shutdown_pool()
+
+
+services = ServiceRegistry()
+
+SNAPSHOT_CACHES = (report_cache, reference_cache)
+
+
+def save_snapshot(path: str) -> int:
+    """Write usable report and reference cache entries to `path`; returns the number of entries"""
+    caches = {cache.name: cache.dump() for cache in SNAPSHOT_CACHES}
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'domain': settings.BITRIX24_DOMAIN,
+        'saved': time.time(),
+        'caches': caches
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Written aside and renamed: a crash mid-write never leaves a truncated snapshot
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as snapshot_file:
+        pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+    return sum(len(entries) for entries in caches.values())
+
+
+def load_snapshot(path: str) -> int:
+    """Load still usable entries from a snapshot of the same portal; returns the number loaded"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as snapshot_file:
+        snapshot = pickle.load(snapshot_file)
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('domain') != settings.BITRIX24_DOMAIN:
+        return 0
+    return sum(cache.load(snapshot['caches'].get(cache.name, [])) for cache in SNAPSHOT_CACHES)
@@ -0,0 +1,242 @@
+"""
+Process-local metrics in the Prometheus text format (served at /metrics).
+
+A small registry of counters, gauges and histograms with labels, enough
+to see where time and upstream quota go: route latency, Bitrix24 calls,
+pages, rows and throttle sleeps per method, Finmap calls, cache
+effectiveness and pandas time per report stage.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+from .tracing import count_upstream, span
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_labels(self.label_names, key)} {_number(value)}' for key, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {count}')
+        return lines
+
+
+class Registry:
+    """Named metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by route template', ('method', 'route', 'status')
+)
+
+bitrix_calls = registry.counter('bitrix_calls_total', 'Bitrix24 REST requests', ('method',))
+bitrix_call_duration = registry.histogram('bitrix_call_duration_seconds', 'Bitrix24 REST request latency', ('method',))
+bitrix_pages = registry.counter('bitrix_pages_total', 'Bitrix24 list pages received', ('method',))
+bitrix_rows = registry.counter('bitrix_rows_total', 'Bitrix24 entities received', ('method',))
+bitrix_errors = registry.counter('bitrix_errors_total', 'Bitrix24 error responses', ('method', 'error'))
+bitrix_throttle_seconds = registry.counter(
+    'bitrix_throttle_sleep_seconds_total', 'Seconds slept to stay within Bitrix24 rate limits', ('method',)
+)
+
+finmap_calls = registry.counter('finmap_calls_total', 'Finmap API requests', ('status',))
+finmap_call_duration = registry.histogram('finmap_call_duration_seconds', 'Finmap API request latency')
+
+cache_requests = registry.counter('cache_requests_total', 'Cache lookups by result (hit, stale, miss)', ('cache', 'result'))
+cache_evictions = registry.counter('cache_evictions_total', 'Cache entries dropped by reason (lru, expired)', ('cache', 'reason'))
+
+report_stage_duration = registry.histogram('report_stage_duration_seconds', 'pandas compute time per report stage', ('stage',))
+
+in_flight_reports = registry.gauge('report_requests_in_flight', 'Admitted report builds in progress')
+dropped_refreshes = registry.counter(
+    'report_refreshes_dropped_total', 'Background refreshes of stale reports rejected by admission control', ('status',)
+)
+live_subscribers = registry.gauge('live_subscribers', 'Open /api/live/today streams')
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route template"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        if endpoint not in self._routes:
+            paths = [route.path for route in scope['app'].routes if getattr(route, 'endpoint', None) is endpoint]
+            self._routes[endpoint] = paths[0] if paths else 'unmatched'
+        return self._routes[endpoint]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {'code': 500, 'recorded': False}
+
+        def record():
+            if not status['recorded']:
+                status['recorded'] = True
+                http_request_duration.observe(
+                    time.perf_counter() - started,
+                    method=scope['method'], route=self._route(scope), status=status['code']
+                )
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                # Streams (SSE) are measured to their first byte, not for their whole lifetime
+                if dict(message.get('headers', [])).get(b'content-type', b'').startswith(b'text/event-stream'):
+                    record()
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a report stage into its histogram and the request trace (context manager or decorator)"""
+    with report_stage_duration.time(stage=name), span(name):
+        yield
+
+
+def throttle_sleep(method: str, seconds: float):
+    """Sleep for a rate limit and account for it"""
+    if seconds > 0:
+        bitrix_throttle_seconds.inc(seconds, method=method)
+        count_upstream('bitrix', method, throttle_seconds=seconds)
+        with span('throttle_sleep'):
+            time.sleep(seconds)
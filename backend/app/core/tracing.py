@@ -0,0 +1,244 @@
+"""
+Per-request timing breakdown.
+
+While a request is handled, a Trace lives in a context variable (it follows
+the request into threadpool calls and the tasks it starts). Service stages
+open named spans: fetch_leads, fetch_deals, reference_data, finmap,
+reaction_time, the aggregation stages, endpoint and serialization. Upstream
+calls are counted per service and method.
+
+Enabled by SERVER_TIMING_ENABLED (adds a Server-Timing header) and/or
+SLOW_REQUEST_SECONDS (requests slower than that are appended to
+SLOW_REQUEST_LOG as one JSON line with their span tree and upstream calls).
+"""
+
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+from .config import settings
+
+
+class Span:
+    __slots__ = ('name', 'start', 'duration', 'children')
+
+    def __init__(self, name: str, start: float, duration: float = 0.0):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.children: List['Span'] = []
+
+    def to_dict(self) -> Dict:
+        node = {'name': self.name, 'start_ms': round(self.start * 1000, 1), 'ms': round(self.duration * 1000, 1)}
+        if self.children:
+            node['children'] = [child.to_dict() for child in self.children]
+        return node
+
+
+class Trace:
+    """Spans and upstream call counts of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.root = Span('request', 0.0)
+        self.upstream: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.endpoint_end: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def attach(self, parent: Optional[Span], span: Span):
+        with self._lock:
+            (parent or self.root).children.append(span)
+
+    def count(self, service: str, method: str, **amounts: float):
+        with self._lock:
+            entry = self.upstream.setdefault(service, {}).setdefault(method, {})
+            for name, amount in amounts.items():
+                entry[name] = entry.get(name, 0) + amount
+
+    def totals(self) -> Dict[str, float]:
+        """Seconds per span name, summed over the whole tree (first-seen order)"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            stack = list(reversed(self.root.children))
+            while stack:
+                span = stack.pop()
+                totals[span.name] = totals.get(span.name, 0.0) + span.duration
+                stack.extend(reversed(span.children))
+        return totals
+
+    def server_timing(self) -> str:
+        """Server-Timing header value"""
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.totals().items()]
+        for service, methods in self.upstream.items():
+            calls = sum(method.get('calls', 0) for method in methods.values())
+            seconds = sum(method.get('seconds', 0) for method in methods.values())
+            entries.append(f'{service};desc="{int(calls)} calls";dur={seconds * 1000:.1f}')
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'spans': [child.to_dict() for child in self.root.children],
+                'upstream': {
+                    service: {method: {k: round(v, 4) for k, v in amounts.items()} for method, amounts in methods.items()}
+                    for service, methods in self.upstream.items()
+                }
+            }
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+_parent: ContextVar[Optional[Span]] = ContextVar('trace_parent', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """Timed span of the current request (no-op outside traced requests)"""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    node = Span(name, trace.elapsed())
+    trace.attach(_parent.get(), node)
+    token = _parent.set(node)
+    try:
+        yield
+    finally:
+        node.duration = trace.elapsed() - node.start
+        _parent.reset(token)
+
+
+def add_span(name: str, seconds: float):
+    """Completed span measured elsewhere (e.g. in a worker process)"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.attach(_parent.get(), Span(name, trace.elapsed() - seconds, seconds))
+
+
+def count_upstream(service: str, method: str, **amounts: float):
+    """Add to upstream counters (calls, seconds, rows, throttle_seconds) of the current request"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.count(service, method, **amounts)
+
+
+def _timed_endpoint(call: Callable) -> Callable:
+    def finish():
+        trace = _trace.get()
+        if trace is not None:
+            trace.endpoint_end = trace.elapsed()
+
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def timed(*args, **kwargs):
+            try:
+                with span('endpoint'):
+                    return await call(*args, **kwargs)
+            finally:
+                finish()
+    else:
+        @functools.wraps(call)
+        def timed(*args, **kwargs):
+            try:
+                with span('endpoint'):
+                    return call(*args, **kwargs)
+            finally:
+                finish()
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that splits handler time into `endpoint` and `serialization` spans"""
+
+    def get_route_handler(self) -> Callable:
+        if not getattr(self.dependant.call, '_timed', False):
+            self.dependant.call = _timed_endpoint(self.dependant.call)
+            self.dependant.call._timed = True
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            response = await handler(request)
+            trace = _trace.get()
+            if trace is not None and trace.endpoint_end is not None:
+                trace.attach(None, Span('serialization', trace.endpoint_end, trace.elapsed() - trace.endpoint_end))
+            return response
+
+        return timed_handler
+
+
+_log_lock = threading.Lock()
+
+
+def write_slow_request(entry: Dict):
+    """Append one JSON line to the slow-request log"""
+    path = settings.SLOW_REQUEST_LOG
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    if not path:
+        print(f"[Slow Request] {line}")
+        return
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as log:
+                log.write(line + '\n')
+    except OSError as e:
+        print(f"[Slow Request] Could not write {path}: {str(e)}")
+
+
+class TracingMiddleware:
+    """ASGI middleware: one Trace per request, Server-Timing header and slow-request log"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        enabled = settings.SERVER_TIMING_ENABLED or settings.SLOW_REQUEST_SECONDS > 0
+        if scope['type'] != 'http' or not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        state = {'status': 500, 'stream': False}
+        token = _trace.set(trace)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+                headers = list(message.get('headers', []))
+                state['stream'] = dict(headers).get(b'content-type', b'').startswith(b'text/event-stream')
+                if settings.SERVER_TIMING_ENABLED and not state['stream']:
+                    headers.append((b'server-timing', trace.server_timing().encode()))
+                    message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _trace.reset(token)
+            duration = trace.elapsed()
+            if settings.SLOW_REQUEST_SECONDS > 0 and duration >= settings.SLOW_REQUEST_SECONDS and not state['stream']:
+                write_slow_request({
+                    'time': datetime.now().isoformat(),
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'query': scope.get('query_string', b'').decode(errors='replace'),
+                    'status': state['status'],
+                    'ms': round(duration * 1000, 1),
+                    **trace.to_dict()
+                })
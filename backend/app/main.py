@@ -1,13 +1,52 @@
-from fastapi import FastAPI
+import asyncio
+import hmac
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from .core.admission import admission
 from .core.config import settings
-from .api import reports, metrics, auth, plans, alerts
+from .core.security import require_stream_user, require_telegram_user
+from .core.services import load_snapshot, save_snapshot, services
+from .core.telemetry import MetricsMiddleware, in_flight_reports, live_subscribers, registry
+from .core.tracing import TracingMiddleware
+from .api import reports, metrics, auth, plans, alerts, webhooks, live
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm caches from the snapshot and start background work; save the snapshot on shutdown"""
+    if settings.SNAPSHOT_PATH:
+        try:
+            loaded = await run_in_threadpool(load_snapshot, settings.SNAPSHOT_PATH)
+            print(f"[Snapshot] Loaded {loaded} cache entries from {settings.SNAPSHOT_PATH}")
+        except Exception as e:
+            print(f"[Snapshot] Could not load {settings.SNAPSHOT_PATH}: {str(e)}")
+    webhooks.start_worker(on_change=live.notify)
+    alerts.start_recorder()
+    # Not awaited: the app starts serving while the service modules load
+    asyncio.get_running_loop().run_in_executor(None, services.warm_up)
+
+    yield
+
+    webhooks.stop_worker()
+    alerts.stop_recorder()
+    if settings.SNAPSHOT_PATH:
+        try:
+            saved = await run_in_threadpool(save_snapshot, settings.SNAPSHOT_PATH)
+            print(f"[Snapshot] Saved {saved} cache entries to {settings.SNAPSHOT_PATH}")
+        except Exception as e:
+            print(f"[Snapshot] Could not save {settings.SNAPSHOT_PATH}: {str(e)}")
+    services.close()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="Analytics Mini App API",
     description="Backend API for Telegram Mini App Analytics Dashboard",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -18,13 +57,20 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
-# Include routers
-app.include_router(reports.router)
-app.include_router(metrics.router)
+# Include routers (data endpoints require Telegram auth)
+authenticated = [Depends(require_telegram_user)]
+app.include_router(reports.router, dependencies=authenticated)
+app.include_router(metrics.router, dependencies=authenticated)
 app.include_router(auth.router)
-app.include_router(plans.router)
-app.include_router(alerts.router)
+app.include_router(plans.router, dependencies=authenticated)
+app.include_router(alerts.router, dependencies=authenticated)
+# EventSource cannot send headers: initData may also come as ?init_data=
+app.include_router(live.router, dependencies=[Depends(require_stream_user)])
+# Called by Bitrix24, checked with the application token
+app.include_router(webhooks.router)
 
 
 @app.get("/")
@@ -44,10 +90,24 @@ async def health_check():
         "status": "healthy",
         "bitrix24_configured": bool(settings.BITRIX24_DOMAIN),
         "finmap_configured": bool(settings.FINMAP_API_KEY),
+        "telegram_auth_enabled": settings.TELEGRAM_AUTH_ENABLED,
         "environment": settings.ENVIRONMENT
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(authorization: str = Header("")):
+    """Prometheus text exposition"""
+    expected = f"Bearer {settings.METRICS_TOKEN}"
+    if settings.METRICS_TOKEN and not hmac.compare_digest(authorization.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+    in_flight_reports.set(admission.stats()['requests_in_flight'])
+    live_hub = services.peek('live_hub')
+    live_subscribers.set(len(live_hub.subscribers) if live_hub is not None else 0)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1 +1 @@
-# Models package (for future database integration)
+# Models package (embedded database storage)
@@ -0,0 +1,236 @@
+"""
+Daily aggregate store: report engine partials persisted per day.
+
+Closed days are fetched from Bitrix24 once; every later report, alert
+evaluation or backfill over them reads these tables instead of raw rows.
+
+Per-period rollups (day, week, month; totals, per manager and per source)
+for trend series are kept up to date on every save, see services.timeseries.
+"""
+
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import pandas as pd
+
+from ..core.database import get_connection
+from ..services import timeseries
+from ..services.sketches import QuantileSketch
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS lead_counts (
+    day TEXT NOT NULL,
+    manager_id INTEGER NOT NULL,
+    source TEXT,
+    status TEXT,
+    leads INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_lead_counts_day ON lead_counts (day, manager_id);
+
+CREATE TABLE IF NOT EXISTS deal_totals (
+    day TEXT NOT NULL,
+    manager_id INTEGER NOT NULL,
+    source TEXT,
+    contract_type TEXT,
+    contracts INTEGER NOT NULL,
+    amount REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_deal_totals_day ON deal_totals (day, manager_id);
+
+CREATE TABLE IF NOT EXISTS reaction_sketches (
+    day TEXT NOT NULL,
+    manager_id INTEGER NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (day, manager_id)
+);
+
+CREATE TABLE IF NOT EXISTS synced_days (
+    day TEXT PRIMARY KEY,
+    synced_at TEXT NOT NULL
+);
+
+-- Trend series per period (services.timeseries); key '' for totals and unknown sources
+CREATE TABLE IF NOT EXISTS series_rollups (
+    grain TEXT NOT NULL,
+    period TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    leads INTEGER NOT NULL,
+    sales INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    reaction_median REAL,
+    PRIMARY KEY (grain, dimension, period, key)
+);
+
+-- Open days kept current by Bitrix24 events (see services.entity_sync)
+CREATE TABLE IF NOT EXISTS live_days (
+    day TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL
+);
+'''
+
+
+def _none(value):
+    return None if value is None or pd.isna(value) else value
+
+
+def _runs(days: List[str]) -> List[tuple]:
+    """Sorted days grouped into inclusive (start, end) runs of consecutive days"""
+    runs = []
+    for day in days:
+        if runs and (pd.Timestamp(day) - pd.Timestamp(runs[-1][1])).days == 1:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+class AggregateStore:
+    """Per-day lead counts, deal totals and reaction sketches"""
+
+    def __init__(self, live_minutes: int = 15):
+        self.live_minutes = live_minutes
+        conn = get_connection()
+        conn.executescript(SCHEMA)
+        # Stores from before rollups existed get them once
+        if conn.execute('SELECT 1 FROM lead_counts LIMIT 1').fetchone() and \
+                not conn.execute('SELECT 1 FROM series_rollups LIMIT 1').fetchone():
+            first, last = conn.execute('SELECT MIN(day), MAX(day) FROM lead_counts').fetchone()
+            self.refresh_rollups(list(pd.date_range(first, last).strftime('%Y-%m-%d')))
+
+    def synced_days(self, start_date: str, end_date: str) -> List[str]:
+        rows = get_connection().execute(
+            'SELECT day FROM synced_days WHERE day BETWEEN ? AND ? ORDER BY day', (start_date, end_date)
+        ).fetchall()
+        return [row['day'] for row in rows]
+
+    def live_days(self, start_date: str, end_date: str) -> List[str]:
+        """Open days events updated within the last `live_minutes`; older marks are polled again"""
+        fresh = (datetime.now() - timedelta(minutes=self.live_minutes)).isoformat()
+        rows = get_connection().execute(
+            'SELECT day FROM live_days WHERE day BETWEEN ? AND ? AND updated_at >= ? ORDER BY day',
+            (start_date, end_date, fresh)
+        ).fetchall()
+        return [row['day'] for row in rows]
+
+    def missing_days(self, start_date: str, end_date: str) -> List[str]:
+        """Days of the range not stored yet; today and later are missing (still open) unless kept live"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        synced = set(self.synced_days(start_date, end_date))
+        live = set(self.live_days(today, max(today, end_date)))
+        days = pd.date_range(start_date, end_date).strftime('%Y-%m-%d')
+        return [day for day in days if (day >= today and day not in live) or (day < today and day not in synced)]
+
+    def save_partial(self, partial: Dict[str, pd.DataFrame], days: List[str], live: bool = False, rollups: bool = True):
+        """
+        Replace stored aggregates of `days` with a report engine partial covering them.
+        With live=True open days are marked as kept current by events; with rollups=False
+        the caller refreshes the series rollups itself (once after many saves).
+        """
+        leads = partial.get('leads', pd.DataFrame())
+        deals = partial.get('deals', pd.DataFrame())
+        reaction = partial.get('reaction', pd.DataFrame())
+        today = datetime.now().strftime('%Y-%m-%d')
+        now = datetime.now().isoformat()
+
+        conn = get_connection()
+        with conn:
+            marks = ','.join('?' * len(days))
+            for table in ('lead_counts', 'deal_totals', 'reaction_sketches'):
+                conn.execute(f'DELETE FROM {table} WHERE day IN ({marks})', days)
+
+            conn.executemany(
+                'INSERT INTO lead_counts (day, manager_id, source, status, leads) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (row.day, int(row.ASSIGNED_BY_ID), _none(row.UTM_SOURCE), _none(row.STATUS_ID), int(row.number_of_leads))
+                    for row in leads.itertuples(index=False)
+                ]
+            )
+            conn.executemany(
+                'INSERT INTO deal_totals (day, manager_id, source, contract_type, contracts, amount) VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (row.day, int(row.ASSIGNED_BY_ID), _none(row.UTM_SOURCE), _none(row.UF_CRM_1695636781),
+                     int(row.number_of_contracts), float(row.contract_amount))
+                    for row in deals.itertuples(index=False)
+                ]
+            )
+            conn.executemany(
+                'INSERT INTO reaction_sketches (day, manager_id, sketch) VALUES (?, ?, ?)',
+                [
+                    (row.day, int(row.ASSIGNED_BY_ID), json.dumps(row.sketch.to_dict()))
+                    for row in reaction.itertuples(index=False)
+                ]
+            )
+            conn.executemany(
+                'INSERT OR REPLACE INTO synced_days (day, synced_at) VALUES (?, ?)',
+                [(day, now) for day in days if day < today]
+            )
+            if live:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO live_days (day, updated_at) VALUES (?, ?)',
+                    [(day, now) for day in days if day >= today]
+                )
+            if rollups:
+                self._refresh_rollups(days)
+
+    def refresh_rollups(self, days: List[str]):
+        """Recompute the series rollups of every period containing one of `days`"""
+        with get_connection():
+            self._refresh_rollups(days)
+
+    def _refresh_rollups(self, days: List[str]):
+        if not days:
+            return
+        periods = timeseries.affected_periods(days)
+        span = timeseries.rollup_span(periods)
+        merged = {}
+        for run_start, run_end in _runs(span):
+            for name, frame in self.load(run_start, run_end).items():
+                merged[name] = pd.concat([merged[name], frame], ignore_index=True) if name in merged else frame
+
+        conn = get_connection()
+        for grain, starts in periods.items():
+            marks = ','.join('?' * len(starts))
+            conn.execute(f'DELETE FROM series_rollups WHERE grain = ? AND period IN ({marks})', [grain] + starts)
+            conn.executemany(
+                'INSERT INTO series_rollups (grain, period, dimension, key, leads, sales, revenue, reaction_median) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(grain,) + row for row in timeseries.rollup_rows(merged, grain, starts)]
+            )
+
+    def load_rollups(self, grain: str, dimension: str, first_period: str, last_period: str) -> pd.DataFrame:
+        """Stored series rows of whole periods (see services.timeseries.period_rows)"""
+        rows = pd.read_sql_query(
+            'SELECT period, key, leads, sales, revenue, reaction_median FROM series_rollups '
+            'WHERE grain = ? AND dimension = ? AND period BETWEEN ? AND ?',
+            get_connection(), params=(grain, dimension, first_period, last_period)
+        )
+        return timeseries.parse_rollups(rows, dimension)
+
+    def load(self, start_date: str, end_date: str) -> Dict[str, pd.DataFrame]:
+        """Stored aggregates of the range in report engine (merged partials) format"""
+        conn = get_connection()
+        params = (start_date, end_date)
+        leads = pd.read_sql_query(
+            'SELECT day, manager_id AS ASSIGNED_BY_ID, source AS UTM_SOURCE, status AS STATUS_ID, '
+            'leads AS number_of_leads FROM lead_counts WHERE day BETWEEN ? AND ?', conn, params=params
+        )
+        deals = pd.read_sql_query(
+            'SELECT day, manager_id AS ASSIGNED_BY_ID, source AS UTM_SOURCE, contract_type AS UF_CRM_1695636781, '
+            'contracts AS number_of_contracts, amount AS contract_amount FROM deal_totals WHERE day BETWEEN ? AND ?',
+            conn, params=params
+        )
+        reaction = pd.read_sql_query(
+            'SELECT day, manager_id AS ASSIGNED_BY_ID, sketch FROM reaction_sketches WHERE day BETWEEN ? AND ?',
+            conn, params=params
+        )
+        reaction['sketch'] = reaction['sketch'].map(lambda raw: QuantileSketch.from_dict(json.loads(raw)))
+
+        merged = {}
+        if not leads.empty:
+            merged['leads'] = leads
+        if not deals.empty:
+            merged['deals'] = deals
+        merged['reaction'] = reaction
+        return merged
@@ -0,0 +1,64 @@
+"""
+Alert history: every evaluated day's alerts with manager ID and timestamp.
+"""
+
+from typing import Dict, List, Optional
+
+from ..core.database import get_connection
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    period TEXT NOT NULL,
+    type TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    value REAL,
+    threshold REAL,
+    manager_id INTEGER,
+    manager_name TEXT,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_alerts_period ON alerts (period, severity);
+CREATE INDEX IF NOT EXISTS ix_alerts_manager ON alerts (manager_id, period);
+'''
+
+COLUMNS = ['period', 'type', 'severity', 'title', 'description', 'value', 'threshold', 'manager_id', 'manager_name', 'timestamp']
+
+
+class AlertStore:
+    """Persisted alert records indexed by period, severity and manager"""
+
+    def __init__(self):
+        get_connection().executescript(SCHEMA)
+
+    def save(self, alerts: List[Dict], periods: List[str]):
+        """Replace stored alerts of `periods` (re-evaluating a day is idempotent)"""
+        conn = get_connection()
+        with conn:
+            marks = ','.join('?' * len(periods))
+            conn.execute(f'DELETE FROM alerts WHERE period IN ({marks})', periods)
+            conn.executemany(
+                f'INSERT INTO alerts ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})',
+                [tuple(alert.get(column) for column in COLUMNS) for alert in alerts if alert.get('period') in periods]
+            )
+
+    def query(
+        self,
+        start_date: str,
+        end_date: str,
+        manager_id: Optional[int] = None,
+        severity: Optional[str] = None
+    ) -> List[Dict]:
+        """Alerts of the range, newest period first"""
+        sql = f'SELECT id, {", ".join(COLUMNS)} FROM alerts WHERE period BETWEEN ? AND ?'
+        params: list = [start_date, end_date]
+        if manager_id is not None:
+            sql += ' AND manager_id = ?'
+            params.append(manager_id)
+        if severity:
+            sql += ' AND severity = ?'
+            params.append(severity)
+        sql += ' ORDER BY period DESC, id'
+        return [dict(row) for row in get_connection().execute(sql, params).fetchall()]
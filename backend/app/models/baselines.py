@@ -0,0 +1,50 @@
+"""
+Rolling baselines: EWMA mean/variance per (metric, key, weekday).
+
+One row per series; updating it with a new day is O(1) and evaluating a
+day reads only the rows of its weekday, however much history exists. The
+state before the last update is kept so a day can be re-evaluated
+idempotently.
+"""
+
+from typing import Dict, List, Tuple
+
+from ..core.database import get_connection
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS baselines (
+    metric TEXT NOT NULL,
+    key TEXT NOT NULL,
+    weekday INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    var REAL NOT NULL,
+    n INTEGER NOT NULL,
+    last_day TEXT NOT NULL,
+    prev_mean REAL,
+    prev_var REAL,
+    prev_n INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, key, weekday)
+);
+'''
+
+COLUMNS = ['metric', 'key', 'weekday', 'mean', 'var', 'n', 'last_day', 'prev_mean', 'prev_var', 'prev_n']
+
+
+class BaselineStore:
+    """Persisted EWMA state of every (metric, key, weekday) series"""
+
+    def __init__(self):
+        get_connection().executescript(SCHEMA)
+
+    def get_weekday(self, weekday: int) -> Dict[Tuple[str, str], Dict]:
+        """All series states of one weekday keyed by (metric, key)"""
+        rows = get_connection().execute('SELECT * FROM baselines WHERE weekday = ?', (weekday,)).fetchall()
+        return {(row['metric'], row['key']): dict(row) for row in rows}
+
+    def upsert(self, states: List[Dict]):
+        conn = get_connection()
+        with conn:
+            conn.executemany(
+                f'INSERT OR REPLACE INTO baselines ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})',
+                [tuple(state[column] for column in COLUMNS) for state in states]
+            )
@@ -0,0 +1,246 @@
+"""
+Local mirror of Bitrix24 leads and deals.
+
+Rows are upserted from Bitrix24 events. A day is "mirrored" once all its
+entities were fetched in one go; from then on events keep it complete and
+its daily aggregates can be recomputed locally without a range fetch.
+Days downloaded by the report sync are mirrored as they are fetched.
+
+Deals keep the lead they were converted from (LEAD_ID, indexed), which
+links every lead to its won deals for cohort conversion.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Set
+
+import pandas as pd
+
+from ..core.database import get_connection
+from ..services.schema import DEAL_DTYPES, LEAD_DTYPES, apply_schema
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS crm_leads (
+    id INTEGER PRIMARY KEY,
+    assigned_by_id INTEGER,
+    status_id TEXT,
+    utm_source TEXT,
+    date_create TEXT,
+    taken_in_work TEXT,
+    day TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_crm_leads_day ON crm_leads (day);
+
+CREATE TABLE IF NOT EXISTS crm_deals (
+    id INTEGER PRIMARY KEY,
+    assigned_by_id INTEGER,
+    opportunity REAL,
+    closedate TEXT,
+    utm_source TEXT,
+    contract_type TEXT,
+    lead_id INTEGER,
+    stage_id TEXT,
+    category_id INTEGER,
+    day TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_crm_deals_day ON crm_deals (day);
+CREATE INDEX IF NOT EXISTS ix_crm_deals_lead ON crm_deals (lead_id);
+
+CREATE TABLE IF NOT EXISTS mirrored_days (
+    kind TEXT NOT NULL,
+    day TEXT NOT NULL,
+    mirrored_at TEXT NOT NULL,
+    PRIMARY KEY (kind, day)
+);
+'''
+
+# Table column -> frame column
+LEAD_COLUMNS = {
+    'id': 'ID',
+    'assigned_by_id': 'ASSIGNED_BY_ID',
+    'status_id': 'STATUS_ID',
+    'utm_source': 'UTM_SOURCE',
+    'date_create': 'DATE_CREATE',
+    'taken_in_work': 'UF_CRM_1745414446',
+}
+
+DEAL_COLUMNS = {
+    'id': 'ID',
+    'assigned_by_id': 'ASSIGNED_BY_ID',
+    'opportunity': 'OPPORTUNITY',
+    'closedate': 'CLOSEDATE',
+    'utm_source': 'UTM_SOURCE',
+    'contract_type': 'UF_CRM_1695636781',
+    'lead_id': 'LEAD_ID',
+    'stage_id': 'STAGE_ID',
+    'category_id': 'CATEGORY_ID',
+}
+
+# Deals counted in sales reports (see SalesService.get_deals_data)
+REPORT_DEALS = "stage_id = 'WON' AND category_id = 0"
+
+
+def _value(value):
+    if value is None or value is pd.NaT or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _day(series: pd.Series) -> pd.Series:
+    return series.dt.strftime('%Y-%m-%d')
+
+
+class EntityStore:
+    """Leads and deals by ID with their report day (DATE_CREATE / CLOSEDATE)"""
+
+    def __init__(self):
+        get_connection().executescript(SCHEMA)
+
+    def _days_of(self, table: str, ids: List[int]) -> Set[str]:
+        if not ids:
+            return set()
+        marks = ','.join('?' * len(ids))
+        rows = get_connection().execute(
+            f'SELECT DISTINCT day FROM {table} WHERE id IN ({marks}) AND day IS NOT NULL', ids
+        ).fetchall()
+        return {row['day'] for row in rows}
+
+    def _upsert(self, table: str, columns: Dict[str, str], df: pd.DataFrame, day: pd.Series):
+        names = list(columns) + ['day', 'updated_at']
+        now = datetime.now().isoformat()
+        frame = df.reindex(columns=list(columns.values()))
+        rows = [
+            tuple(_value(value) for value in values) + (row_day if isinstance(row_day, str) else None, now)
+            for values, row_day in zip(frame.itertuples(index=False, name=None), day)
+        ]
+        conn = get_connection()
+        with conn:
+            conn.executemany(
+                f'INSERT OR REPLACE INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})',
+                rows
+            )
+
+    def upsert_leads(self, leads_df: pd.DataFrame) -> Set[str]:
+        """Store typed leads; returns days affected (old and new day of every lead)"""
+        if leads_df.empty:
+            return set()
+        days = _day(leads_df['DATE_CREATE'])
+        affected = self._days_of('crm_leads', leads_df['ID'].tolist()) | set(days.dropna())
+        self._upsert('crm_leads', LEAD_COLUMNS, leads_df, days)
+        return affected
+
+    def upsert_deals(self, deals_df: pd.DataFrame) -> Set[str]:
+        """Store typed deals; returns days affected (old and new close day of every deal)"""
+        if deals_df.empty:
+            return set()
+        days = _day(deals_df['CLOSEDATE'])
+        affected = self._days_of('crm_deals', deals_df['ID'].tolist()) | set(days.dropna())
+        self._upsert('crm_deals', DEAL_COLUMNS, deals_df, days)
+        return affected
+
+    def replace_day(self, kind: str, day: str, df: pd.DataFrame):
+        """Replace all entities of a day with a complete fetch and mark it mirrored"""
+        self.replace_days(kind, [day], df)
+
+    def replace_days(self, kind: str, days: List[str], df: pd.DataFrame):
+        """Replace all entities of `days` with a complete fetch covering them and mark them mirrored"""
+        if not days:
+            return
+        table = 'crm_leads' if kind == 'lead' else 'crm_deals'
+        marks = ','.join('?' * len(days))
+        conn = get_connection()
+        with conn:
+            conn.execute(f'DELETE FROM {table} WHERE day IN ({marks})', days)
+        if kind == 'lead':
+            self.upsert_leads(df)
+        else:
+            self.upsert_deals(df)
+        now = datetime.now().isoformat()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO mirrored_days (kind, day, mirrored_at) VALUES (?, ?, ?)',
+                [(kind, day, now) for day in days]
+            )
+
+    def mirror_report_frames(self, days: List[str], leads_df: pd.DataFrame, deals_df: pd.DataFrame, category_id: int = 0):
+        """Mirror complete days fetched for reports (LeadsService.get_leads_data, SalesService.get_deals_data)"""
+        self.replace_days('lead', days, leads_df.rename(columns={'taken_in_work': 'UF_CRM_1745414446'}))
+        self.replace_days('deal', days, deals_df.assign(STAGE_ID='WON', CATEGORY_ID=category_id))
+
+    def mirrored_days(self, kind: str, days: Iterable[str]) -> Set[str]:
+        days = list(days)
+        if not days:
+            return set()
+        marks = ','.join('?' * len(days))
+        rows = get_connection().execute(
+            f'SELECT day FROM mirrored_days WHERE kind = ? AND day IN ({marks})', [kind] + days
+        ).fetchall()
+        return {row['day'] for row in rows}
+
+    def mirrored_range(self, kind: str, start_date: str, end_date: str) -> Set[str]:
+        rows = get_connection().execute(
+            'SELECT day FROM mirrored_days WHERE kind = ? AND day BETWEEN ? AND ?', (kind, start_date, end_date)
+        ).fetchall()
+        return {row['day'] for row in rows}
+
+    def _frame(self, sql: str, params: list, columns: Dict[str, str], dtypes: Dict[str, str]) -> pd.DataFrame:
+        df = pd.read_sql_query(sql, get_connection(), params=params)
+        if df.empty:
+            return pd.DataFrame()
+        return apply_schema(df.rename(columns=columns), dtypes)
+
+    def leads_frame(self, days: List[str]) -> pd.DataFrame:
+        """Leads of the days in the format of LeadsService.get_leads_data(reaction_time=False)"""
+        marks = ','.join('?' * len(days))
+        df = self._frame(
+            f'SELECT {", ".join(LEAD_COLUMNS)} FROM crm_leads WHERE day IN ({marks})',
+            list(days), LEAD_COLUMNS, LEAD_DTYPES
+        )
+        return df.rename(columns={'UF_CRM_1745414446': 'taken_in_work'})
+
+    def deals_frame(self, days: List[str]) -> pd.DataFrame:
+        """Report deals (won, main pipeline) of the days in the format of SalesService.get_deals_data"""
+        marks = ','.join('?' * len(days))
+        columns = {column: name for column, name in DEAL_COLUMNS.items() if name in DEAL_DTYPES}
+        return self._frame(
+            f'SELECT {", ".join(columns)} FROM crm_deals WHERE day IN ({marks}) AND {REPORT_DEALS}',
+            list(days), columns, DEAL_DTYPES
+        )
+
+    def day_counts(self, day: str) -> Dict[int, Dict]:
+        """Per-manager leads, report deals and revenue of one day"""
+        conn = get_connection()
+        counts: Dict[int, Dict] = {}
+        for row in conn.execute('SELECT assigned_by_id, COUNT(*) AS leads FROM crm_leads WHERE day = ? GROUP BY 1', (day,)):
+            counts[row['assigned_by_id']] = {'leads': row['leads'], 'deals': 0, 'revenue': 0.0}
+        for row in conn.execute(
+            f'SELECT assigned_by_id, COUNT(*) AS deals, SUM(opportunity) AS revenue FROM crm_deals '
+            f'WHERE day = ? AND {REPORT_DEALS} GROUP BY 1', (day,)
+        ):
+            entry = counts.setdefault(row['assigned_by_id'], {'leads': 0, 'deals': 0, 'revenue': 0.0})
+            entry['deals'] = row['deals']
+            entry['revenue'] = row['revenue'] or 0.0
+        return counts
+
+    def recent_taken(self, day: str, limit: int = 10) -> List[Dict]:
+        """Leads of the day most recently taken in work"""
+        rows = get_connection().execute(
+            'SELECT id, assigned_by_id, date_create, taken_in_work FROM crm_leads '
+            'WHERE day = ? AND taken_in_work IS NOT NULL ORDER BY taken_in_work DESC LIMIT ?', (day, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def lead_outcomes(self, start_date: str, end_date: str) -> pd.DataFrame:
+        """Leads created in the range with their won deals: first close, number of deals and revenue"""
+        return pd.read_sql_query(
+            'SELECT l.id, l.day, l.assigned_by_id, l.utm_source, l.date_create, '
+            'MIN(d.closedate) AS first_close, COUNT(d.id) AS deals, COALESCE(SUM(d.opportunity), 0) AS revenue '
+            'FROM crm_leads l '
+            # Report deals only (REPORT_DEALS)
+            "LEFT JOIN crm_deals d ON d.lead_id = l.id AND d.stage_id = 'WON' AND d.category_id = 0 "
+            'WHERE l.day BETWEEN ? AND ? GROUP BY l.id',
+            get_connection(), params=(start_date, end_date)
+        )
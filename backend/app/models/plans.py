@@ -0,0 +1,137 @@
+"""
+Plans: sales targets per manager, metric and period.
+
+A plan is unique by (manager_id, metric_type, period_type, start_date,
+end_date), so importing a team's monthly targets again updates them in
+place. Plans active on a day are found through the (end_date, start_date)
+index: plans that already ended are never scanned.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ..core.database import get_connection
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    manager_id INTEGER NOT NULL,
+    metric_type TEXT NOT NULL,
+    period_type TEXT NOT NULL,
+    target_value REAL NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    UNIQUE (manager_id, metric_type, period_type, start_date, end_date)
+);
+CREATE INDEX IF NOT EXISTS ix_plans_manager ON plans (manager_id, period_type, start_date, end_date);
+CREATE INDEX IF NOT EXISTS ix_plans_active ON plans (end_date, start_date);
+'''
+
+COLUMNS = ['id', 'manager_id', 'metric_type', 'period_type', 'target_value', 'start_date', 'end_date', 'created_at', 'updated_at']
+
+UPSERT = '''
+INSERT INTO plans (manager_id, metric_type, period_type, target_value, start_date, end_date, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (manager_id, metric_type, period_type, start_date, end_date)
+DO UPDATE SET target_value = excluded.target_value, updated_at = excluded.created_at
+'''
+
+INSERT = '''
+INSERT INTO plans (manager_id, metric_type, period_type, target_value, start_date, end_date, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (manager_id, metric_type, period_type, start_date, end_date) DO NOTHING
+'''
+
+KEY = ['manager_id', 'metric_type', 'period_type', 'start_date', 'end_date']
+
+
+class PlanStore:
+    """Persisted plans indexed by manager, period type and date range"""
+
+    def __init__(self):
+        get_connection().executescript(SCHEMA)
+
+    def get(self, plan_id: int) -> Optional[Dict]:
+        row = get_connection().execute(f'SELECT {", ".join(COLUMNS)} FROM plans WHERE id = ?', (plan_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find(
+        self,
+        manager_id: Optional[int] = None,
+        period_type: Optional[str] = None,
+        metric_type: Optional[str] = None,
+        active_on: Optional[str] = None
+    ) -> List[Dict]:
+        """Plans matching all given filters; active_on is a YYYY-MM-DD day"""
+        sql = f'SELECT {", ".join(COLUMNS)} FROM plans WHERE 1 = 1'
+        params: list = []
+        if manager_id is not None:
+            sql += ' AND manager_id = ?'
+            params.append(manager_id)
+        if period_type:
+            sql += ' AND period_type = ?'
+            params.append(period_type)
+        if metric_type:
+            sql += ' AND metric_type = ?'
+            params.append(metric_type)
+        if active_on:
+            sql += ' AND end_date >= ? AND start_date <= ?'
+            params.extend([active_on, active_on])
+        sql += ' ORDER BY start_date, manager_id, id'
+        return [dict(row) for row in get_connection().execute(sql, params).fetchall()]
+
+    def find_by_key(self, plan: Dict) -> Optional[Dict]:
+        """Stored plan with the unique key (KEY) of `plan`"""
+        row = get_connection().execute(
+            f'SELECT {", ".join(COLUMNS)} FROM plans WHERE {" AND ".join(f"{column} = ?" for column in KEY)}',
+            (int(plan['manager_id']), plan['metric_type'], plan['period_type'], plan['start_date'], plan['end_date'])
+        ).fetchone()
+        return dict(row) if row else None
+
+    def create(self, plan: Dict) -> Optional[Dict]:
+        """Insert a plan; None if one with the same key already exists"""
+        conn = get_connection()
+        with conn:
+            cursor = conn.execute(INSERT, (
+                int(plan['manager_id']), plan['metric_type'], plan['period_type'], float(plan['target_value']),
+                plan['start_date'], plan['end_date'], datetime.now().isoformat()
+            ))
+        return self.get(cursor.lastrowid) if cursor.rowcount else None
+
+    def upsert_many(self, plans: List[Dict]) -> List[Dict]:
+        """Insert plans or update targets of existing ones, in one transaction"""
+        if not plans:
+            return []
+        now = datetime.now().isoformat()
+        conn = get_connection()
+        with conn:
+            conn.executemany(UPSERT, [
+                (int(plan['manager_id']), plan['metric_type'], plan['period_type'], float(plan['target_value']),
+                 plan['start_date'], plan['end_date'], now)
+                for plan in plans
+            ])
+            rows = [
+                conn.execute(
+                    f'SELECT {", ".join(COLUMNS)} FROM plans WHERE {" AND ".join(f"{column} = ?" for column in KEY)}',
+                    (int(plan['manager_id']), plan['metric_type'], plan['period_type'], plan['start_date'], plan['end_date'])
+                ).fetchone()
+                for plan in plans
+            ]
+        return [dict(row) for row in rows]
+
+    def update_target(self, plan_id: int, target_value: float) -> Optional[Dict]:
+        conn = get_connection()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE plans SET target_value = ?, updated_at = ? WHERE id = ?',
+                (target_value, datetime.now().isoformat(), plan_id)
+            )
+        return self.get(plan_id) if cursor.rowcount else None
+
+    def delete(self, plan_id: int) -> bool:
+        conn = get_connection()
+        with conn:
+            cursor = conn.execute('DELETE FROM plans WHERE id = ?', (plan_id,))
+        return bool(cursor.rowcount)
@@ -0,0 +1,111 @@
+"""
+Local copy of Bitrix24 stage history (crm.stagehistory.list) of leads and deals.
+
+One row per transition: an entity entering a status (leads) or stage
+(deals) at a moment, stored as unix seconds so stays are integer
+arithmetic. History records never change and their IDs only grow, so
+ingestion is incremental: the highest stored ID of each kind is its
+watermark, and a sync asks Bitrix24 only for records above it.
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+
+from ..core.database import get_connection
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stage_transitions (
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    owner_id INTEGER NOT NULL,
+    type_id INTEGER NOT NULL,
+    category_id INTEGER,
+    stage TEXT NOT NULL,
+    semantic TEXT,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (kind, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_stage_transitions_time ON stage_transitions (kind, created_at);
+CREATE INDEX IF NOT EXISTS ix_stage_transitions_owner ON stage_transitions (kind, owner_id, created_at);
+
+CREATE TABLE IF NOT EXISTS stage_watermarks (
+    kind TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    synced_at TEXT NOT NULL
+);
+'''
+
+COLUMNS = ['id', 'owner_id', 'type_id', 'category_id', 'stage', 'semantic', 'created_at']
+
+# Entity table of each kind (see EntityStore), for the current manager of an owner
+ENTITY_TABLES = {'lead': 'crm_leads', 'deal': 'crm_deals'}
+
+
+class StageHistoryStore:
+    """Stage transitions of leads and deals with a per-kind ingestion watermark"""
+
+    def __init__(self):
+        get_connection().executescript(SCHEMA)
+
+    def watermark(self, kind: str) -> int:
+        """Highest stored history record ID of the kind, 0 before the first sync"""
+        row = get_connection().execute('SELECT last_id FROM stage_watermarks WHERE kind = ?', (kind,)).fetchone()
+        return row['last_id'] if row else 0
+
+    def synced_at(self, kind: str) -> Optional[str]:
+        row = get_connection().execute('SELECT synced_at FROM stage_watermarks WHERE kind = ?', (kind,)).fetchone()
+        return row['synced_at'] if row else None
+
+    def append(self, kind: str, transitions: pd.DataFrame) -> int:
+        """Store transitions (COLUMNS) and move the watermark to their highest ID; returns rows stored"""
+        conn = get_connection()
+        now = datetime.now().isoformat()
+        with conn:
+            if not transitions.empty:
+                conn.executemany(
+                    f'INSERT OR IGNORE INTO stage_transitions (kind, {", ".join(COLUMNS)}) '
+                    f'VALUES (?, {", ".join("?" * len(COLUMNS))})',
+                    list(zip([kind] * len(transitions), *(transitions[column].tolist() for column in COLUMNS)))
+                )
+            last_id = int(transitions['id'].max()) if not transitions.empty else 0
+            conn.execute(
+                'INSERT INTO stage_watermarks (kind, last_id, synced_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (kind) DO UPDATE SET last_id = MAX(last_id, excluded.last_id), synced_at = excluded.synced_at',
+                (kind, last_id, now)
+            )
+        return len(transitions)
+
+    def _scope(self, kind: str, start_ts: int, end_ts: int) -> tuple:
+        # Owners with a transition in the range, and their transitions from the last one before it on
+        sql = ('t.kind = ? AND t.created_at >= (SELECT COALESCE(MAX(p.created_at), ?) FROM stage_transitions p '
+               'WHERE p.kind = t.kind AND p.owner_id = t.owner_id AND p.created_at < ?) AND t.owner_id IN '
+               '(SELECT owner_id FROM stage_transitions WHERE kind = ? AND created_at >= ? AND created_at < ?)')
+        return sql, [kind, start_ts, start_ts, kind, start_ts, end_ts]
+
+    def transitions(self, kind: str, start_ts: int, end_ts: int, managers: bool = False) -> pd.DataFrame:
+        """
+        Transitions from `start_ts` on of every owner that moved in [start_ts, end_ts), after the
+        owner's last one before `start_ts` (its stage when the range began), ordered by owner and
+        time; with `managers`, each owner's current manager from the entity mirror
+        """
+        where, params = self._scope(kind, start_ts, end_ts)
+        join = ''
+        columns = 't.owner_id, t.stage, t.semantic, t.created_at'
+        if managers:
+            join = f' LEFT JOIN {ENTITY_TABLES[kind]} e ON e.id = t.owner_id'
+            columns += ', e.assigned_by_id AS manager_id'
+        return pd.read_sql_query(
+            f'SELECT {columns} FROM stage_transitions t{join} WHERE {where} ORDER BY t.owner_id, t.created_at, t.id',
+            get_connection(), params=params
+        )
+
+    def unknown_owners(self, kind: str, start_ts: int, end_ts: int) -> List[int]:
+        """Owners that moved in the range but are not in the entity mirror"""
+        where, params = self._scope(kind, start_ts, end_ts)
+        rows = get_connection().execute(
+            f'SELECT DISTINCT t.owner_id FROM stage_transitions t LEFT JOIN {ENTITY_TABLES[kind]} e '
+            f'ON e.id = t.owner_id WHERE {where} AND e.id IS NULL', params
+        ).fetchall()
+        return [row['owner_id'] for row in rows]
@@ -1,6 +1,8 @@
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import datetime
 from typing import Dict, List, Optional
 from enum import Enum
+import numpy as np
 import pandas as pd
 
 
@@ -16,6 +18,10 @@ class AlertType(str, Enum):
     SLOW_REACTION = "slow_reaction"
     NO_SALES = "no_sales"
     PLAN_MISS = "plan_miss"
+    LEADS_ANOMALY = "leads_anomaly"
+    CONVERSION_ANOMALY = "conversion_anomaly"
+    REACTION_ANOMALY = "reaction_anomaly"
+    REVENUE_ANOMALY = "revenue_anomaly"
 
 
 class Alert:
@@ -27,7 +33,9 @@ class Alert:
         description: str,
         value: float = None,
         threshold: float = None,
-        manager_name: str = None
+        manager_name: str = None,
+        manager_id: int = None,
+        period: str = None
     ):
         self.type = alert_type
         self.severity = severity
@@ -36,6 +44,8 @@ class Alert:
         self.value = value
         self.threshold = threshold
         self.manager_name = manager_name
+        self.manager_id = manager_id
+        self.period = period
         self.timestamp = datetime.now().isoformat()
 
     def to_dict(self) -> Dict:
@@ -47,151 +57,343 @@ class Alert:
             'value': self.value,
             'threshold': self.threshold,
             'manager_name': self.manager_name,
+            'manager_id': self.manager_id,
+            'period': self.period,
             'timestamp': self.timestamp
         }
 
 
-class AlertsService:
-    """Service for generating alerts based on metrics"""
-
-    # Thresholds configuration
-    THRESHOLDS = {
-        'conversion_drop_pct': 15,  # CR% drop by 15%
-        'low_leads_pct': -20,  # 20% fewer leads
-        'slow_reaction_seconds': 1200,  # > 20 minutes
-        'plan_miss_pct': -10,  # Plan miss by 10%
-        'min_conversion': 10.0,  # Minimum acceptable CR%
-    }
+@dataclass(frozen=True)
+class Rule:
+    """
+    Declarative alert rule: fires where `metric` compared with `threshold`
+    (times `threshold_sign`) holds. Title and description are formatted with
+    the evaluated row (all frame columns plus value/threshold helpers).
+    Past the `critical` threshold, if given, the alert is critical.
+    """
+    alert_type: AlertType
+    severity: AlertSeverity
+    metric: str
+    op: str  # 'lt' or 'gt'
+    threshold: str
+    title: str
+    description: str
+    threshold_sign: int = 1
+    critical: Optional[str] = None
+
+
+# Rules evaluated per manager and period
+MANAGER_RULES = [
+    Rule(
+        alert_type=AlertType.CONVERSION_DROP,
+        severity=AlertSeverity.CRITICAL,
+        metric='CR%',
+        op='lt',
+        threshold='min_conversion',
+        title="Критично низька конверсія",
+        description="{manager_name}: CR% = {value:.2f}% (поріг: {threshold}%)"
+    ),
+    Rule(
+        alert_type=AlertType.CONVERSION_DROP,
+        severity=AlertSeverity.WARNING,
+        metric='cr_change_pct',
+        op='lt',
+        threshold='conversion_drop_pct',
+        threshold_sign=-1,
+        title="Падіння конверсії",
+        description="{manager_name}: CR% впав на {abs_value:.1f}% (було {prev_cr:.2f}%, стало {cr:.2f}%)"
+    ),
+    Rule(
+        alert_type=AlertType.SLOW_REACTION,
+        severity=AlertSeverity.WARNING,
+        metric='reaction_seconds',
+        op='gt',
+        threshold='slow_reaction_seconds',
+        title="Повільна реакція",
+        description="{manager_name}: середній час реакції {hours:02d}:{minutes:02d} (поріг: {threshold_minutes:.0f} хв)"
+    ),
+]
+
+# Rules evaluated per period for the whole department
+DEPARTMENT_RULES = [
+    Rule(
+        alert_type=AlertType.LOW_LEADS,
+        severity=AlertSeverity.WARNING,
+        metric='leads_change_pct',
+        op='lt',
+        threshold='low_leads_pct',
+        title="Зниження кількості лідів",
+        description="Лідів на {abs_value:.1f}% менше ніж вчора (було {prev_total_leads:.0f}, стало {total_leads:.0f})"
+    ),
+    Rule(
+        alert_type=AlertType.NO_SALES,
+        severity=AlertSeverity.CRITICAL,
+        metric='total_contracts',
+        op='lt',
+        threshold='min_contracts',
+        title="Немає продажів",
+        description="За вчорашній день не було жодної продажі!"
+    ),
+]
+
+# Rules evaluated per plan (actual vs expected to date, see services.plan_progress)
+PLAN_RULES = [
+    Rule(
+        alert_type=AlertType.PLAN_MISS,
+        severity=AlertSeverity.WARNING,
+        metric='deviation_pct',
+        op='lt',
+        threshold='plan_miss_pct',
+        critical='plan_critical_pct',
+        title="План не виконано: {metric_name}",
+        description="План: {planned:.0f}, Факт: {actual:.0f} ({value:+.1f}%)"
+    ),
+]
+
+
+class ThresholdTable:
+    """Alert thresholds with per-team and per-manager overrides (manager > team > default)"""
+
+    def __init__(self, defaults: Dict[str, float], managers: Dict = None, teams: Dict = None, team_members: Dict = None):
+        self.defaults = dict(defaults)
+        self.managers = {int(manager_id): values for manager_id, values in (managers or {}).items()}
+        self.teams = teams or {}
+        self.team_of = {
+            int(manager_id): team
+            for team, members in (team_members or {}).items()
+            for manager_id in members
+        }
 
-    def __init__(self):
-        self.alerts: List[Alert] = []
+    @staticmethod
+    def _apply(table: pd.DataFrame, manager_id: int, overrides: Dict):
+        for key, value in overrides.items():
+            if key in table.columns:
+                table.at[manager_id, key] = float(value)
+
+    def for_managers(self, manager_ids) -> pd.DataFrame:
+        """Threshold frame indexed by manager ID (one column per threshold)"""
+        index = pd.Index(pd.unique(np.asarray(manager_ids, dtype='int64')), name='ASSIGNED_BY_ID')
+        table = pd.DataFrame({key: float(value) for key, value in self.defaults.items()}, index=index)
+
+        for manager_id, team in self.team_of.items():
+            if manager_id in index and team in self.teams:
+                self._apply(table, manager_id, self.teams[team])
+        for manager_id, overrides in self.managers.items():
+            if manager_id in index:
+                self._apply(table, manager_id, overrides)
+        return table
+
+
+def _change_pct(current: pd.Series, previous: pd.Series) -> pd.Series:
+    """Percentage change, NaN where previous is missing or zero"""
+    previous = previous.where(previous > 0)
+    return (current - previous) / previous * 100
+
+
+class RuleEngine:
+    """Evaluates declarative rules over period-by-manager frames in one pass"""
+
+    def __init__(self, thresholds: ThresholdTable, manager_rules: List[Rule] = None,
+                 department_rules: List[Rule] = None, plan_rules: List[Rule] = None):
+        self.thresholds = thresholds
+        self.manager_rules = MANAGER_RULES if manager_rules is None else manager_rules
+        self.department_rules = DEPARTMENT_RULES if department_rules is None else department_rules
+        self.plan_rules = PLAN_RULES if plan_rules is None else plan_rules
+
+    @staticmethod
+    def _previous_periods(periods: pd.Series) -> pd.Series:
+        ordered = sorted(periods.unique())
+        return periods.map(dict(zip(ordered[1:], ordered[:-1]))).astype(object)
+
+    def _fire(self, rule: Rule, frame: pd.DataFrame) -> List[Alert]:
+        limit = frame[rule.threshold] * rule.threshold_sign
+        values = frame[rule.metric]
+        mask = values < limit if rule.op == 'lt' else values > limit
+        hits = frame[mask.fillna(False)]
 
-    def check_conversion_alerts(self, current_metrics: List[Dict], previous_metrics: List[Dict] = None) -> List[Alert]:
-        """Check for conversion rate issues"""
         alerts = []
-
-        for manager in current_metrics:
-            cr = manager.get('CR%', 0)
-            manager_name = manager.get('FULL_NAME', 'Unknown')
-
-            # Critical: Very low conversion
-            if cr < self.THRESHOLDS['min_conversion']:
-                alerts.append(Alert(
-                    alert_type=AlertType.CONVERSION_DROP,
-                    severity=AlertSeverity.CRITICAL,
-                    title=f"Критично низька конверсія",
-                    description=f"{manager_name}: CR% = {cr:.2f}% (поріг: {self.THRESHOLDS['min_conversion']}%)",
-                    value=cr,
-                    threshold=self.THRESHOLDS['min_conversion'],
-                    manager_name=manager_name
-                ))
-
-            # Warning: Conversion drop compared to previous period
-            if previous_metrics:
-                prev_manager = next((m for m in previous_metrics if m.get('FULL_NAME') == manager_name), None)
-                if prev_manager:
-                    prev_cr = prev_manager.get('CR%', 0)
-                    if prev_cr > 0:
-                        drop_pct = ((cr - prev_cr) / prev_cr) * 100
-                        if drop_pct < -self.THRESHOLDS['conversion_drop_pct']:
-                            alerts.append(Alert(
-                                alert_type=AlertType.CONVERSION_DROP,
-                                severity=AlertSeverity.WARNING,
-                                title=f"Падіння конверсії",
-                                description=f"{manager_name}: CR% впав на {abs(drop_pct):.1f}% (було {prev_cr:.2f}%, стало {cr:.2f}%)",
-                                value=drop_pct,
-                                threshold=-self.THRESHOLDS['conversion_drop_pct'],
-                                manager_name=manager_name
-                            ))
-
+        for row in hits.to_dict('records'):
+            value = float(row[rule.metric])
+            threshold = float(row[rule.threshold]) * rule.threshold_sign
+            seconds = row.get('reaction_seconds')
+            seconds = 0 if seconds is None or pd.isna(seconds) else seconds
+            context = dict(
+                row,
+                value=value,
+                abs_value=abs(value),
+                threshold=row[rule.threshold],
+                hours=int(seconds // 3600),
+                minutes=int((seconds % 3600) // 60),
+                threshold_minutes=row.get('slow_reaction_seconds', 0) / 60,
+            )
+            severity = rule.severity
+            if rule.critical is not None:
+                critical = float(row[rule.critical])
+                if (value <= critical) if rule.op == 'lt' else (value >= critical):
+                    severity = AlertSeverity.CRITICAL
+            manager_id = row.get('ASSIGNED_BY_ID')
+            alerts.append(Alert(
+                alert_type=rule.alert_type,
+                severity=severity,
+                title=rule.title.format(**context),
+                description=rule.description.format(**context),
+                value=value,
+                threshold=threshold,
+                manager_name=row.get('manager_name'),
+                manager_id=int(manager_id) if manager_id is not None else None,
+                period=row.get('period')
+            ))
         return alerts
 
-    def check_reaction_time_alerts(self, metrics: List[Dict]) -> List[Alert]:
-        """Check for slow reaction time"""
-        alerts = []
-
-        for manager in metrics:
-            reaction_time = manager.get('time_taken_in_work')
-            manager_name = manager.get('FULL_NAME', 'Unknown')
-
-            if reaction_time and not pd.isna(reaction_time):
-                # Convert timedelta to seconds
-                if isinstance(reaction_time, pd.Timedelta):
-                    reaction_seconds = reaction_time.total_seconds()
-                elif isinstance(reaction_time, timedelta):
-                    reaction_seconds = reaction_time.total_seconds()
-                else:
-                    continue
-
-                if reaction_seconds > self.THRESHOLDS['slow_reaction_seconds']:
-                    hours = int(reaction_seconds // 3600)
-                    minutes = int((reaction_seconds % 3600) // 60)
-
-                    alerts.append(Alert(
-                        alert_type=AlertType.SLOW_REACTION,
-                        severity=AlertSeverity.WARNING,
-                        title=f"Повільна реакція",
-                        description=f"{manager_name}: середній час реакції {hours:02d}:{minutes:02d} (поріг: 20 хв)",
-                        value=reaction_seconds,
-                        threshold=self.THRESHOLDS['slow_reaction_seconds'],
-                        manager_name=manager_name
-                    ))
+    def evaluate_managers(self, managers: pd.DataFrame) -> List[Alert]:
+        """
+        managers: one row per (period, ASSIGNED_BY_ID) with columns
+        manager_name, CR%, reaction_seconds. The previous period of each row
+        (optional prev_period column, else the preceding period) is joined by manager ID.
+        """
+        if managers.empty:
+            return []
+
+        frame = managers.copy()
+        if 'prev_period' not in frame:
+            frame['prev_period'] = self._previous_periods(frame['period'])
+        previous = frame[['period', 'ASSIGNED_BY_ID', 'CR%']].rename(
+            columns={'period': 'prev_period', 'CR%': 'prev_cr'}
+        )
+        frame = frame.merge(previous, on=['prev_period', 'ASSIGNED_BY_ID'], how='left')
+        frame['cr'] = frame['CR%']
+        frame['cr_change_pct'] = _change_pct(frame['CR%'], frame['prev_cr'])
+        frame = frame.merge(
+            self.thresholds.for_managers(frame['ASSIGNED_BY_ID']),
+            left_on='ASSIGNED_BY_ID', right_index=True, how='left'
+        )
 
+        alerts = []
+        for rule in self.manager_rules:
+            alerts.extend(self._fire(rule, frame))
         return alerts
 
-    def check_leads_volume_alerts(self, current_total: int, previous_total: int = None) -> List[Alert]:
-        """Check for low leads volume"""
-        alerts = []
+    def evaluate_department(self, totals: pd.DataFrame) -> List[Alert]:
+        """
+        totals: one row per period with total_leads, total_contracts, total_amount;
+        the previous period's leads (optional prev_total_leads column) default to the preceding row
+        """
+        if totals.empty:
+            return []
+
+        frame = totals.sort_values('period').reset_index(drop=True)
+        if 'prev_total_leads' not in frame:
+            frame['prev_total_leads'] = frame['total_leads'].shift(1)
+        frame['leads_change_pct'] = _change_pct(frame['total_leads'], frame['prev_total_leads'])
+        for key, value in self.thresholds.defaults.items():
+            frame[key] = float(value)
 
-        if previous_total and previous_total > 0:
-            change_pct = ((current_total - previous_total) / previous_total) * 100
+        alerts = []
+        for rule in self.department_rules:
+            alerts.extend(self._fire(rule, frame))
+        return alerts
 
-            if change_pct < self.THRESHOLDS['low_leads_pct']:
-                alerts.append(Alert(
-                    alert_type=AlertType.LOW_LEADS,
-                    severity=AlertSeverity.WARNING,
-                    title=f"Зниження кількості лідів",
-                    description=f"Лідів на {abs(change_pct):.1f}% менше ніж вчора (було {previous_total}, стало {current_total})",
-                    value=change_pct,
-                    threshold=self.THRESHOLDS['low_leads_pct']
-                ))
+    def evaluate_plans(self, plans: pd.DataFrame) -> List[Alert]:
+        """
+        plans: one row per plan with period, ASSIGNED_BY_ID (None for the department),
+        manager_name, metric_name, planned and actual; thresholds of the plan's manager apply
+        """
+        if plans.empty:
+            return []
+
+        frame = plans.assign(deviation_pct=_change_pct(plans['actual'], plans['planned']))
+        frame['threshold_id'] = frame['ASSIGNED_BY_ID'].fillna(0).astype('int64')
+        frame = frame.merge(
+            self.thresholds.for_managers(frame['threshold_id']),
+            left_on='threshold_id', right_index=True, how='left'
+        )
 
+        alerts = []
+        for rule in self.plan_rules:
+            alerts.extend(self._fire(rule, frame))
         return alerts
 
-    def check_sales_alerts(self, total_contracts: int, total_amount: float) -> List[Alert]:
-        """Check for sales issues"""
-        alerts = []
+    def evaluate(self, managers: pd.DataFrame, totals: pd.DataFrame = None, plans: pd.DataFrame = None) -> List[Alert]:
+        alerts = self.evaluate_managers(managers)
+        if totals is not None:
+            alerts.extend(self.evaluate_department(totals))
+        if plans is not None:
+            alerts.extend(self.evaluate_plans(plans))
+        return alerts
 
-        if total_contracts == 0:
-            alerts.append(Alert(
-                alert_type=AlertType.NO_SALES,
-                severity=AlertSeverity.CRITICAL,
-                title=f"Немає продажів",
-                description=f"За вчорашній день не було жодної продажі!",
-                value=0,
-                threshold=1
-            ))
 
-        return alerts
+def manager_frame(by_manager: List[Dict], period: str) -> pd.DataFrame:
+    """Period-by-manager frame from report records (metrics.by_manager)"""
+    frame = pd.DataFrame(by_manager)
+    if frame.empty:
+        return pd.DataFrame(columns=['period', 'ASSIGNED_BY_ID', 'manager_name', 'CR%', 'reaction_seconds'])
+
+    reaction = frame['time_taken_in_work'] if 'time_taken_in_work' in frame else pd.Series(pd.NaT, index=frame.index)
+    return pd.DataFrame({
+        'period': period,
+        'ASSIGNED_BY_ID': frame['ASSIGNED_BY_ID'].astype('int64'),
+        'manager_name': frame.get('FULL_NAME', pd.Series('Unknown', index=frame.index)).fillna('Unknown'),
+        'CR%': frame.get('CR%', pd.Series(0, index=frame.index)).astype(float),
+        'reaction_seconds': pd.to_timedelta(reaction).dt.total_seconds(),
+    })
+
+
+def plan_frame(plans: List[Dict]) -> pd.DataFrame:
+    """Plan frame from plan inputs (PlanProgressService.get_alert_inputs)"""
+    columns = ['period', 'ASSIGNED_BY_ID', 'manager_name', 'metric_name', 'planned', 'actual']
+    if not plans:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame({
+        'period': [plan.get('period') for plan in plans],
+        'ASSIGNED_BY_ID': pd.Series([plan.get('manager_id') for plan in plans], dtype=object),
+        'manager_name': [plan.get('manager_name') for plan in plans],
+        'metric_name': [plan.get('metric_name', 'Unknown') for plan in plans],
+        'planned': [float(plan.get('planned_value', 0)) for plan in plans],
+        'actual': [float(plan.get('actual_value', 0)) for plan in plans],
+    }, columns=columns)
 
-    def check_plan_alerts(self, actual: float, planned: float, metric_name: str) -> List[Alert]:
-        """Check plan vs actual performance"""
-        alerts = []
 
-        if planned > 0:
-            deviation_pct = ((actual - planned) / planned) * 100
+class AlertsService:
+    """Service for generating alerts based on metrics"""
 
-            if deviation_pct < self.THRESHOLDS['plan_miss_pct']:
-                alerts.append(Alert(
-                    alert_type=AlertType.PLAN_MISS,
-                    severity=AlertSeverity.WARNING if deviation_pct > -30 else AlertSeverity.CRITICAL,
-                    title=f"План не виконано: {metric_name}",
-                    description=f"План: {planned:.0f}, Факт: {actual:.0f} ({deviation_pct:+.1f}%)",
-                    value=deviation_pct,
-                    threshold=self.THRESHOLDS['plan_miss_pct']
-                ))
+    # Default thresholds (overridable per manager/team via ThresholdTable)
+    THRESHOLDS = {
+        'conversion_drop_pct': 15,  # CR% drop by 15%
+        'low_leads_pct': -20,  # 20% fewer leads
+        'slow_reaction_seconds': 1200,  # > 20 minutes
+        'plan_miss_pct': -10,  # Plan miss by 10%
+        'plan_critical_pct': -30,  # Plan miss by 30% is critical
+        'min_conversion': 10.0,  # Minimum acceptable CR%
+        'min_contracts': 1,  # At least one sale per period
+    }
 
-        return alerts
+    def __init__(self, thresholds: ThresholdTable = None):
+        self.alerts: List[Alert] = []
+        self.thresholds = thresholds or ThresholdTable(self.THRESHOLDS)
+        self.engine = RuleEngine(self.thresholds)
+
+    @classmethod
+    def from_settings(cls, settings) -> 'AlertsService':
+        """Service with threshold overrides from ALERT_THRESHOLDS/ALERT_TEAMS"""
+        overrides = settings.alert_thresholds
+        return cls(ThresholdTable(
+            cls.THRESHOLDS,
+            managers=overrides.get('managers'),
+            teams=overrides.get('teams'),
+            team_members=settings.alert_teams
+        ))
+
+    def evaluate_periods(self, managers: pd.DataFrame, totals: pd.DataFrame, periods: List[str] = None,
+                         plans: List[Dict] = None) -> List[Dict]:
+        """
+        Evaluate all rules over many periods at once (e.g. ReportEngine.get_daily_frames).
+        Earlier periods serve as baselines; only alerts of `periods` are returned if given.
+        `plans`: plan inputs of those periods (PlanProgressService.get_alert_inputs).
+        """
+        alerts = self.engine.evaluate(managers, totals, plan_frame(plans))
+        if periods is not None:
+            alerts = [alert for alert in alerts if alert.period in periods]
+        return [alert.to_dict() for alert in alerts]
 
     def get_all_alerts(
         self,
@@ -200,47 +402,22 @@ class AlertsService:
         previous_leads_metrics: Dict = None,
         plans: List[Dict] = None
     ) -> List[Dict]:
-        """Generate all alerts for current period"""
-        all_alerts = []
-
-        # Conversion alerts
-        if current_leads_metrics.get('metrics', {}).get('by_manager'):
-            prev_managers = None
-            if previous_leads_metrics and previous_leads_metrics.get('metrics', {}).get('by_manager'):
-                prev_managers = previous_leads_metrics['metrics']['by_manager']
-
-            all_alerts.extend(
-                self.check_conversion_alerts(
-                    current_leads_metrics['metrics']['by_manager'],
-                    prev_managers
-                )
-            )
-
-            # Reaction time alerts
-            all_alerts.extend(
-                self.check_reaction_time_alerts(current_leads_metrics['metrics']['by_manager'])
-            )
-
-        # Leads volume alerts
-        current_leads_total = current_leads_metrics.get('metrics', {}).get('total_leads', 0)
-        if previous_leads_metrics:
-            prev_leads_total = previous_leads_metrics.get('metrics', {}).get('total_leads', 0)
-            all_alerts.extend(self.check_leads_volume_alerts(current_leads_total, prev_leads_total))
-
-        # Sales alerts
-        all_alerts.extend(
-            self.check_sales_alerts(
-                current_sales_metrics.get('total_contracts', 0),
-                current_sales_metrics.get('total_amount', 0)
-            )
-        )
-
-        # Plan alerts (if plans are provided)
-        if plans:
-            for plan in plans:
-                metric_name = plan.get('metric_name', 'Unknown')
-                planned_value = plan.get('planned_value', 0)
-                actual_value = plan.get('actual_value', 0)
-                all_alerts.extend(self.check_plan_alerts(actual_value, planned_value, metric_name))
-
-        return [alert.to_dict() for alert in all_alerts]
+        """Generate all alerts for current period (one rule engine pass over both periods and the plans)"""
+        leads = current_leads_metrics.get('metrics', {})
+        previous = (previous_leads_metrics or {}).get('metrics', {})
+
+        # Managers matched by ID against the previous period
+        managers = manager_frame(leads.get('by_manager') or [], 'current').assign(prev_period='previous')
+        if previous.get('by_manager'):
+            managers = pd.concat([manager_frame(previous['by_manager'], 'previous'), managers], ignore_index=True)
+
+        totals = pd.DataFrame([{
+            'period': None,
+            'total_leads': leads.get('total_leads', 0),
+            'prev_total_leads': previous.get('total_leads', 0) if previous_leads_metrics else None,
+            'total_contracts': current_sales_metrics.get('total_contracts', 0),
+            'total_amount': current_sales_metrics.get('total_amount', 0),
+        }]).astype({'prev_total_leads': float})
+
+        alerts = self.engine.evaluate(managers, totals, plan_frame(plans))
+        return [alert.to_dict() for alert in alerts if alert.period != 'previous']
@@ -1,6 +1,31 @@
 import requests
 import time
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+from ..core.telemetry import (
+    bitrix_call_duration, bitrix_calls, bitrix_errors, bitrix_pages, bitrix_rows, throttle_sleep
+)
+from ..core.tracing import count_upstream
+
+# Rows per list page and commands per batch request (Bitrix24 limits)
+PAGE_SIZE = 50
+BATCH_COMMANDS = 50
+
+
+def _query_pairs(key: str, value):
+    if isinstance(value, dict):
+        for name, item in value.items():
+            yield from _query_pairs(f'{key}[{name}]', item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _query_pairs(f'{key}[]', item)
+    elif value is not None:
+        yield key, value
+
+
+def batch_command(method: str, params: dict) -> str:
+    """One batch command: method with PHP-style encoded params (filter[>ID]=10&select[]=ID)"""
+    return f'{method}?' + urlencode([pair for key, value in params.items() for pair in _query_pairs(key, value)])
 
 
 class B24Service:
@@ -10,43 +35,53 @@ class B24Service:
         self.domain = domain
         self.user_id = user_id
         self.token = token
+        # A domain with a scheme (http://127.0.0.1:8900) points at a stand-in server
+        self.base_url = domain if '://' in domain else f'https://{domain}'
 
     def get(self, url: str, params: dict = None):
         """GET request to Bitrix24 API"""
+        started = time.perf_counter()
         resp = requests.get(
-            f'https://{self.domain}/rest/{self.user_id}/{self.token}/{url}',
+            f'{self.base_url}/rest/{self.user_id}/{self.token}/{url}',
             params=params
         )
+        self._record_call(url, time.perf_counter() - started)
+        return resp
+
+    def _record_call(self, url: str, seconds: float):
+        bitrix_calls.inc(method=url)
+        bitrix_call_duration.observe(seconds, method=url)
+        count_upstream('bitrix', url, calls=1, seconds=seconds)
+
+    def _post(self, url: str, json: dict = None, data: dict = None, files: dict = None):
+        started = time.perf_counter()
+        resp = requests.post(
+            f'{self.base_url}/rest/{self.user_id}/{self.token}/{url}',
+            json=json, files=files, data=data
+        )
+        self._record_call(url, time.perf_counter() - started)
         return resp
 
     def post(self, url: str, json: dict = None, data: dict = None, files: dict = None, wait_for_limit: bool = False):
         """POST request to Bitrix24 API"""
         if wait_for_limit:
             for k in range(0, 5):
-                time.sleep(k * 10)
-                resp = requests.post(
-                    f'https://{self.domain}/rest/{self.user_id}/{self.token}/{url}',
-                    json=json, files=files, data=data
-                )
+                throttle_sleep(url, k * 10)
+                resp = self._post(url, json=json, files=files, data=data)
                 if 'error' not in resp.json().keys():
                     return resp
 
-        resp = requests.post(
-            f'https://{self.domain}/rest/{self.user_id}/{self.token}/{url}',
-            json=json, files=files, data=data
-        )
+        resp = self._post(url, json=json, files=files, data=data)
         return resp
 
-    def get_list(
+    def iter_pages(
         self,
         url: str,
         b24_filter: dict = None,
         select: list = None,
-        entityTypeId: int = None,
-        total_count_only: bool = False
-    ) -> List[Dict]:
-        """Get list of entities from Bitrix24 with pagination"""
-        entities = []
+        entityTypeId: int = None
+    ) -> Iterator[List[Dict]]:
+        """Yield entities page by page (50 per page) without accumulating them"""
         start_pos = 0
         total = 1
 
@@ -60,41 +95,134 @@ class B24Service:
             response = self.post(url, json=data).json()
 
             if 'error' in response.keys():
+                bitrix_errors.inc(method=url, error=response['error'])
                 if response['error'] == 'QUERY_LIMIT_EXCEEDED':
-                    time.sleep(5)
-                    print('delay 5s')
+                    throttle_sleep(url, 5)
                     continue
 
             start_pos += 50
 
             if 'total' not in response:
                 print('No total key in response:', response)
-                total = None
+                total = 0
             else:
                 total = response['total']
 
-            if total_count_only:
-                return total
-
-            if start_pos == 50:
-                print(url, 'Total_count =', total)
-
             if start_pos % 1000 == 0:
-                time.sleep(1)
-                print('delay 1s')
+                throttle_sleep(url, 1)
 
             result = response['result']
             if entityTypeId:
                 result = result['items']
 
-            for entity in result:
-                entities.append(entity)
+            bitrix_pages.inc(method=url)
+            bitrix_rows.inc(len(result), method=url)
+            count_upstream('bitrix', url, pages=1, rows=len(result))
+            yield result
+
+    def get_list(
+        self,
+        url: str,
+        b24_filter: dict = None,
+        select: list = None,
+        entityTypeId: int = None,
+        total_count_only: bool = False
+    ) -> List[Dict]:
+        """Get list of entities from Bitrix24 with pagination"""
+        if total_count_only:
+            data = {'start': 0, 'filter': b24_filter}
+            if entityTypeId:
+                data['entityTypeId'] = entityTypeId
+            return self.post(url, json=data, wait_for_limit=True).json().get('total')
+
+        entities = []
+        for page in self.iter_pages(url, b24_filter=b24_filter, select=select, entityTypeId=entityTypeId):
+            entities.extend(page)
 
         return entities
 
+    def batch(self, commands: Dict[str, str], halt: bool = False) -> Dict:
+        """Run up to 50 encoded commands in one request; returns result, result_error, result_total, result_next"""
+        while True:
+            response = self.post('batch', json={'halt': int(halt), 'cmd': commands}).json()
+            if 'error' not in response:
+                return response['result']
+            bitrix_errors.inc(method='batch', error=response['error'])
+            if response['error'] != 'QUERY_LIMIT_EXCEEDED':
+                raise RuntimeError(f"Bitrix24 batch failed: {response.get('error_description', response['error'])}")
+            throttle_sleep('batch', 5)
+
+    def _batch_pages(self, url: str, commands: Dict[str, str], items: bool = False) -> Tuple[List[List[Dict]], Dict]:
+        """Pages of a batch of `url` list commands in command order, and their totals; fails on any command error"""
+        block = self.batch(commands)
+        errors = block.get('result_error') or {}
+        if errors:
+            error = next(iter(errors.values()))
+            raise RuntimeError(f"Bitrix24 {url} failed: {error.get('error_description', error.get('error'))}")
+        pages = []
+        for key in commands:
+            result = block['result'][key]
+            if items:
+                result = result['items']
+            bitrix_pages.inc(method=url)
+            bitrix_rows.inc(len(result), method=url)
+            count_upstream('bitrix', url, pages=1, rows=len(result))
+            pages.append(result)
+        return pages, block.get('result_total') or {}
+
+    def iter_after_id(
+        self,
+        url: str,
+        after_id: int = 0,
+        b24_filter: dict = None,
+        select: list = None,
+        entityTypeId: int = None
+    ) -> Iterator[List[Dict]]:
+        """
+        Yield entities with ID above `after_id` in ID order, page by page, fetching up to 50 pages
+        per batch request. Each batch filters on the last ID seen, so offsets stay below 2500 however
+        long the list is, and rows added while paging are picked up rather than shifting pages.
+        """
+        pages = 1  # the first batch learns the total
+        while True:
+            params = {'order': {'ID': 'ASC'}, 'filter': {**(b24_filter or {}), '>ID': after_id}}
+            if entityTypeId:
+                params['entityTypeId'] = entityTypeId
+            if select:
+                params['select'] = select
+            results, totals = self._batch_pages(url, {
+                f'p{i}': batch_command(url, {**params, 'start': i * PAGE_SIZE}) for i in range(pages)
+            }, items=bool(entityTypeId))
+
+            fetched = 0
+            for result in results:
+                if result:
+                    fetched += len(result)
+                    after_id = int(result[-1]['ID'])
+                    yield result
+
+            total = totals.get('p0')
+            remaining = total - fetched if total is not None else (PAGE_SIZE if fetched == pages * PAGE_SIZE else 0)
+            if remaining <= 0 or not fetched:
+                return
+            pages = min(BATCH_COMMANDS, -(-remaining // PAGE_SIZE))
+
+    def iter_by_ids(self, url: str, ids: List[int], select: list = None) -> Iterator[List[Dict]]:
+        """Yield entities by ID: one command per 50 IDs, up to 50 commands (2500 entities) per batch request"""
+        chunks = [ids[i:i + PAGE_SIZE] for i in range(0, len(ids), PAGE_SIZE)]
+        for first in range(0, len(chunks), BATCH_COMMANDS):
+            commands = {}
+            for i, chunk in enumerate(chunks[first:first + BATCH_COMMANDS]):
+                params = {'filter': {'@ID': chunk}}
+                if select:
+                    params['select'] = select
+                commands[f'c{i}'] = batch_command(url, params)
+            yield from self._batch_pages(url, commands)[0]
+
     def call(self, method: str, params: dict = None):
         """Direct API method call"""
         response = self.post(method, json=params).json()
         if 'error' in response:
+            bitrix_errors.inc(method=method, error=response['error'])
             print(f"[API Error] Method: {method} — {response.get('error_description', 'Unknown error')}")
         return response
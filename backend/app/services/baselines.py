@@ -0,0 +1,170 @@
+"""
+Baseline-aware anomaly alerts.
+
+Each day's metrics (leads, CR%, median reaction, revenue - for the
+department and per source) are compared with EWMA baselines of the
+same weekday, then folded into them. Mondays are compared with Mondays, so
+weekly seasonality does not trigger alerts.
+"""
+
+import math
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from .alerts_service import Alert, AlertSeverity, AlertType
+from .sketches import QuantileSketch
+
+DEPARTMENT = '*'
+
+# metric -> (alert type, direction that is bad, additive, title)
+METRICS = {
+    'leads': (AlertType.LEADS_ANOMALY, -1, True, "Аномально мало лідів"),
+    'cr': (AlertType.CONVERSION_ANOMALY, -1, False, "Аномально низька конверсія"),
+    'reaction': (AlertType.REACTION_ANOMALY, 1, False, "Аномально повільна реакція"),
+    'revenue': (AlertType.REVENUE_ANOMALY, -1, True, "Аномально низька виручка"),
+}
+
+
+def std_floor(metric: str, mean: float) -> float:
+    """Lower bound of the baseline deviation, so quiet series do not alert on noise"""
+    if metric == 'leads':
+        return math.sqrt(max(mean, 1.0))  # Poisson
+    if metric == 'cr':
+        return 1.0  # percentage point
+    if metric == 'reaction':
+        return max(60.0, 0.1 * mean)
+    return 0.1 * abs(mean)
+
+
+def day_observations(merged: Dict[str, pd.DataFrame], day: str) -> pd.DataFrame:
+    """Long frame (metric, key, value) of one day from merged daily aggregates"""
+    leads = merged.get('leads', pd.DataFrame(columns=['day', 'ASSIGNED_BY_ID', 'UTM_SOURCE', 'number_of_leads']))
+    deals = merged.get('deals', pd.DataFrame(columns=['day', 'ASSIGNED_BY_ID', 'UTM_SOURCE', 'number_of_contracts', 'contract_amount']))
+    reaction = merged.get('reaction', pd.DataFrame(columns=['day', 'ASSIGNED_BY_ID', 'sketch']))
+    leads = leads[leads['day'] == day]
+    deals = deals[deals['day'] == day]
+    reaction = reaction[reaction['day'] == day]
+
+    rows = []
+
+    def add(metric: str, series: pd.Series):
+        rows.extend((metric, str(key), float(value)) for key, value in series.items())
+
+    total_leads = leads['number_of_leads'].sum()
+    total_deals = deals['number_of_contracts'].sum()
+    add('leads', pd.Series({DEPARTMENT: total_leads}))
+    add('leads', leads.groupby('UTM_SOURCE', observed=True)['number_of_leads'].sum())
+    add('revenue', pd.Series({DEPARTMENT: deals['contract_amount'].sum()}))
+    add('revenue', deals.groupby('UTM_SOURCE', observed=True)['contract_amount'].sum())
+
+    # Daily CR% of a single manager is mostly noise; per-manager conversion
+    # is covered by the period rules of AlertsService
+    if total_leads > 0:
+        add('cr', pd.Series({DEPARTMENT: total_deals / total_leads * 100}))
+
+    median = QuantileSketch.merged(reaction['sketch']).quantile(0.5)
+    if median is not None:
+        add('reaction', pd.Series({DEPARTMENT: median}))
+
+    return pd.DataFrame(rows, columns=['metric', 'key', 'value'])
+
+
+class AnomalyDetector:
+    """Same-weekday EWMA baselines with O(1) update per series and day"""
+
+    def __init__(self, store, alpha: float = 0.25, z_threshold: float = 2.5, min_history: int = 4):
+        self.store = store
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_history = min_history
+
+    @classmethod
+    def from_settings(cls, store, settings) -> 'AnomalyDetector':
+        return cls(
+            store,
+            alpha=settings.ANOMALY_ALPHA,
+            z_threshold=settings.ANOMALY_Z_THRESHOLD,
+            min_history=settings.ANOMALY_MIN_HISTORY
+        )
+
+    def _update(self, mean: Optional[float], var: Optional[float], n: int, value: float):
+        if not n:
+            return value, 0.0, 1
+        delta = value - mean
+        mean = mean + self.alpha * delta
+        var = (1 - self.alpha) * (var + self.alpha * delta * delta)
+        return mean, var, n + 1
+
+    def _alert(self, day: str, metric: str, key: str, value: float, mean: float, z: float) -> Alert:
+        alert_type, _, _, title = METRICS[metric]
+        label = "Відділ" if key == DEPARTMENT else f"Джерело {key}"
+        if metric == 'reaction':
+            description = f"{label}: медіана реакції {value / 60:.0f} хв проти звичних {mean / 60:.0f} хв (z = {z:+.1f})"
+        elif metric == 'cr':
+            description = f"{label}: CR% = {value:.2f}% проти звичних {mean:.2f}% (z = {z:+.1f})"
+        else:
+            description = f"{label}: {value:,.0f} проти звичних {mean:,.0f} для цього дня тижня (z = {z:+.1f})"
+
+        return Alert(
+            alert_type=alert_type,
+            severity=AlertSeverity.CRITICAL if abs(z) >= 1.5 * self.z_threshold else AlertSeverity.WARNING,
+            title=title,
+            description=description,
+            value=value,
+            threshold=mean,
+            period=day
+        )
+
+    def observe_day(self, day: str, observations: pd.DataFrame, update: bool = True) -> List[Alert]:
+        """Evaluate one day against its weekday baselines, then fold it into them (unless not `update`)"""
+        weekday = pd.Timestamp(day).weekday()
+        states = self.store.get_weekday(weekday)
+        values = {(row.metric, row.key): row.value for row in observations.itertuples(index=False)}
+
+        # Additive series seen before but absent today are zero today
+        for (metric, key) in states:
+            if METRICS[metric][2] and (metric, key) not in values:
+                values[(metric, key)] = 0.0
+
+        alerts = []
+        updated = []
+        for (metric, key), value in values.items():
+            state = states.get((metric, key))
+            if state and state['last_day'] > day:
+                # Older day than the baseline already has: evaluate only
+                base = (state['mean'], state['var'], state['n'])
+            elif state and state['last_day'] == day:
+                # Re-evaluation of the same day: start from the state before it
+                base = (state['prev_mean'], state['prev_var'], state['prev_n'])
+            elif state:
+                base = (state['mean'], state['var'], state['n'])
+            else:
+                base = (None, None, 0)
+
+            mean, var, n = base
+            if n >= self.min_history:
+                std = max(math.sqrt(var), std_floor(metric, mean), 1e-9)
+                z = (value - mean) / std
+                direction = METRICS[metric][1]
+                if z * direction >= self.z_threshold:
+                    alerts.append(self._alert(day, metric, key, value, mean, z))
+
+            if not state or state['last_day'] <= day:
+                new_mean, new_var, new_n = self._update(mean, var, n, value)
+                updated.append({
+                    'metric': metric, 'key': key, 'weekday': weekday,
+                    'mean': new_mean, 'var': new_var, 'n': new_n, 'last_day': day,
+                    'prev_mean': mean, 'prev_var': var, 'prev_n': n
+                })
+
+        if update:
+            self.store.upsert(updated)
+        return alerts
+
+    def observe_range(self, merged: Dict[str, pd.DataFrame], days: List[str], update: bool = True) -> List[Alert]:
+        """observe_day over days in chronological order"""
+        alerts = []
+        for day in sorted(days):
+            alerts.extend(self.observe_day(day, day_observations(merged, day), update=update))
+        return alerts
@@ -0,0 +1,105 @@
+"""
+Lead cohorts: true conversion of leads to the won deals made from them.
+
+Leads are grouped by creation period (cohort) and optionally by their
+manager or source; a lead is converted when at least one won deal of the
+main pipeline has it as LEAD_ID, whenever that deal closed. Unlike the
+report CR% (deals closed in a period / leads created in it) every deal is
+counted in the cohort of the lead it came from.
+
+Lead-to-close time is the time from the lead's DATE_CREATE to its first
+won deal's CLOSEDATE, in days. `converted_within` is the share of the
+cohort converted within 7, 30 and 90 days; it is None while the window has
+not passed for every lead of the cohort yet.
+"""
+
+from datetime import datetime
+from typing import Dict, Optional
+
+import pandas as pd
+
+from ..core.telemetry import stage
+from .schema import manager_names
+from .timeseries import period_end, period_starts
+
+WINDOWS = (7, 30, 90)
+
+PERCENTILES = {'p25': 0.25, 'p50': 0.5, 'p75': 0.75, 'p90': 0.9}
+
+BREAKDOWN_COLUMNS = {
+    'manager': 'assigned_by_id',
+    'source': 'utm_source',
+}
+
+
+def _round(value, digits: int = 2) -> Optional[float]:
+    return None if value is None or pd.isna(value) else round(float(value), digits)
+
+
+@stage('cohorts')
+def build_cohorts(outcomes: pd.DataFrame, grain: str = 'monthly', breakdown: Optional[str] = None,
+                  users_df: Optional[pd.DataFrame] = None) -> Dict:
+    """Cohort rows of EntityStore.lead_outcomes, oldest cohort first (largest key first within a cohort)"""
+    today = datetime.now().strftime('%Y-%m-%d')
+    if outcomes.empty:
+        return {'grain': grain, 'breakdown': breakdown, 'cohorts': []}
+
+    # Timestamps are parsed for converted leads only (a small share)
+    converted = outcomes[outcomes['first_close'].notna()]
+    elapsed = pd.to_datetime(converted['first_close'], utc=True, format='ISO8601') \
+        - pd.to_datetime(converted['date_create'], utc=True, format='ISO8601')
+    days = pd.Index(outcomes['day'].unique())
+    cohort_of = pd.Series(period_starts(pd.DatetimeIndex(days), grain), index=days)
+    leads = pd.DataFrame({
+        'cohort': outcomes['day'].map(cohort_of),
+        'key': outcomes[BREAKDOWN_COLUMNS[breakdown]].astype(object).where(lambda keys: keys.notna(), '')
+        if breakdown else '',
+        'converted': outcomes['deals'] > 0,
+        'deals': outcomes['deals'],
+        'revenue': outcomes['revenue'],
+        # Deals closed before the lead was created (back-dated) count as closed at once
+        'close_days': (elapsed.dt.total_seconds() / 86400).clip(lower=0).reindex(outcomes.index),
+    })
+    for days in WINDOWS:
+        leads[f'within_{days}'] = leads['close_days'] <= days
+
+    groups = leads.groupby(['cohort', 'key'])
+    totals = groups.agg(
+        leads=('converted', 'size'), converted=('converted', 'sum'), deals=('deals', 'sum'), revenue=('revenue', 'sum'),
+        **{f'within_{days}': (f'within_{days}', 'sum') for days in WINDOWS}
+    )
+    quantiles = groups['close_days'].quantile(list(PERCENTILES.values())).unstack()
+    quantiles.columns = list(PERCENTILES)
+    totals = totals.join(quantiles).reset_index()
+    totals = totals.sort_values(['cohort', 'leads'], ascending=[True, False], kind='stable')
+
+    names = manager_names(users_df) if breakdown == 'manager' else {}
+
+    # A window is complete once it has passed for the cohort's last lead
+    complete = {
+        cohort: {days: (pd.Timestamp(period_end(cohort, grain)) + pd.Timedelta(days=days)).strftime('%Y-%m-%d') < today
+                 for days in WINDOWS}
+        for cohort in totals['cohort'].unique()
+    }
+
+    cohorts = []
+    for row in totals.to_dict('records'):
+        item = {'cohort': row['cohort']}
+        if breakdown:
+            key = None if row['key'] == '' else (int(row['key']) if breakdown == 'manager' else row['key'])
+            item.update({'key': key, 'label': names.get(key, None if key is None else str(key))})
+        item.update({
+            'leads': int(row['leads']),
+            'converted': int(row['converted']),
+            'conversion': round(row['converted'] / row['leads'] * 100, 2),
+            'deals': int(row['deals']),
+            'revenue': round(float(row['revenue']), 2),
+            'close_days': {name: _round(row[name], 1) for name in PERCENTILES},
+            'converted_within': {
+                str(days): round(row[f'within_{days}'] / row['leads'] * 100, 2) if complete[row['cohort']][days] else None
+                for days in WINDOWS
+            },
+        })
+        cohorts.append(item)
+
+    return {'grain': grain, 'breakdown': breakdown, 'cohorts': cohorts}
@@ -0,0 +1,126 @@
+"""
+Period-over-period comparison from daily aggregates.
+
+Both periods come from the aggregate store (closed days are stored once, so
+the baseline costs no Bitrix24 calls after its first use), and every value
+is returned with its baseline and the absolute and percentage deltas:
+
+    {'current': 120, 'baseline': 100, 'delta': 20, 'delta_pct': 20.0}
+
+delta_pct is None when the baseline is zero. Metrics use the plan progress
+names: 'leads', 'sales' (contracts), 'revenue' (contract amount) and
+'conversion' (CR%, totals and managers only).
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from ..core.telemetry import stage
+from .schema import CONTRACT_TYPES, manager_names
+
+BASELINES = ('previous', 'same_last_year')
+
+
+def baseline_range(start_date: str, end_date: str, baseline: str) -> Tuple[str, str]:
+    """Baseline period of a range: the same number of days just before it, or the same dates a year earlier"""
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    if baseline == 'previous':
+        length = end - start + timedelta(days=1)
+        start, end = start - length, end - length
+    elif baseline == 'same_last_year':
+        # 29 February falls back to 28 February
+        start, end = (pd.Timestamp(day) - pd.DateOffset(years=1) for day in (start, end))
+    else:
+        raise ValueError(f"Unknown baseline: {baseline}. Use one of {', '.join(BASELINES)}")
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+
+def _value(value) -> float:
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 2)
+
+
+def delta(current: float, baseline: float) -> Dict:
+    """Current and baseline value with absolute and percentage change"""
+    return {
+        'current': _value(current),
+        'baseline': _value(baseline),
+        'delta': _value(current - baseline),
+        'delta_pct': round((current - baseline) / baseline * 100, 2) if baseline else None
+    }
+
+
+def _conversion(sums: pd.Series) -> float:
+    return sums['sales'] / sums['leads'] * 100 if sums['leads'] else 0.0
+
+
+def period_sums(merged: Dict[str, pd.DataFrame], column: str) -> pd.DataFrame:
+    """column -> leads, sales, revenue of merged aggregates (leads only where the column exists)"""
+    parts = []
+    leads = merged.get('leads')
+    if leads is not None and not leads.empty and column in leads.columns:
+        parts.append(leads.groupby(column, dropna=False)['number_of_leads'].sum().rename('leads'))
+    deals = merged.get('deals')
+    if deals is not None and not deals.empty:
+        parts.append(
+            deals.groupby(column, dropna=False)[['number_of_contracts', 'contract_amount']].sum()
+            .rename(columns={'number_of_contracts': 'sales', 'contract_amount': 'revenue'})
+        )
+    sums = pd.concat(parts, axis=1) if parts else pd.DataFrame()
+    return sums.reindex(columns=['leads', 'sales', 'revenue'], fill_value=0).fillna(0)
+
+
+def _rows(current: pd.DataFrame, baseline: pd.DataFrame, metrics: List[str], conversion: bool) -> List[Tuple]:
+    """(key, {metric: delta}) of every key of either period, largest current value of the first metric first"""
+    keys = current.index.union(baseline.index)
+    current = current.reindex(keys, fill_value=0)
+    baseline = baseline.reindex(keys, fill_value=0)
+    order = current[metrics[0]].sort_values(ascending=False, kind='stable').index
+
+    rows = []
+    for key in order:
+        values = {metric: delta(current.at[key, metric], baseline.at[key, metric]) for metric in metrics}
+        if conversion:
+            values['conversion'] = delta(_conversion(current.loc[key]), _conversion(baseline.loc[key]))
+        rows.append((None if pd.isna(key) else key, values))
+    return rows
+
+
+@stage('comparison')
+def compare_periods(current: Dict[str, pd.DataFrame], baseline: Dict[str, pd.DataFrame], users_df: pd.DataFrame) -> Dict:
+    """Totals and per manager, source and contract type deltas of two periods of merged aggregates"""
+    names = manager_names(users_df)
+    counts = ['leads', 'sales', 'revenue']
+
+    managers = [
+        {'manager_id': int(key), 'manager': names.get(key, str(key)), **values}
+        for key, values in _rows(
+            period_sums(current, 'ASSIGNED_BY_ID'), period_sums(baseline, 'ASSIGNED_BY_ID'), counts, conversion=True
+        )
+    ]
+    sources = [
+        {'source': key, **values}
+        for key, values in _rows(period_sums(current, 'UTM_SOURCE'), period_sums(baseline, 'UTM_SOURCE'), counts, False)
+    ]
+    types = [
+        {'type_contract': CONTRACT_TYPES.get(key, key), **values}
+        for key, values in _rows(
+            period_sums(current, 'UF_CRM_1695636781'), period_sums(baseline, 'UF_CRM_1695636781'),
+            ['sales', 'revenue'], conversion=False
+        )
+    ]
+
+    current_totals = period_sums(current, 'day').sum()
+    baseline_totals = period_sums(baseline, 'day').sum()
+    totals = {metric: delta(current_totals[metric], baseline_totals[metric]) for metric in counts}
+    totals['conversion'] = delta(_conversion(current_totals), _conversion(baseline_totals))
+
+    return {
+        'totals': totals,
+        'by_manager': managers,
+        'by_source': sources,
+        'by_type': types
+    }
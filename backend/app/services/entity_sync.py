@@ -0,0 +1,167 @@
+"""
+Near real-time sync from Bitrix24 outbound events.
+
+The webhook endpoint only queues entity IDs. The worker wakes up, waits a
+moment so bursts collapse into one batch, fetches the changed leads and
+deals by ID (`@ID` filter, 50 IDs per command of one batch request) and
+upserts them into the entity store. Every affected day is then recomputed
+from the local mirror and written to the aggregate store; open days are
+marked live, so reports of "today" no longer poll Bitrix24 for the whole
+day. A mark expires after BITRIX24_EVENT_LIVE_MINUTES without events, so a
+missed event leaves the day stale for at most that long.
+
+A day is mirrored in full the first time an event touches it. A deal
+whose CLOSEDATE moves away from a day that was never mirrored leaves that
+day's aggregates as they were until it is synced again.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+from fastapi.concurrency import run_in_threadpool
+
+from ..core.telemetry import stage
+from .report_engine import compute_partial, contiguous_runs
+from .schema import ENTITY_DEAL_DTYPES, LEAD_DTYPES, build_frame
+
+EVENTS = {
+    'ONCRMLEADADD': 'lead',
+    'ONCRMLEADUPDATE': 'lead',
+    'ONCRMDEALADD': 'deal',
+    'ONCRMDEALUPDATE': 'deal',
+}
+
+
+class EntitySync:
+    """Fetches changed entities by ID and recomputes the daily aggregates they touch"""
+
+    def __init__(self, leads_service, sales_service, entity_store, aggregate_store):
+        self.leads_service = leads_service
+        self.sales_service = sales_service
+        self.entity_store = entity_store
+        self.aggregate_store = aggregate_store
+
+    def fetch_leads(self, b24_filter: Dict) -> pd.DataFrame:
+        pages = self.leads_service.b24_leads.iter_pages('crm.lead.list', b24_filter=b24_filter, select=list(LEAD_DTYPES))
+        return build_frame(pages, LEAD_DTYPES)
+
+    def fetch_deals(self, b24_filter: Dict) -> pd.DataFrame:
+        pages = self.sales_service.b24_deals.iter_pages('crm.deal.list', b24_filter=b24_filter, select=list(ENTITY_DEAL_DTYPES))
+        return build_frame(pages, ENTITY_DEAL_DTYPES)
+
+    def seed_day(self, kind: str, day: str):
+        """Mirror one whole day of leads or report deals"""
+        if kind == 'lead':
+            df = self.fetch_leads({'>=DATE_CREATE': f'{day}T00:00:01', '<=DATE_CREATE': f'{day}T23:59:59'})
+        else:
+            df = self.fetch_deals({
+                'CATEGORY_ID': 0,
+                '>=CLOSEDATE': f'{day}T00:00:01',
+                '<=CLOSEDATE': f'{day}T23:59:59',
+                'STAGE_ID': 'WON'
+            })
+        self.entity_store.replace_day(kind, day, df)
+
+    def mirror_range(self, kind: str, start_date: str, end_date: str) -> int:
+        """
+        Mirror the days of the range that are not mirrored yet, with one range fetch per run of
+        missing days; open days count as missing unless events keep them live. Returns days fetched.
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        mirrored = self.entity_store.mirrored_range(kind, start_date, end_date)
+        live = set(self.aggregate_store.live_days(today, max(today, end_date)))
+        days = pd.date_range(start_date, end_date).strftime('%Y-%m-%d')
+        missing = [day for day in days if day not in mirrored or (day >= today and day not in live)]
+
+        for run_start, run_end in contiguous_runs(missing):
+            if kind == 'lead':
+                df = self.fetch_leads({'>=DATE_CREATE': f'{run_start}T00:00:01', '<=DATE_CREATE': f'{run_end}T23:59:59'})
+            else:
+                df = self.fetch_deals({
+                    'CATEGORY_ID': 0,
+                    '>=CLOSEDATE': f'{run_start}T00:00:01',
+                    '<=CLOSEDATE': f'{run_end}T23:59:59',
+                    'STAGE_ID': 'WON'
+                })
+            self.entity_store.replace_days(kind, list(pd.date_range(run_start, run_end).strftime('%Y-%m-%d')), df)
+        return len(missing)
+
+    def recompute_days(self, days: Iterable[str]):
+        """Rebuild daily aggregates of `days` from the mirror (seeding days not mirrored yet)"""
+        days = sorted(days)
+        if not days:
+            return
+        for kind in ('lead', 'deal'):
+            for day in set(days) - self.entity_store.mirrored_days(kind, days):
+                self.seed_day(kind, day)
+
+        leads_df, deals_df = self.entity_store.leads_frame(days), self.entity_store.deals_frame(days)
+        with stage('compute_partial'):
+            partial = compute_partial(leads_df, deals_df)
+        self.aggregate_store.save_partial(partial, days, live=True)
+
+    def upsert_by_id(self, kind: str, ids: Iterable[int]) -> Set[str]:
+        """Fetch entities by ID (any stage) into the store, 2500 per batch request; returns the days affected"""
+        ids = sorted(ids)
+        if kind == 'lead':
+            pages = self.leads_service.b24_leads.iter_by_ids('crm.lead.list', ids, select=list(LEAD_DTYPES))
+            return self.entity_store.upsert_leads(build_frame(pages, LEAD_DTYPES))
+        pages = self.sales_service.b24_deals.iter_by_ids('crm.deal.list', ids, select=list(ENTITY_DEAL_DTYPES))
+        return self.entity_store.upsert_deals(build_frame(pages, ENTITY_DEAL_DTYPES))
+
+    def apply(self, lead_ids: Iterable[int], deal_ids: Iterable[int]) -> List[str]:
+        """Sync changed entities; returns the recomputed days"""
+        affected = self.upsert_by_id('lead', lead_ids) | self.upsert_by_id('deal', deal_ids)
+        self.recompute_days(affected)
+        return sorted(affected)
+
+
+class EventQueue:
+    """Pending entity IDs per kind; repeated events of one entity collapse"""
+
+    def __init__(self):
+        self.pending: Dict[str, Set[int]] = {'lead': set(), 'deal': set()}
+        self._ready = asyncio.Event()
+
+    def add(self, kind: str, entity_id: int):
+        self.pending[kind].add(entity_id)
+        self._ready.set()
+
+    async def wait(self):
+        await self._ready.wait()
+
+    def drain(self) -> Dict[str, Set[int]]:
+        batch = self.pending
+        self.pending = {'lead': set(), 'deal': set()}
+        self._ready.clear()
+        return batch
+
+    def size(self) -> int:
+        return sum(len(ids) for ids in self.pending.values())
+
+
+async def run_worker(
+    queue: EventQueue,
+    sync: EntitySync,
+    batch_seconds: float = 2.0,
+    retry_seconds: float = 30.0,
+    on_change: Optional[Callable[[List[str]], Awaitable]] = None
+):
+    """Background task: apply queued events in batches; `on_change` gets the recomputed days"""
+    while True:
+        await queue.wait()
+        await asyncio.sleep(batch_seconds)
+        batch = queue.drain()
+        try:
+            days = await run_in_threadpool(sync.apply, batch['lead'], batch['deal'])
+            print(f"[Bitrix Events] {len(batch['lead'])} leads, {len(batch['deal'])} deals -> days {days}")
+            if on_change is not None:
+                await on_change(days)
+        except Exception as e:
+            print(f"[Bitrix Events] Sync failed, retrying in {retry_seconds:.0f}s: {str(e)}")
+            await asyncio.sleep(retry_seconds)
+            for kind, ids in batch.items():
+                for entity_id in ids:
+                    queue.add(kind, entity_id)
@@ -0,0 +1,106 @@
+"""
+Sparse two-dimensional lead counts (heatmaps).
+
+Both dimensions are coded as integers (pd.factorize) and the leads are
+counted with one groupby over the combined code, so only non-zero cells are
+produced; no dense manager x status table full of zeros is built or sent.
+
+    {
+        'rows': {'dimension': 'manager', 'keys': [100, 101], 'labels': ['Name Last', ...]},
+        'columns': {'dimension': 'status', 'keys': ['NEW', ...], 'labels': ['New lead', ...]},
+        'cells': [[row_index, column_index, count], ...]  # row-major, non-zero only
+    }
+
+Dimensions: manager, status, source, hour (of DATE_CREATE, per-lead data
+only) and weekday (0 = Monday; from DATE_CREATE or the aggregates' `day`).
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .schema import manager_names
+
+DIMENSIONS = ('manager', 'status', 'source', 'hour', 'weekday')
+
+WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Нд']
+
+
+def _keys(leads: pd.DataFrame, dimension: str) -> pd.Series:
+    """Key of every lead on one dimension"""
+    if dimension == 'manager':
+        return leads['ASSIGNED_BY_ID']
+    if dimension == 'status':
+        return leads['STATUS_ID']
+    if dimension == 'source':
+        return leads['UTM_SOURCE']
+    if dimension == 'hour':
+        if 'DATE_CREATE' not in leads.columns:
+            raise ValueError("The hour dimension needs per-lead data")
+        return leads['DATE_CREATE'].dt.hour.astype('Int64')
+    if dimension == 'weekday':
+        if 'DATE_CREATE' in leads.columns:
+            return leads['DATE_CREATE'].dt.dayofweek.astype('Int64')
+        return pd.to_datetime(leads['day']).dt.dayofweek.astype('Int64')
+    raise ValueError(f"Unknown dimension: {dimension}. Use one of {', '.join(DIMENSIONS)}")
+
+
+def _labels(dimension: str, keys: List, users_df: Optional[pd.DataFrame], statuses_df: Optional[pd.DataFrame]) -> List[str]:
+    """Display label of every key"""
+    if dimension == 'manager' and users_df is not None:
+        names = manager_names(users_df)
+        return [names.get(key, str(key)) for key in keys]
+    if dimension == 'status' and statuses_df is not None:
+        statuses = statuses_df.drop_duplicates('STATUS_ID')
+        names = dict(zip(statuses['STATUS_ID'].astype(str).tolist(), statuses['NAME'].astype(str).tolist()))
+        return [names.get(key, key) for key in keys]
+    if dimension == 'hour':
+        return [f'{key:02d}:00' for key in keys]
+    if dimension == 'weekday':
+        return [WEEKDAYS[key] for key in keys]
+    return [str(key) for key in keys]
+
+
+def _factorize(keys: pd.Series) -> Tuple[np.ndarray, List]:
+    """(integer codes, -1 for missing; sorted unique keys as Python values)"""
+    codes, uniques = pd.factorize(keys, sort=True)
+    return codes, np.asarray(uniques).tolist()
+
+
+def sparse_heatmap(
+    leads: pd.DataFrame,
+    rows: str,
+    columns: str,
+    users_df: Optional[pd.DataFrame] = None,
+    statuses_df: Optional[pd.DataFrame] = None,
+    weights: Optional[str] = None
+) -> Dict:
+    """Non-zero cells of a rows x columns lead count (or sum of the `weights` column)"""
+    row_codes, row_keys = _factorize(_keys(leads, rows))
+    column_codes, column_keys = _factorize(_keys(leads, columns))
+
+    width = max(len(column_keys), 1)
+    valid = (row_codes >= 0) & (column_codes >= 0)
+    cells = row_codes[valid].astype('int64') * width + column_codes[valid]
+    values = leads[weights].to_numpy()[valid] if weights else np.ones(len(cells), dtype='int64')
+    totals = pd.Series(values).groupby(cells, sort=True).sum()
+    totals = totals[totals != 0]
+
+    cell_codes = totals.index.to_numpy()
+    return {
+        'rows': {'dimension': rows, 'keys': row_keys, 'labels': _labels(rows, row_keys, users_df, statuses_df)},
+        'columns': {
+            'dimension': columns,
+            'keys': column_keys,
+            'labels': _labels(columns, column_keys, users_df, statuses_df)
+        },
+        'cells': [
+            [int(row), int(column), int(value)]
+            for row, column, value in zip(
+                (cell_codes // width).tolist(),
+                (cell_codes % width).tolist(),
+                totals.to_numpy().tolist()
+            )
+        ]
+    }
@@ -2,6 +2,11 @@ from datetime import datetime, timedelta
 import pandas as pd
 from typing import Dict, List, Optional
 from .b24_service import B24Service
+from .heatmap import sparse_heatmap
+from .schema import apply_schema, build_frame, to_records, value_counts_dict, LEAD_DTYPES, DEAL_DTYPES, USER_DTYPES
+from ..core.cache import get_or_compute
+from ..core.telemetry import stage
+from ..core.tracing import span
 
 
 def calculate_working_hours(start_time, end_time, work_start_hour=9, work_end_hour=21):
@@ -34,18 +39,33 @@ def calculate_working_hours(start_time, end_time, work_start_hour=9, work_end_ho
     return timedelta(seconds=total_working_seconds)
 
 
+@stage('reaction_time')
+def add_reaction_time(leads_df: pd.DataFrame) -> pd.DataFrame:
+    """Add working-time reaction (time_taken_in_work) to typed leads frame"""
+    leads_df['time_taken_in_work'] = leads_df.apply(
+        lambda row: calculate_working_hours(row['DATE_CREATE'], row['taken_in_work']),
+        axis=1
+    )
+    return leads_df
+
+
 class LeadsService:
     """Service for working with leads data"""
 
-    def __init__(self, domain: str, user_id: int, leads_token: str, users_token: str, status_token: str):
+    def __init__(self, domain: str, user_id: int, leads_token: str, users_token: str, status_token: str,
+                 reference_cache=None, reference_ttl: float = 0):
         self.b24_leads = B24Service(domain, user_id, leads_token)
         self.b24_users = B24Service(domain, user_id, users_token)
         self.b24_status = B24Service(domain, user_id, status_token)
         self.domain = domain
+        # Optional ReportCache for users and statuses, fresh for reference_ttl seconds
+        self.reference_cache = reference_cache
+        self.reference_ttl = reference_ttl
 
-    def get_leads_data(self, start_date: str, end_date: str) -> pd.DataFrame:
+    @span('fetch_leads')
+    def get_leads_data(self, start_date: str, end_date: str, reaction_time: bool = True) -> pd.DataFrame:
         """Get leads data for date range"""
-        leads = self.b24_leads.get_list(
+        pages = self.b24_leads.iter_pages(
             'crm.lead.list',
             b24_filter={
                 '>=DATE_CREATE': f'{start_date}T00:00:01',
@@ -53,36 +73,51 @@ class LeadsService:
             },
             select=['ID', 'STATUS_ID', 'ASSIGNED_BY_ID', 'DATE_CREATE', 'UTM_SOURCE', 'UF_CRM_1745414446']
         )
+        leads_df = build_frame(pages, LEAD_DTYPES)
 
-        if not leads:
+        if leads_df.empty:
             return pd.DataFrame()
 
-        leads_df = pd.DataFrame(leads)
-        leads_df['DATE_CREATE'] = pd.to_datetime(leads_df['DATE_CREATE'])
-        leads_df['taken_in_work'] = pd.to_datetime(leads_df['UF_CRM_1745414446'])
-        leads_df = leads_df.drop('UF_CRM_1745414446', axis=1)
+        leads_df = leads_df.rename(columns={'UF_CRM_1745414446': 'taken_in_work'})
 
         # Calculate working time
-        leads_df['time_taken_in_work'] = leads_df.apply(
-            lambda row: calculate_working_hours(row['DATE_CREATE'], row['taken_in_work']),
-            axis=1
-        )
+        if reaction_time:
+            leads_df = add_reaction_time(leads_df)
 
         return leads_df
 
     def get_users(self) -> pd.DataFrame:
         """Get users data"""
+        return get_or_compute(self.reference_cache, 'users', self.reference_ttl, self.fetch_users)
+
+    def get_statuses(self) -> pd.DataFrame:
+        """Get lead statuses"""
+        return get_or_compute(self.reference_cache, 'statuses', self.reference_ttl, self.fetch_statuses)
+
+    def get_status_list(self) -> pd.DataFrame:
+        """Get crm.status.list entries of every entity (lead statuses, deal stages of all pipelines, sources...)"""
+        return get_or_compute(self.reference_cache, 'status_list', self.reference_ttl, self.fetch_status_list)
+
+    @span('reference_data')
+    def fetch_users(self) -> pd.DataFrame:
         users = self.b24_users.get_list('user.get', select=['ID', 'NAME', 'LAST_NAME', 'SECOND_NAME'])
         users_df = pd.DataFrame(users)[['ID', 'NAME', 'LAST_NAME', 'SECOND_NAME']]
         users_df['FULL_NAME'] = users_df[['NAME', 'LAST_NAME', 'SECOND_NAME']].fillna('').agg(' '.join, axis=1).str.strip()
-        return users_df[['ID', 'FULL_NAME']]
+        return apply_schema(users_df[['ID', 'FULL_NAME']].copy(), USER_DTYPES)
 
-    def get_statuses(self) -> pd.DataFrame:
-        """Get lead statuses"""
-        statuses = self.b24_status.get_list('crm.status.list', select=['ID', 'NAME'])
-        df_status = pd.DataFrame(statuses)
-        return df_status[['STATUS_ID', 'NAME']]
+    def fetch_statuses(self) -> pd.DataFrame:
+        # crm.status.list mixes all entities; lead statuses are ENTITY_ID STATUS
+        statuses = self.get_status_list()
+        return statuses.loc[statuses['ENTITY_ID'] == 'STATUS', ['STATUS_ID', 'NAME']].reset_index(drop=True)
+
+    @span('reference_data')
+    def fetch_status_list(self) -> pd.DataFrame:
+        statuses = pd.DataFrame(self.b24_status.get_list('crm.status.list'))
+        statuses = statuses.reindex(columns=['ENTITY_ID', 'STATUS_ID', 'NAME', 'SORT'])
+        statuses['SORT'] = pd.to_numeric(statuses['SORT'], errors='coerce')
+        return statuses.sort_values(['ENTITY_ID', 'SORT'], kind='stable').reset_index(drop=True)
 
+    @span('fetch_deals')
     def get_deals_data(self, start_date: str, end_date: str, category_id: int = 0) -> pd.DataFrame:
         """Get deals data for date range"""
         deal_filter = {
@@ -93,13 +128,10 @@ class LeadsService:
         }
 
         select_fields = ["ID", "OPPORTUNITY", 'ASSIGNED_BY_ID', 'CLOSEDATE', 'UTM_SOURCE', 'UF_CRM_1695636781']
-        deals = self.b24_leads.get_list("crm.deal.list", b24_filter=deal_filter, select=select_fields)
-
-        if not deals:
-            return pd.DataFrame()
-
-        return pd.DataFrame(deals)
+        pages = self.b24_leads.iter_pages("crm.deal.list", b24_filter=deal_filter, select=select_fields)
+        return build_frame(pages, DEAL_DTYPES)
 
+    @stage('leads_metrics')
     def calculate_metrics(self, leads_df: pd.DataFrame, deals_df: pd.DataFrame, users_df: pd.DataFrame) -> Dict:
         """Calculate conversion metrics and reaction times"""
         # Filter leads with valid reaction time
@@ -121,12 +153,18 @@ class LeadsService:
         agg_leads = leads_df.groupby('ASSIGNED_BY_ID').agg({'ID': 'count'}).reset_index()
         agg_leads = agg_leads.rename(columns={'ID': 'number_of_leads'})
 
-        # Add median reaction time per manager (without trimming)
+        # Add median and p90/p95 reaction time per manager (without trimming)
         if len(leads_with_time) > 0:
             time_medians = leads_with_time.groupby('ASSIGNED_BY_ID')['time_taken_in_work'].median().reset_index()
             agg_leads = agg_leads.merge(time_medians, on='ASSIGNED_BY_ID', how='left')
+            time_tails = leads_with_time.groupby('ASSIGNED_BY_ID')['time_in_seconds'].quantile([0.9, 0.95]).unstack()
+            time_tails = time_tails.apply(pd.to_timedelta, unit='s')
+            time_tails.columns = ['reaction_p90', 'reaction_p95']
+            agg_leads = agg_leads.merge(time_tails.reset_index(), on='ASSIGNED_BY_ID', how='left')
         else:
             agg_leads['time_taken_in_work'] = pd.NaT
+            agg_leads['reaction_p90'] = pd.NaT
+            agg_leads['reaction_p95'] = pd.NaT
 
         # Aggregate deals
         if not deals_df.empty:
@@ -153,9 +191,17 @@ class LeadsService:
         else:
             dept_median = pd.NaT
 
+        # Department tails (untrimmed data)
+        if len(leads_with_time) > 0:
+            dept_p90, dept_p95 = pd.to_timedelta(leads_with_time['time_in_seconds'].quantile([0.9, 0.95]), unit='s')
+        else:
+            dept_p90, dept_p95 = pd.NaT, pd.NaT
+
         return {
-            'by_manager': full_agg_data.to_dict('records'),
+            'by_manager': to_records(full_agg_data),
             'department_median': dept_median,
+            'department_p90': dept_p90,
+            'department_p95': dept_p95,
             'total_leads': len(leads_df),
             'total_deals': len(deals_df) if not deals_df.empty else 0
         }
@@ -169,7 +215,10 @@ class LeadsService:
 
         if leads_df.empty:
             return {
-                'metrics': {'by_manager': [], 'department_median': None, 'total_leads': 0, 'total_deals': 0},
+                'metrics': {
+                    'by_manager': [], 'department_median': None, 'department_p90': None, 'department_p95': None,
+                    'total_leads': 0, 'total_deals': 0
+                },
                 'distribution': {},
                 'leads_detail': []
             }
@@ -177,32 +226,29 @@ class LeadsService:
         # Calculate metrics
         metrics = self.calculate_metrics(leads_df, deals_df, users_df)
 
-        # Distribution analysis
-        leads_by_managers = leads_df.merge(users_df, left_on='ASSIGNED_BY_ID', right_on='ID', how='inner')
-        full_data = leads_by_managers.merge(statuses_df, on='STATUS_ID', how='inner')
-        full_data = full_data.drop_duplicates()[['ID_x', 'DATE_CREATE', 'UTM_SOURCE', 'FULL_NAME', 'NAME']]
-        full_data = full_data.rename(columns={'ID_x': 'ID_lead', 'FULL_NAME': 'manager_name', 'NAME': 'status_lead'})
-
-        distribution = {
-            'by_source': full_data['UTM_SOURCE'].value_counts().to_dict(),
-            'by_manager': full_data['manager_name'].value_counts().to_dict(),
-            'by_status': full_data['status_lead'].value_counts().to_dict(),
-            'heatmap': full_data.pivot_table(
-                index='manager_name',
-                columns='status_lead',
-                values='ID_lead',
-                aggfunc='count',
-                fill_value=0
-            ).to_dict()
-        }
+        with stage('leads_distribution'):
+            # Distribution analysis
+            leads_by_managers = leads_df.merge(users_df, left_on='ASSIGNED_BY_ID', right_on='ID', how='inner')
+            full_data = leads_by_managers.merge(statuses_df, on='STATUS_ID', how='inner')
+            full_data = full_data.drop_duplicates()[
+                ['ID_x', 'ASSIGNED_BY_ID', 'STATUS_ID', 'DATE_CREATE', 'UTM_SOURCE', 'FULL_NAME', 'NAME']
+            ]
+            full_data = full_data.rename(columns={'ID_x': 'ID_lead', 'FULL_NAME': 'manager_name', 'NAME': 'status_lead'})
+
+            distribution = {
+                'by_source': value_counts_dict(full_data['UTM_SOURCE']),
+                'by_manager': value_counts_dict(full_data['manager_name']),
+                'by_status': value_counts_dict(full_data['status_lead']),
+                'heatmap': sparse_heatmap(full_data, 'manager', 'status', users_df, statuses_df)
+            }
 
-        # Leads detail for Excel export
-        leads_detail = leads_df[['ID', 'ASSIGNED_BY_ID', 'DATE_CREATE', 'taken_in_work', 'time_taken_in_work']].copy()
-        leads_detail = leads_detail.merge(users_df, left_on='ASSIGNED_BY_ID', right_on='ID', how='left')
-        leads_detail['link'] = leads_detail['ID_x'].apply(lambda x: f'https://{self.domain}/crm/lead/details/{x}/')
+            # Leads detail for Excel export
+            leads_detail = leads_df[['ID', 'ASSIGNED_BY_ID', 'DATE_CREATE', 'taken_in_work', 'time_taken_in_work']].copy()
+            leads_detail = leads_detail.merge(users_df, left_on='ASSIGNED_BY_ID', right_on='ID', how='left')
+            leads_detail['link'] = leads_detail['ID_x'].apply(lambda x: f'https://{self.domain}/crm/lead/details/{x}/')
 
         return {
             'metrics': metrics,
             'distribution': distribution,
-            'leads_detail': leads_detail.to_dict('records')
+            'leads_detail': to_records(leads_detail)
         }
@@ -0,0 +1,210 @@
+"""
+Live "today" counters for the Mini App over Server-Sent Events.
+
+One hub serves every open stream. The snapshot of today (totals,
+per-manager counts, latest reactions) is computed from the local entity
+mirror once per change: when the event worker recomputes today, or, when
+Bitrix24 events are not configured, on a poll that runs only while someone
+is watching. Each subscriber gets the full snapshot on connect and then
+only the changed fields, so N viewers cost one computation, not N.
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+import pandas as pd
+from fastapi.concurrency import run_in_threadpool
+
+from .leads_service import calculate_working_hours
+from .schema import manager_names
+
+
+def _changed(old: Dict, new: Dict) -> Dict:
+    """Keys of `new` whose values differ from `old`; removed keys map to None"""
+    delta = {key: value for key, value in new.items() if old.get(key) != value}
+    delta.update({key: None for key in old.keys() - new.keys()})
+    return delta
+
+
+def diff_snapshots(old: Dict, new: Dict) -> Dict:
+    """Delta event payload between two snapshots of the same day (empty when nothing changed)"""
+    delta = {}
+    totals = _changed(old['totals'], new['totals'])
+    if totals:
+        delta['totals'] = totals
+    managers = _changed(old['managers'], new['managers'])
+    if managers:
+        delta['managers'] = managers
+    if old['reactions'] != new['reactions']:
+        delta['reactions'] = new['reactions']
+    return delta
+
+
+def format_event(event: str, data: Dict, event_id: Optional[int] = None) -> str:
+    """One SSE message"""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class LiveHub:
+    """Today's snapshot, its version and the subscriber queues"""
+
+    def __init__(self, entity_sync, poll_seconds: float = 0, heartbeat_seconds: float = 15,
+                 recent_limit: int = 10, queue_size: int = 32):
+        self.entity_sync = entity_sync
+        self.poll_seconds = poll_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.recent_limit = recent_limit
+        self.queue_size = queue_size
+        self.snapshot: Optional[Dict] = None
+        self.version = 0
+        self.subscribers: Set[asyncio.Queue] = set()
+        self._lock = asyncio.Lock()
+        self._names: tuple = ('', {})
+        self._ticker: Optional[asyncio.Task] = None
+
+    def _manager_names(self, day: str) -> Dict[int, str]:
+        """User names, fetched once per day"""
+        if self._names[0] != day:
+            try:
+                users_df = self.entity_sync.leads_service.get_users()
+                names = manager_names(users_df)
+            except Exception as e:
+                print(f"[Live] Could not load users: {str(e)}")
+                names = self._names[1]
+            self._names = (day, names)
+        return self._names[1]
+
+    def compute_snapshot(self, day: str) -> Dict:
+        """Today's counters from the mirror (mirroring the day first if needed)"""
+        store = self.entity_sync.entity_store
+        if store.mirrored_days('lead', [day]) != {day} or store.mirrored_days('deal', [day]) != {day}:
+            self.entity_sync.recompute_days([day])
+
+        names = self._manager_names(day)
+        managers = {}
+        for manager_id, counts in store.day_counts(day).items():
+            if manager_id is None:
+                continue
+            managers[str(manager_id)] = {
+                'name': names.get(manager_id, str(manager_id)),
+                'leads': counts['leads'],
+                'deals': counts['deals'],
+                'revenue': round(float(counts['revenue']), 2)
+            }
+
+        reactions: List[Dict] = []
+        for lead in store.recent_taken(day, self.recent_limit):
+            reaction = calculate_working_hours(pd.Timestamp(lead['date_create']), pd.Timestamp(lead['taken_in_work']))
+            reactions.append({
+                'lead_id': lead['id'],
+                'manager_id': lead['assigned_by_id'],
+                'taken_at': lead['taken_in_work'],
+                'reaction_seconds': None if pd.isna(reaction) else int(reaction.total_seconds())
+            })
+
+        return {
+            'date': day,
+            'totals': {
+                'leads': sum(m['leads'] for m in managers.values()),
+                'deals': sum(m['deals'] for m in managers.values()),
+                'revenue': round(sum(m['revenue'] for m in managers.values()), 2)
+            },
+            'managers': managers,
+            'reactions': reactions
+        }
+
+    def _broadcast(self, message: str, snapshot_message: str):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow client: drop its backlog and resync it with the full snapshot
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(snapshot_message)
+
+    async def refresh(self):
+        """Recompute today and publish what changed"""
+        async with self._lock:
+            day = datetime.now().strftime('%Y-%m-%d')
+            snapshot = await run_in_threadpool(self.compute_snapshot, day)
+            previous = self.snapshot
+            if previous is not None and previous['date'] == day:
+                delta = diff_snapshots(previous, snapshot)
+                if not delta:
+                    return
+                event, data = 'delta', {'date': day, **delta}
+            else:
+                event, data = 'snapshot', snapshot
+            self.version += 1
+            self.snapshot = snapshot
+            snapshot_message = self.snapshot_message()
+            self._broadcast(format_event(event, {'version': self.version, **data}, self.version), snapshot_message)
+
+    def snapshot_message(self) -> str:
+        return format_event('snapshot', {'version': self.version, **self.snapshot}, self.version)
+
+    async def notify(self, days: List[str]):
+        """Event worker callback: days whose aggregates were just recomputed"""
+        if datetime.now().strftime('%Y-%m-%d') not in days:
+            return
+        if not self.subscribers:
+            # Nobody is watching: recompute on the next connect instead
+            self.snapshot = None
+            return
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"[Live] Refresh failed: {str(e)}")
+
+    def _resync_today(self):
+        day = datetime.now().strftime('%Y-%m-%d')
+        for kind in ('lead', 'deal'):
+            self.entity_sync.seed_day(kind, day)
+        self.entity_sync.recompute_days([day])
+
+    async def _tick(self):
+        """While subscribed: poll Bitrix24 for today (if enabled) and roll over at midnight"""
+        while self.subscribers:
+            await asyncio.sleep(self.poll_seconds or 60)
+            if not self.subscribers:
+                break
+            try:
+                if self.poll_seconds:
+                    await run_in_threadpool(self._resync_today)
+                    await self.refresh()
+                elif self.snapshot is None or self.snapshot['date'] != datetime.now().strftime('%Y-%m-%d'):
+                    await self.refresh()
+            except Exception as e:
+                print(f"[Live] Update failed: {str(e)}")
+
+    async def subscribe(self) -> asyncio.Queue:
+        """New subscriber queue, primed with the current snapshot"""
+        if self.snapshot is None or self.snapshot['date'] != datetime.now().strftime('%Y-%m-%d'):
+            await self.refresh()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        queue.put_nowait(self.snapshot_message())
+        self.subscribers.add(queue)
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.ensure_future(self._tick())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    async def stream(self):
+        """SSE body of one client: snapshot, then deltas, with comment heartbeats"""
+        queue = await self.subscribe()
+        try:
+            yield f"retry: {int(self.heartbeat_seconds * 1000)}\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    message = ": ping\n\n"
+                yield message
+        finally:
+            self.unsubscribe(queue)
@@ -0,0 +1,177 @@
+"""
+Plan progress: actual values of active plans to date, with pace projection.
+
+Daily aggregates of the union of plan ranges are loaded once (closed days
+come from the aggregate store) and turned into per-manager cumulative sums,
+so the actual value of any plan is a difference of two prefix sums - every
+plan costs O(1) no matter how long its period is.
+
+Metrics: 'leads' (number of leads), 'sales' (number of contracts),
+'revenue' (contract amount) and 'conversion' (CR%). manager_id 0 is the
+whole department.
+"""
+
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from ..core.telemetry import stage
+from .schema import manager_names
+
+DEPARTMENT_ID = 0
+
+METRIC_NAMES = {
+    'leads': "Ліди",
+    'sales': "Продажі",
+    'revenue': "Виручка",
+    'conversion': "Конверсія",
+}
+
+# Rows of the cumulative cube
+COUNTS = ['leads', 'sales', 'revenue']
+
+
+def daily_counts(merged: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """(day, ASSIGNED_BY_ID) -> leads, sales, revenue from merged aggregates"""
+    parts = []
+    leads = merged.get('leads')
+    if leads is not None and not leads.empty:
+        parts.append(leads.groupby(['day', 'ASSIGNED_BY_ID'])['number_of_leads'].sum().rename('leads'))
+    deals = merged.get('deals')
+    if deals is not None and not deals.empty:
+        grouped = deals.groupby(['day', 'ASSIGNED_BY_ID'])
+        parts.append(grouped['number_of_contracts'].sum().rename('sales'))
+        parts.append(grouped['contract_amount'].sum().rename('revenue'))
+    if not parts:
+        return pd.DataFrame(columns=COUNTS)
+    return pd.concat(parts, axis=1).reindex(columns=COUNTS).fillna(0)
+
+
+class PlanProgress:
+    """Prefix sums of daily counts per manager over a day range"""
+
+    def __init__(self, counts: pd.DataFrame, start_date: str, end_date: str):
+        self.days = pd.date_range(start_date, end_date).strftime('%Y-%m-%d')
+        self.day_index = {day: i for i, day in enumerate(self.days)}
+
+        managers = sorted(set(counts.index.get_level_values('ASSIGNED_BY_ID'))) if not counts.empty else []
+        self.manager_index = {DEPARTMENT_ID: 0}
+        self.manager_index.update({int(manager): i + 1 for i, manager in enumerate(managers)})
+
+        # cube[metric, day + 1, manager]; row 0 is the zero prefix
+        cube = np.zeros((len(COUNTS), len(self.days) + 1, len(self.manager_index)))
+        if not counts.empty:
+            counts = counts[counts.index.get_level_values('day').isin(self.day_index)]
+            day_pos = counts.index.get_level_values('day').map(self.day_index).to_numpy() + 1
+            manager_pos = counts.index.get_level_values('ASSIGNED_BY_ID').map(self.manager_index).to_numpy()
+            for m, metric in enumerate(COUNTS):
+                np.add.at(cube[m], (day_pos, manager_pos), counts[metric].to_numpy())
+            cube[:, :, 0] = cube[:, :, 1:].sum(axis=2)
+        self.cumulative = cube.cumsum(axis=1)
+
+    def totals(self, manager_ids: np.ndarray, starts: List[str], ends: List[str]) -> np.ndarray:
+        """[metric, plan] sums between start and end (inclusive) for each plan"""
+        # Plans starting after the range sum over nothing
+        first = np.array([self.day_index.get(day, len(self.days)) for day in starts])
+        last = np.maximum(np.array([self.day_index[day] + 1 for day in ends]), first)
+        managers = np.array([self.manager_index.get(int(manager), -1) for manager in manager_ids])
+        known = managers >= 0
+        managers = np.where(known, managers, 0)
+        result = self.cumulative[:, last, managers] - self.cumulative[:, first, managers]
+        return np.where(known, result, 0.0)
+
+
+@stage('plan_progress')
+def evaluate_plans(plans: List[Dict], merged: Dict[str, pd.DataFrame], as_of: str) -> List[Dict]:
+    """Progress of each plan as of a day (inclusive)"""
+    if not plans:
+        return []
+
+    start = min(plan['start_date'] for plan in plans)
+    progress = PlanProgress(daily_counts(merged), start, as_of)
+
+    elapsed_ends = [min(plan['end_date'], as_of) for plan in plans]
+    sums = progress.totals(
+        np.array([plan['manager_id'] for plan in plans]),
+        [plan['start_date'] for plan in plans],
+        elapsed_ends
+    )
+
+    as_of_day = datetime.strptime(as_of, '%Y-%m-%d')
+    results = []
+    for i, plan in enumerate(plans):
+        start_day = datetime.strptime(plan['start_date'], '%Y-%m-%d')
+        end_day = datetime.strptime(plan['end_date'], '%Y-%m-%d')
+        total_days = (end_day - start_day).days + 1
+        elapsed_days = max(0, min((as_of_day - start_day).days + 1, total_days))
+
+        leads, sales, revenue = sums[:, i]
+        target = plan['target_value']
+        if plan['metric_type'] == 'conversion':
+            actual = sales / leads * 100 if leads > 0 else 0.0
+            expected = target
+            projected = actual
+        else:
+            actual = {'leads': leads, 'sales': sales, 'revenue': revenue}.get(plan['metric_type'], 0.0)
+            expected = target * elapsed_days / total_days
+            projected = actual / elapsed_days * total_days if elapsed_days else 0.0
+
+        results.append({
+            **plan,
+            'as_of': as_of,
+            'elapsed_days': elapsed_days,
+            'total_days': total_days,
+            'actual': round(float(actual), 2),
+            'expected_to_date': round(float(expected), 2),
+            'projected': round(float(projected), 2),
+            'completion_pct': round(float(actual / target * 100), 2) if target else None,
+            'projected_pct': round(float(projected / target * 100), 2) if target else None,
+            'on_track': bool(projected >= target)
+        })
+    return results
+
+
+def plan_alert_inputs(progress: List[Dict], names: Dict[int, str] = None) -> List[Dict]:
+    """Progress rows in the `plans=` format of AlertsService.get_all_alerts (actual vs expected to date)"""
+    names = names or {}
+    inputs = []
+    for row in progress:
+        if not row['elapsed_days']:
+            continue
+        who = "Відділ" if row['manager_id'] == DEPARTMENT_ID else names.get(row['manager_id'], str(row['manager_id']))
+        inputs.append({
+            'metric_name': f"{METRIC_NAMES.get(row['metric_type'], row['metric_type'])} ({who})",
+            'planned_value': row['expected_to_date'],
+            'actual_value': row['actual'],
+            'manager_id': row['manager_id'] or None,
+            'manager_name': None if row['manager_id'] == DEPARTMENT_ID else who,
+            'period': row['as_of']
+        })
+    return inputs
+
+
+class PlanProgressService:
+    """Progress of stored plans from the report engine's daily aggregates"""
+
+    def __init__(self, plan_store, report_engine):
+        self.plan_store = plan_store
+        self.report_engine = report_engine
+
+    def get_progress(self, as_of: str, manager_id: int = None) -> List[Dict]:
+        """Progress of plans active on `as_of`"""
+        plans = self.plan_store.find(manager_id=manager_id, active_on=as_of)
+        if not plans:
+            return []
+        merged = self.report_engine.load_merged(min(plan['start_date'] for plan in plans), as_of)
+        return evaluate_plans(plans, merged, as_of)
+
+    def get_alert_inputs(self, as_of: str) -> List[Dict]:
+        """Active plans of `as_of` ready for AlertsService.get_all_alerts(plans=...)"""
+        progress = self.get_progress(as_of)
+        if not progress:
+            return []
+        users_df = self.report_engine.leads_service.get_users()
+        names = manager_names(users_df)
+        return plan_alert_inputs(progress, names)
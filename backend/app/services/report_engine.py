@@ -0,0 +1,433 @@
+"""
+Map-reduce report engine for long date ranges.
+
+A range is split into day chunks. Each chunk is fetched from Bitrix24 in the
+API process and handed to a process pool, where the heavy pandas work
+(working-time calculation, grouping) turns it into a small partial:
+counts and sums per manager/source/status plus reaction times. Partials are
+merged and rendered into the same shape as LeadsService.get_full_report and
+SalesService.get_full_report.
+
+Partials are keyed by day, reaction times are kept as one QuantileSketch
+per day and manager, so medians and percentiles of any period come from
+merged sketches instead of raw rows. Only these aggregates come back from
+the workers: per-lead rows never cross the process boundary, so reports of
+this engine carry no leads_detail (short ranges served by LeadsService do).
+At most `workers + 1` fetched chunks wait for the pool at a time.
+
+Batches of ranges (get_batch_reports) fetch the union of their days once
+and render every range from slices of that one merged result.
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from ..core.telemetry import report_stage_duration, stage
+from ..core.tracing import add_span
+from .heatmap import sparse_heatmap
+from .leads_service import LeadsService, add_reaction_time
+from .sales_service import SalesService
+from .schema import CONTRACT_TYPES, to_records
+from .sketches import QuantileSketch
+from .timeseries import build_timeseries, stored_timeseries
+
+LEAD_KEYS = ['day', 'ASSIGNED_BY_ID', 'UTM_SOURCE', 'STATUS_ID']
+DEAL_KEYS = ['day', 'ASSIGNED_BY_ID', 'UTM_SOURCE', 'UF_CRM_1695636781']
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pool(workers: int = 1) -> ProcessPoolExecutor:
+    """Shared process pool of `workers` processes (created on first use)"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, workers))
+    return _pool
+
+
+def shutdown_pool():
+    """Stop the process pool (on app shutdown)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def split_range(start_date: str, end_date: str, chunk_days: int) -> List[Tuple[str, str]]:
+    """Split inclusive YYYY-MM-DD range into chunks of chunk_days days"""
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    chunks = []
+    while start <= end:
+        chunk_end = min(start + timedelta(days=chunk_days - 1), end)
+        chunks.append((start.strftime('%Y-%m-%d'), chunk_end.strftime('%Y-%m-%d')))
+        start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def reaction_sketches(leads_df: pd.DataFrame) -> pd.DataFrame:
+    """One reaction-time sketch (seconds) per day and manager"""
+    with_time = leads_df[leads_df['time_taken_in_work'].notna()]
+    seconds = pd.to_timedelta(with_time['time_taken_in_work']).dt.total_seconds()
+    rows = [
+        {'day': day, 'ASSIGNED_BY_ID': manager_id, 'sketch': QuantileSketch().add(values.to_numpy())}
+        for (day, manager_id), values in seconds.groupby([with_time['day'], with_time['ASSIGNED_BY_ID']])
+    ]
+    return pd.DataFrame(rows, columns=['day', 'ASSIGNED_BY_ID', 'sketch'])
+
+
+def compute_partial(leads_df: pd.DataFrame, deals_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Map step (runs in a worker process): raw chunk frames -> partial aggregates"""
+    partial = {}
+
+    if not leads_df.empty:
+        leads_df = add_reaction_time(leads_df)
+        leads_df['day'] = leads_df['DATE_CREATE'].dt.strftime('%Y-%m-%d')
+        partial['leads'] = leads_df.groupby(LEAD_KEYS, observed=True, dropna=False).size() \
+            .rename('number_of_leads').reset_index()
+        partial['reaction'] = reaction_sketches(leads_df)
+
+    if not deals_df.empty:
+        deals_df = deals_df.assign(day=deals_df['CLOSEDATE'].dt.strftime('%Y-%m-%d'))
+        partial['deals'] = deals_df.groupby(DEAL_KEYS, observed=True, dropna=False).agg(
+            number_of_contracts=('ID', 'count'),
+            contract_amount=('OPPORTUNITY', 'sum')
+        ).reset_index()
+
+    return partial
+
+
+def timed_partial(leads_df: pd.DataFrame, deals_df: pd.DataFrame) -> Tuple[Dict[str, pd.DataFrame], float]:
+    """compute_partial plus its duration (metrics of worker processes are not collected)"""
+    started = time.perf_counter()
+    partial = compute_partial(leads_df, deals_df)
+    return partial, time.perf_counter() - started
+
+
+@stage('merge_partials')
+def merge_partials(partials: List[Dict[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """Reduce step: combine partial aggregates of several chunks"""
+    frames: Dict[str, List[pd.DataFrame]] = {}
+    for partial in partials:
+        for name, frame in partial.items():
+            frames.setdefault(name, []).append(frame)
+
+    merged = {name: pd.concat(parts, ignore_index=True) for name, parts in frames.items()}
+
+    if 'leads' in merged:
+        merged['leads'] = merged['leads'].groupby(LEAD_KEYS, observed=True, dropna=False)['number_of_leads'].sum().reset_index()
+    if 'deals' in merged:
+        merged['deals'] = merged['deals'].groupby(DEAL_KEYS, observed=True, dropna=False)[
+            ['number_of_contracts', 'contract_amount']
+        ].sum().reset_index()
+
+    return merged
+
+
+def slice_merged(merged: Dict[str, pd.DataFrame], start_date: str, end_date: str) -> Dict[str, pd.DataFrame]:
+    """Rows of merged partials within the range"""
+    return {name: frame[(frame['day'] >= start_date) & (frame['day'] <= end_date)] for name, frame in merged.items()}
+
+
+def _as_timedelta(seconds: Optional[float]):
+    return pd.NaT if seconds is None else pd.to_timedelta(seconds, unit='s')
+
+
+def reaction_by_manager(reaction: pd.DataFrame) -> pd.DataFrame:
+    """Median/p90/p95 reaction per manager from merged day sketches"""
+    rows = []
+    for manager_id, sketches in reaction.groupby('ASSIGNED_BY_ID')['sketch']:
+        sketch = QuantileSketch.merged(sketches)
+        rows.append({
+            'ASSIGNED_BY_ID': manager_id,
+            'time_taken_in_work': _as_timedelta(sketch.quantile(0.5)),
+            'reaction_p90': _as_timedelta(sketch.quantile(0.9)),
+            'reaction_p95': _as_timedelta(sketch.quantile(0.95)),
+        })
+    columns = ['ASSIGNED_BY_ID', 'time_taken_in_work', 'reaction_p90', 'reaction_p95']
+    return pd.DataFrame(rows, columns=columns).astype({'ASSIGNED_BY_ID': 'int32'})
+
+
+@stage('leads_report')
+def build_leads_report(merged: Dict[str, pd.DataFrame], users_df: pd.DataFrame, statuses_df: pd.DataFrame) -> Dict:
+    """Render merged partials into LeadsService.get_full_report shape"""
+    leads = merged.get('leads')
+    if leads is None or leads.empty:
+        return {
+            'metrics': {
+                'by_manager': [], 'department_median': None, 'department_p90': None, 'department_p95': None,
+                'total_leads': 0, 'total_deals': 0
+            },
+            'distribution': {},
+            'leads_detail': []
+        }
+
+    reaction = merged.get('reaction', pd.DataFrame(columns=['day', 'ASSIGNED_BY_ID', 'sketch']))
+    deals = merged.get('deals')
+
+    # Metrics by manager
+    agg_leads = leads.groupby('ASSIGNED_BY_ID')['number_of_leads'].sum().reset_index()
+    agg_leads = agg_leads.merge(reaction_by_manager(reaction), on='ASSIGNED_BY_ID', how='left')
+
+    if deals is not None and not deals.empty:
+        agg_deals = deals.groupby('ASSIGNED_BY_ID')['number_of_contracts'].sum().rename('number_of_deals').reset_index()
+        total_deals = int(deals['number_of_contracts'].sum())
+    else:
+        agg_deals = pd.DataFrame({'ASSIGNED_BY_ID': agg_leads['ASSIGNED_BY_ID'], 'number_of_deals': 0})
+        total_deals = 0
+
+    full_agg_data = agg_leads.merge(agg_deals, how='left', on='ASSIGNED_BY_ID')
+    full_agg_data['number_of_deals'] = full_agg_data['number_of_deals'].fillna(0)
+    full_agg_data['CR%'] = round(full_agg_data.number_of_deals / full_agg_data.number_of_leads * 100, 2)
+    full_agg_data = full_agg_data.merge(users_df, left_on='ASSIGNED_BY_ID', right_on='ID', how='left')
+
+    department = QuantileSketch.merged(reaction['sketch'])
+    metrics = {
+        'by_manager': to_records(full_agg_data),
+        'department_median': _as_timedelta(department.trimmed_median()),
+        'department_p90': _as_timedelta(department.quantile(0.9)),
+        'department_p95': _as_timedelta(department.quantile(0.95)),
+        'total_leads': int(leads['number_of_leads'].sum()),
+        'total_deals': total_deals
+    }
+
+    # Distribution analysis
+    full_data = leads.merge(users_df, left_on='ASSIGNED_BY_ID', right_on='ID', how='inner')
+    full_data = full_data.merge(statuses_df.drop_duplicates(), on='STATUS_ID', how='inner')
+    full_data = full_data.rename(columns={'FULL_NAME': 'manager_name', 'NAME': 'status_lead'})
+
+    def counts(column: str) -> Dict:
+        totals = full_data.groupby(column, observed=True)['number_of_leads'].sum()
+        return totals[totals > 0].sort_values(ascending=False, kind='stable').to_dict()
+
+    distribution = {
+        'by_source': counts('UTM_SOURCE'),
+        'by_manager': counts('manager_name'),
+        'by_status': counts('status_lead'),
+        'heatmap': sparse_heatmap(full_data, 'manager', 'status', users_df, statuses_df, weights='number_of_leads')
+    }
+
+    return {
+        'metrics': metrics,
+        'distribution': distribution,
+        # Per-lead rows are not aggregated (see module docstring)
+        'leads_detail': []
+    }
+
+
+@stage('sales_report')
+def build_sales_report(merged: Dict[str, pd.DataFrame], users_df: pd.DataFrame) -> Dict:
+    """Render merged partials into SalesService.get_full_report shape"""
+    deals = merged.get('deals')
+    if deals is None or deals.empty:
+        return {
+            'total_amount': 0,
+            'total_contracts': 0,
+            'by_manager': [],
+            'by_source': [],
+            'by_type': []
+        }
+
+    full_data = deals.merge(users_df, how='inner', left_on='ASSIGNED_BY_ID', right_on='ID')
+    full_data = full_data.rename(columns={'FULL_NAME': 'manager', 'UF_CRM_1695636781': 'type_contract'})
+    full_data['type_contract'] = full_data['type_contract'].map(lambda code: CONTRACT_TYPES.get(code, code))
+
+    def by(column: str, sort: bool = True) -> pd.DataFrame:
+        data = full_data.groupby(column, observed=True)[['contract_amount', 'number_of_contracts']].sum()
+        if sort:
+            data = data.sort_values('contract_amount', ascending=False)
+        return data.reset_index()
+
+    return {
+        'total_amount': float(full_data['contract_amount'].sum()),
+        'total_contracts': int(full_data['number_of_contracts'].sum()),
+        'by_manager': to_records(by('manager')),
+        'by_source': to_records(by('UTM_SOURCE')),
+        'by_type': to_records(by('type_contract', sort=False))
+    }
+
+
+@stage('daily_frames')
+def daily_frames(merged: Dict[str, pd.DataFrame], users_df: pd.DataFrame,
+                 start_date: str, end_date: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    (managers, totals) frames for the rule engine:
+    managers - one row per day and manager with leads, deals, CR% and median reaction;
+    totals - one row per day of the range with total leads, contracts and amount.
+    """
+    days = pd.date_range(start_date, end_date).strftime('%Y-%m-%d')
+    leads = merged.get('leads', pd.DataFrame(columns=LEAD_KEYS + ['number_of_leads']))
+    deals = merged.get('deals', pd.DataFrame(columns=DEAL_KEYS + ['number_of_contracts', 'contract_amount']))
+    reaction = merged.get('reaction', pd.DataFrame(columns=['day', 'ASSIGNED_BY_ID', 'sketch']))
+
+    by_day_manager = ['day', 'ASSIGNED_BY_ID']
+    managers = leads.groupby(by_day_manager)['number_of_leads'].sum().to_frame()
+    managers = managers.join(
+        deals.groupby(by_day_manager)['number_of_contracts'].sum().rename('number_of_deals'), how='left'
+    )
+    managers['number_of_deals'] = managers['number_of_deals'].fillna(0)
+    managers['CR%'] = round(managers['number_of_deals'] / managers['number_of_leads'] * 100, 2)
+
+    medians = reaction.set_index(by_day_manager)['sketch'].map(lambda sketch: sketch.quantile(0.5))
+    managers = managers.join(medians.rename('reaction_seconds').astype(float), how='left').reset_index()
+
+    names = users_df.set_index('ID')['FULL_NAME'].astype(object)
+    managers['manager_name'] = managers['ASSIGNED_BY_ID'].map(names).fillna('Unknown')
+    managers = managers[managers['day'].isin(days)].rename(columns={'day': 'period'})
+
+    totals = pd.DataFrame({
+        'total_leads': leads.groupby('day')['number_of_leads'].sum(),
+        'total_contracts': deals.groupby('day')['number_of_contracts'].sum(),
+        'total_amount': deals.groupby('day')['contract_amount'].sum(),
+    }).reindex(days, fill_value=0).fillna(0)
+    totals = totals.rename_axis('period').reset_index()
+
+    return managers, totals
+
+
+def contiguous_runs(days: List[str]) -> List[Tuple[str, str]]:
+    """Group sorted YYYY-MM-DD days into inclusive (start, end) runs of consecutive days"""
+    runs = []
+    for day in days:
+        if runs and (datetime.strptime(day, '%Y-%m-%d') - datetime.strptime(runs[-1][1], '%Y-%m-%d')).days == 1:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+class ReportEngine:
+    """Computes leads and sales reports for long ranges over day chunks in a process pool"""
+
+    def __init__(self, leads_service: LeadsService, sales_service: SalesService,
+                 workers: int = 1, chunk_days: int = 7, min_days: int = 14, store=None, entities=None):
+        self.leads_service = leads_service
+        self.sales_service = sales_service
+        self.workers = workers
+        self.chunk_days = chunk_days
+        self.min_days = min_days
+        # Optional AggregateStore: daily partials are persisted and reused
+        self.store = store
+        # Optional EntityStore: days synced into the store are mirrored too (lead -> deal links)
+        self.entities = entities
+
+    def compute_chunks(self, chunks: List[Tuple[str, str]], leads: bool = True,
+                       mirror: bool = False) -> List[Tuple[Tuple[str, str], Dict[str, pd.DataFrame]]]:
+        """
+        Fetch chunks one by one and compute their partials in the pool (deals only with leads=False).
+        With mirror=True the fetched days are also written to the entity store.
+        """
+        pool = get_pool(self.workers)
+        futures = deque()
+        results = []
+
+        def collect():
+            chunk, future = futures.popleft()
+            partial, seconds = future.result()
+            report_stage_duration.observe(seconds, stage='compute_partial')
+            add_span('compute_partial', seconds)
+            results.append((chunk, partial))
+
+        for chunk_start, chunk_end in chunks:
+            # Fetching stays sequential (Bitrix24 rate limits), the pool works meanwhile
+            leads_df = self.leads_service.get_leads_data(chunk_start, chunk_end, reaction_time=False) \
+                if leads else pd.DataFrame()
+            deals_df = self.sales_service.get_deals_data(chunk_start, chunk_end)
+            if mirror and leads and self.entities is not None:
+                days = list(pd.date_range(chunk_start, chunk_end).strftime('%Y-%m-%d'))
+                self.entities.mirror_report_frames(days, leads_df, deals_df)
+            futures.append(((chunk_start, chunk_end), pool.submit(timed_partial, leads_df, deals_df)))
+            # Raw frames of submitted chunks stay in this process until their worker is done
+            if len(futures) > self.workers:
+                collect()
+
+        while futures:
+            collect()
+        return results
+
+    def compute_merged(self, start_date: str, end_date: str) -> Dict[str, pd.DataFrame]:
+        """Merged partials of the range computed from Bitrix24"""
+        chunks = split_range(start_date, end_date, self.chunk_days)
+        return merge_partials([partial for _, partial in self.compute_chunks(chunks)])
+
+    def sync_days(self, start_date: str, end_date: str) -> int:
+        """Fetch days missing from the aggregate store; returns number of days fetched"""
+        missing = self.store.missing_days(start_date, end_date)
+        chunks = [
+            chunk
+            for run_start, run_end in contiguous_runs(missing)
+            for chunk in split_range(run_start, run_end, self.chunk_days)
+        ]
+        for (chunk_start, chunk_end), partial in self.compute_chunks(chunks, mirror=True):
+            days = list(pd.date_range(chunk_start, chunk_end).strftime('%Y-%m-%d'))
+            self.store.save_partial(partial, days, rollups=False)
+        # Rollup periods shared by several chunks are recomputed once
+        self.store.refresh_rollups(missing)
+        return len(missing)
+
+    def load_merged(self, start_date: str, end_date: str) -> Dict[str, pd.DataFrame]:
+        """Merged aggregates of the range, from the store when configured"""
+        if self.store is None:
+            return self.compute_merged(start_date, end_date)
+        self.sync_days(start_date, end_date)
+        return self.store.load(start_date, end_date)
+
+    def get_daily_frames(self, start_date: str, end_date: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Per-day (managers, totals) frames of the range"""
+        merged = self.load_merged(start_date, end_date)
+        return daily_frames(merged, self.leads_service.get_users(), start_date, end_date)
+
+    def get_timeseries(self, start_date: str, end_date: str, grain: str = 'daily', breakdown: Optional[str] = None) -> Dict:
+        """Trend series of the range, from the store's rollups when configured"""
+        users_df = self.leads_service.get_users() if breakdown == 'manager' else None
+        if self.store is None:
+            return build_timeseries(self.compute_merged(start_date, end_date), start_date, end_date, grain, breakdown, users_df)
+        self.sync_days(start_date, end_date)
+        return stored_timeseries(self.store, start_date, end_date, grain, breakdown, users_df)
+
+    def get_full_reports(self, start_date: str, end_date: str) -> Tuple[Dict, Dict]:
+        """(leads_report, sales_report) for the range"""
+        days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+        if days < self.min_days:
+            return (
+                self.leads_service.get_full_report(start_date, end_date),
+                self.sales_service.get_full_report(start_date, end_date)
+            )
+
+        merged = self.compute_merged(start_date, end_date)
+        users_df = self.leads_service.get_users()
+        statuses_df = self.leads_service.get_statuses()
+
+        return (
+            build_leads_report(merged, users_df, statuses_df),
+            build_sales_report(merged, users_df)
+        )
+
+    def get_batch_reports(self, ranges: List[Tuple[str, str]], sections: Tuple[str, ...] = ('leads', 'sales')) -> List[Dict]:
+        """Reports of several ranges: the union of their days is fetched once, each range is a slice of it"""
+        days = sorted({day for start, end in ranges for day in pd.date_range(start, end).strftime('%Y-%m-%d')})
+        chunks = [
+            chunk
+            for run_start, run_end in contiguous_runs(days)
+            for chunk in split_range(run_start, run_end, self.chunk_days)
+        ]
+        # Deals are always fetched (the leads report counts them); leads only for the leads section
+        merged = merge_partials([partial for _, partial in self.compute_chunks(chunks, leads='leads' in sections)])
+        users_df = self.leads_service.get_users()
+        statuses_df = self.leads_service.get_statuses() if 'leads' in sections else None
+
+        reports = []
+        for start_date, end_date in ranges:
+            part = slice_merged(merged, start_date, end_date)
+            report = {'start_date': start_date, 'end_date': end_date}
+            if 'leads' in sections:
+                report['leads'] = build_leads_report(part, users_df, statuses_df)
+            if 'sales' in sections:
+                report['sales'] = build_sales_report(part, users_df)
+            reports.append(report)
+        return reports
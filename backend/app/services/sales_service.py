@@ -2,17 +2,27 @@ from datetime import datetime, timedelta
 import pandas as pd
 from typing import Dict, List, Optional
 from .b24_service import B24Service
+from .schema import apply_schema, build_frame, to_records, DEAL_DTYPES, USER_DTYPES, CONTRACT_TYPES
+from ..core.cache import get_or_compute
+from ..core.telemetry import finmap_call_duration, finmap_calls, stage
+from ..core.tracing import count_upstream, span
 import requests
+import time
 
 
 class SalesService:
     """Service for working with sales data"""
 
-    def __init__(self, domain: str, user_id: int, deals_token: str, users_token: str):
+    def __init__(self, domain: str, user_id: int, deals_token: str, users_token: str,
+                 reference_cache=None, reference_ttl: float = 0):
         self.b24_deals = B24Service(domain, user_id, deals_token)
         self.b24_users = B24Service(domain, user_id, users_token)
         self.domain = domain
+        # Optional ReportCache for users, fresh for reference_ttl seconds
+        self.reference_cache = reference_cache
+        self.reference_ttl = reference_ttl
 
+    @span('fetch_deals')
     def get_deals_data(self, start_date: str, end_date: str, category_id: int = 0) -> pd.DataFrame:
         """Get deals data for date range"""
         deal_filter = {
@@ -22,20 +32,20 @@ class SalesService:
             'STAGE_ID': 'WON'
         }
 
-        select_fields = ["ID", "OPPORTUNITY", 'ASSIGNED_BY_ID', 'CLOSEDATE', 'UTM_SOURCE', 'UF_CRM_1695636781']
-        deals = self.b24_deals.get_list("crm.deal.list", b24_filter=deal_filter, select=select_fields)
-
-        if not deals:
-            return pd.DataFrame()
-
-        return pd.DataFrame(deals)
+        select_fields = ["ID", "OPPORTUNITY", 'ASSIGNED_BY_ID', 'CLOSEDATE', 'UTM_SOURCE', 'UF_CRM_1695636781', 'LEAD_ID']
+        pages = self.b24_deals.iter_pages("crm.deal.list", b24_filter=deal_filter, select=select_fields)
+        return build_frame(pages, DEAL_DTYPES)
 
     def get_users(self) -> pd.DataFrame:
         """Get users data"""
+        return get_or_compute(self.reference_cache, 'users', self.reference_ttl, self.fetch_users)
+
+    @span('reference_data')
+    def fetch_users(self) -> pd.DataFrame:
         users = self.b24_users.get_list('user.get', select=['ID', 'NAME', 'LAST_NAME', 'SECOND_NAME'])
         users_df = pd.DataFrame(users)[['ID', 'NAME', 'LAST_NAME', 'SECOND_NAME']]
         users_df['FULL_NAME'] = users_df[['NAME', 'LAST_NAME', 'SECOND_NAME']].fillna('').agg(' '.join, axis=1).str.strip()
-        return users_df[['ID', 'FULL_NAME']]
+        return apply_schema(users_df[['ID', 'FULL_NAME']].copy(), USER_DTYPES)
 
     def get_full_report(self, start_date: str, end_date: str) -> Dict:
         """Get full sales report with all analytics"""
@@ -51,59 +61,59 @@ class SalesService:
                 'by_type': []
             }
 
-        # Transform data
-        full_data = deals_df.merge(users_df, how='inner', left_on='ASSIGNED_BY_ID', right_on='ID')
-        full_data["OPPORTUNITY"] = full_data["OPPORTUNITY"].astype(float)
-        full_data = full_data.rename(columns={
-            'ID_x': 'deal_id',
-            'OPPORTUNITY': 'contract_amount',
-            'FULL_NAME': 'manager',
-            'UF_CRM_1695636781': 'type_contract'
-        })
-
-        # Replace contract type codes
-        full_data.type_contract = full_data.type_contract.replace({
-            '1206': 'Банкрутство',
-            '1207': 'Досудове'
-        })
-
-        # Analysis by contract type
-        type_contracts_data = full_data.groupby('type_contract').agg({
-            'contract_amount': 'sum',
-            'deal_id': 'count'
-        }).reset_index().rename(columns={'deal_id': 'number_of_contracts'})
-
-        # Analysis by managers
-        data_sales_by_managers = full_data.groupby('manager').aggregate({
-            'contract_amount': 'sum',
-            'CLOSEDATE': 'count'
-        }).sort_values('contract_amount', ascending=False).reset_index()
-        data_sales_by_managers = data_sales_by_managers.rename(columns={'CLOSEDATE': 'number_of_contracts'})
-
-        # Analysis by sources
-        data_sales_by_source = full_data.groupby('UTM_SOURCE').aggregate({
-            'contract_amount': 'sum',
-            'CLOSEDATE': 'count'
-        }).sort_values('contract_amount', ascending=False).reset_index()
-        data_sales_by_source = data_sales_by_source.rename(columns={'CLOSEDATE': 'number_of_contracts'})
+        with stage('sales_report'):
+            # Transform data
+            full_data = deals_df.merge(users_df, how='inner', left_on='ASSIGNED_BY_ID', right_on='ID')
+            full_data = full_data.rename(columns={
+                'ID_x': 'deal_id',
+                'OPPORTUNITY': 'contract_amount',
+                'FULL_NAME': 'manager',
+                'UF_CRM_1695636781': 'type_contract'
+            })
+
+            # Replace contract type codes
+            full_data.type_contract = full_data.type_contract.cat.rename_categories(
+                lambda code: CONTRACT_TYPES.get(code, code)
+            )
+
+            # Analysis by contract type
+            type_contracts_data = full_data.groupby('type_contract', observed=True).agg({
+                'contract_amount': 'sum',
+                'deal_id': 'count'
+            }).reset_index().rename(columns={'deal_id': 'number_of_contracts'})
+
+            # Analysis by managers
+            data_sales_by_managers = full_data.groupby('manager', observed=True).aggregate({
+                'contract_amount': 'sum',
+                'CLOSEDATE': 'count'
+            }).sort_values('contract_amount', ascending=False).reset_index()
+            data_sales_by_managers = data_sales_by_managers.rename(columns={'CLOSEDATE': 'number_of_contracts'})
+
+            # Analysis by sources
+            data_sales_by_source = full_data.groupby('UTM_SOURCE', observed=True).aggregate({
+                'contract_amount': 'sum',
+                'CLOSEDATE': 'count'
+            }).sort_values('contract_amount', ascending=False).reset_index()
+            data_sales_by_source = data_sales_by_source.rename(columns={'CLOSEDATE': 'number_of_contracts'})
 
         return {
             'total_amount': float(full_data['contract_amount'].sum()),
             'total_contracts': int(full_data.shape[0]),
-            'by_manager': data_sales_by_managers.to_dict('records'),
-            'by_source': data_sales_by_source.to_dict('records'),
-            'by_type': type_contracts_data.to_dict('records')
+            'by_manager': to_records(data_sales_by_managers),
+            'by_source': to_records(data_sales_by_source),
+            'by_type': to_records(type_contracts_data)
         }
 
 
 class FinmapService:
     """Service for working with Finmap API"""
 
-    def __init__(self, api_key: str, company_id: str = ""):
+    def __init__(self, api_key: str, company_id: str = "", base_url: str = "https://api.finmap.online/v2.2"):
         self.api_key = api_key
         self.company_id = company_id
-        self.base_url = "https://api.finmap.online/v2.2"
+        self.base_url = base_url.rstrip('/')
 
+    @span('finmap')
     def get_income_for_date(self, target_date: str) -> Dict:
         """
         Get income operations for specific date
@@ -158,12 +168,22 @@ class FinmapService:
                 body.update({"dateFrom": start_ms, "dateTo": end_ms})
 
             try:
-                response = requests.post(
-                    f"{self.base_url}/operations/list",
-                    json=body,
-                    headers=headers,
-                    timeout=30
-                )
+                started = time.perf_counter()
+                try:
+                    response = requests.post(
+                        f"{self.base_url}/operations/list",
+                        json=body,
+                        headers=headers,
+                        timeout=30
+                    )
+                    finmap_calls.inc(status=response.status_code)
+                except Exception:
+                    finmap_calls.inc(status='error')
+                    raise
+                finally:
+                    seconds = time.perf_counter() - started
+                    finmap_call_duration.observe(seconds)
+                    count_upstream('finmap', 'operations/list', calls=1, seconds=seconds)
 
                 if response.status_code in (400, 422) and not use_alt_dates:
                     use_alt_dates = True
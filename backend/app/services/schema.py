@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional
+
+
+# Portal timezone used for all timestamps coming from Bitrix24
+TIMEZONE = "Europe/Kyiv"
+
+# Contract type codes of UF_CRM_1695636781
+CONTRACT_TYPES = {
+    '1206': 'Банкрутство',
+    '1207': 'Досудове'
+}
+
+# Target dtypes of the ingest step. IDs are integers so every merge/groupby
+# works on integer keys, repeated labels are categorical.
+LEAD_DTYPES = {
+    'ID': 'int64',
+    'ASSIGNED_BY_ID': 'int32',
+    'STATUS_ID': 'category',
+    'UTM_SOURCE': 'category',
+    'DATE_CREATE': 'datetime',
+    'UF_CRM_1745414446': 'datetime',
+}
+
+DEAL_DTYPES = {
+    'ID': 'int64',
+    'ASSIGNED_BY_ID': 'int32',
+    'OPPORTUNITY': 'float64',
+    'CLOSEDATE': 'datetime',
+    'UTM_SOURCE': 'category',
+    'UF_CRM_1695636781': 'category',
+    'LEAD_ID': 'int64',  # lead the deal was converted from, 0 if none
+}
+
+# Deals as mirrored by the local entity store (any stage and pipeline)
+ENTITY_DEAL_DTYPES = {
+    **DEAL_DTYPES,
+    'STAGE_ID': 'category',
+    'CATEGORY_ID': 'int32',
+}
+
+USER_DTYPES = {
+    'ID': 'int32',
+    'FULL_NAME': 'category',
+}
+
+# crm.stagehistory.list records: leads carry STATUS_*, deals STAGE_* and CATEGORY_ID
+STAGE_HISTORY_DTYPES = {
+    'ID': 'int64',
+    'TYPE_ID': 'int32',
+    'OWNER_ID': 'int64',
+    'CREATED_TIME': 'datetime',
+    'CATEGORY_ID': 'int32',
+    'STATUS_ID': 'category',
+    'STATUS_SEMANTIC_ID': 'category',
+    'STAGE_ID': 'category',
+    'STAGE_SEMANTIC_ID': 'category',
+}
+
+
+def manager_names(users_df: Optional[pd.DataFrame]) -> Dict[int, str]:
+    """User ID -> full name of a users frame (LeadsService.get_users); empty without one"""
+    if users_df is None or users_df.empty:
+        return {}
+    return dict(zip(users_df['ID'].astype(int).tolist(), users_df['FULL_NAME'].astype(str).tolist()))
+
+
+def to_datetime(series: pd.Series) -> pd.Series:
+    """Parse Bitrix24 timestamps into datetime64 in portal timezone"""
+    parsed = pd.to_datetime(series, utc=True, errors='coerce')
+    return parsed.dt.tz_convert(TIMEZONE)
+
+
+def coerce_column(series: pd.Series, dtype: str) -> pd.Series:
+    """Convert one raw JSON column to its schema dtype"""
+    if dtype == 'datetime':
+        return to_datetime(series)
+    if dtype.startswith('int'):
+        return pd.to_numeric(series, errors='coerce').fillna(0).astype(dtype)
+    if dtype == 'float64':
+        return pd.to_numeric(series, errors='coerce').fillna(0.0).astype(dtype)
+    if dtype == 'category':
+        return series.replace('', None).astype('category')
+    return series.astype(dtype)
+
+
+def apply_schema(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Apply typed schema to a frame built from raw JSON"""
+    for column, dtype in dtypes.items():
+        if column in df.columns:
+            df[column] = coerce_column(df[column], dtype)
+    return df
+
+
+class FrameBuilder:
+    """
+    Builds a typed frame from Bitrix24 pages without keeping the raw dicts.
+    Page values are staged per column and encoded every `chunk_rows` rows
+    into compact buffers (int codes for categories, int64/float64/datetime64
+    arrays), so peak memory is the typed frame plus one chunk of values.
+    """
+
+    def __init__(self, dtypes: Dict[str, str], chunk_rows: int = 5000):
+        self.dtypes = dtypes
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self._pending: Dict[str, list] = {column: [] for column in dtypes}
+        self._pending_rows = 0
+        self._buffers: Dict[str, List[np.ndarray]] = {column: [] for column in dtypes}
+        self._categories: Dict[str, Dict[str, int]] = {
+            column: {} for column, dtype in dtypes.items() if dtype == 'category'
+        }
+
+    def _encode(self, column: str, dtype: str, values: list) -> np.ndarray:
+        if dtype == 'category':
+            codes = self._categories[column]
+            return np.array(
+                [-1 if value in (None, '') else codes.setdefault(value, len(codes)) for value in values],
+                dtype='int32'
+            )
+        if dtype == 'datetime':
+            parsed = pd.to_datetime(pd.Series(values, dtype=object), utc=True, errors='coerce', format='ISO8601')
+            return parsed.dt.tz_localize(None).to_numpy()
+        return coerce_column(pd.Series(values, dtype=object), dtype).to_numpy()
+
+    def _flush(self):
+        if not self._pending_rows:
+            return
+        for column, dtype in self.dtypes.items():
+            self._buffers[column].append(self._encode(column, dtype, self._pending[column]))
+            self._pending[column] = []
+        self._pending_rows = 0
+
+    def add_page(self, page: List[Dict]):
+        """Stage one page of entities, encoding once a chunk is full"""
+        if not page:
+            return
+        for column in self.dtypes:
+            self._pending[column].extend(entity.get(column) for entity in page)
+        self._pending_rows += len(page)
+        self.rows += len(page)
+        if self._pending_rows >= self.chunk_rows:
+            self._flush()
+
+    def add_pages(self, pages: Iterable[List[Dict]]) -> 'FrameBuilder':
+        for page in pages:
+            self.add_page(page)
+        return self
+
+    def build(self) -> pd.DataFrame:
+        """Concatenate buffers into the final typed frame"""
+        self._flush()
+        if not self.rows:
+            return pd.DataFrame()
+
+        columns = {}
+        for column, dtype in self.dtypes.items():
+            values = np.concatenate(self._buffers[column])
+            self._buffers[column] = []
+            if dtype == 'category':
+                columns[column] = pd.Categorical.from_codes(values, categories=list(self._categories[column]))
+            elif dtype == 'datetime':
+                columns[column] = pd.Series(values).dt.tz_localize('UTC').dt.tz_convert(TIMEZONE)
+            else:
+                columns[column] = values
+        return pd.DataFrame(columns)
+
+
+def build_frame(pages: Iterable[List[Dict]], dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Typed frame from an iterator of Bitrix24 pages"""
+    return FrameBuilder(dtypes).add_pages(pages).build()
+
+
+def value_counts_dict(series: pd.Series) -> Dict:
+    """value_counts().to_dict() that skips unused categories"""
+    counts = series.value_counts()
+    return counts[counts > 0].to_dict()
+
+
+def to_records(df: pd.DataFrame) -> List[Dict]:
+    """to_dict('records') that keeps missing categorical values as None"""
+    df = df.copy()
+    for column in df.select_dtypes('category').columns:
+        df[column] = df[column].astype(object).where(df[column].notna(), None)
+    return df.to_dict('records')
@@ -0,0 +1,283 @@
+"""
+Stage history ingestion and funnel velocity.
+
+StageHistorySync copies crm.stagehistory.list of leads (entityTypeId 1) and
+deals (2) into the StageHistoryStore: records above the stored watermark, in
+ID order, up to 50 pages per batch request (B24Service.iter_after_id),
+written every few thousand rows so an interrupted first sync resumes where
+it stopped. The first sync copies the whole history and is run by
+app.commands.sync_stage_history; after it, report requests top up above
+the watermark with a page cap (one request when nothing moved) and never
+wait behind another sync of the same kind.
+
+A stay is the time from an entity entering a stage to its next transition.
+Stays of all owners are computed at once on arrays ordered by owner and
+time: a stay ends at the next row if that row has the same owner. Records
+repeating the owner's current stage continue the stay. Stays without a next
+transition are open; stays in final stages (semantic S or F) never end and
+are left out of the time percentiles.
+
+Managers are the owners' current ASSIGNED_BY_ID in the entity mirror;
+owners the mirror does not have are fetched by ID first.
+"""
+
+import threading
+import time
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..core.telemetry import stage
+from .schema import STAGE_HISTORY_DTYPES, TIMEZONE, build_frame, manager_names
+
+# entityTypeId of each kind
+KINDS = {'lead': 1, 'deal': 2}
+
+FIELDS = {
+    'lead': ['ID', 'TYPE_ID', 'OWNER_ID', 'CREATED_TIME', 'STATUS_ID', 'STATUS_SEMANTIC_ID'],
+    'deal': ['ID', 'TYPE_ID', 'OWNER_ID', 'CREATED_TIME', 'CATEGORY_ID', 'STAGE_ID', 'STAGE_SEMANTIC_ID'],
+}
+
+# Final stage semantics: success and failure
+FINAL = ('S', 'F')
+
+PERCENTILES = {'p50': 0.5, 'p75': 0.75, 'p90': 0.9, 'p95': 0.95}
+
+# Pages (50 records each) written to the store at once
+STORE_PAGES = 100
+
+
+def range_bounds(start_date: str, end_date: str) -> Tuple[int, int]:
+    """Unix seconds of the range's first moment and of the day after it, in portal time"""
+    start = pd.Timestamp(start_date).tz_localize(TIMEZONE)
+    end = (pd.Timestamp(end_date) + pd.Timedelta(days=1)).tz_localize(TIMEZONE)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def transition_rows(kind: str, df: pd.DataFrame) -> pd.DataFrame:
+    """History records (STAGE_HISTORY_DTYPES frame) as StageHistoryStore rows"""
+    prefix = 'STATUS' if kind == 'lead' else 'STAGE'
+    df = df[df['CREATED_TIME'].notna() & df[f'{prefix}_ID'].notna()]
+    semantic = df[f'{prefix}_SEMANTIC_ID'].astype(object)
+    return pd.DataFrame({
+        'id': df['ID'],
+        'owner_id': df['OWNER_ID'],
+        'type_id': df['TYPE_ID'],
+        'category_id': df['CATEGORY_ID'] if kind == 'deal' else None,
+        'stage': df[f'{prefix}_ID'].astype(object),
+        'semantic': semantic.where(semantic.notna(), None),
+        'created_at': df['CREATED_TIME'].dt.tz_convert('UTC').dt.tz_localize(None)
+        .to_numpy('datetime64[s]').astype('int64'),
+    })
+
+
+class StageHistorySync:
+    """Incremental ingestion of crm.stagehistory.list into the stage history store"""
+
+    def __init__(self, leads_service, sales_service, store, entity_sync):
+        self.clients = {'lead': leads_service.b24_leads, 'deal': sales_service.b24_deals}
+        self.store = store
+        self.entity_sync = entity_sync
+        self._locks = {kind: threading.Lock() for kind in KINDS}
+        # Owners fetched by ID that Bitrix24 no longer has (deleted entities)
+        self._gone: Dict[str, Set[int]] = {kind: set() for kind in KINDS}
+
+    def ingested(self, kind: str) -> bool:
+        """Whether the kind's first sync has run (its watermark exists)"""
+        return self.store.synced_at(kind) is not None
+
+    def sync(self, kind: str, max_pages: Optional[int] = None, wait: bool = True) -> int:
+        """
+        Fetch the kind's history records above its watermark, at most `max_pages` pages; returns
+        records stored. Without `wait`, returns 0 at once while another sync of the kind runs.
+        """
+        lock = self._locks[kind]
+        if not lock.acquire(blocking=wait):
+            return 0
+        try:
+            pages = self.clients[kind].iter_after_id(
+                'crm.stagehistory.list', after_id=self.store.watermark(kind), select=FIELDS[kind], entityTypeId=KINDS[kind]
+            )
+            if max_pages:
+                pages = islice(pages, max_pages)
+            stored = 0
+            while True:
+                chunk = list(islice(pages, STORE_PAGES))
+                df = build_frame(chunk, STAGE_HISTORY_DTYPES)
+                stored += self.store.append(kind, transition_rows(kind, df) if not df.empty else df)
+                if len(chunk) < STORE_PAGES:
+                    break
+            if stored:
+                print(f"[Stage History] Stored {stored} {kind} transitions")
+            return stored
+        finally:
+            lock.release()
+
+    def attach_managers(self, kind: str, start_ts: int, end_ts: int) -> int:
+        """Mirror owners that moved in the range and are not in the entity store; returns owners fetched"""
+        missing = [owner for owner in self.store.unknown_owners(kind, start_ts, end_ts) if owner not in self._gone[kind]]
+        self.entity_sync.upsert_by_id(kind, missing)
+        self._gone[kind].update(self.store.unknown_owners(kind, start_ts, end_ts))
+        return len(missing)
+
+
+def stays(transitions: pd.DataFrame, start_ts: int, end_ts: int, now_ts: Optional[int] = None) -> pd.DataFrame:
+    """
+    Stays that began in [start_ts, end_ts) from StageHistoryStore.transitions: the transition's
+    columns plus seconds (NaN while open), open_seconds (age of open stays), next_stage and
+    reached_success (the owner entered a success stage at or after the stay began, at any time)
+    """
+    now_ts = int(time.time()) if now_ts is None else now_ts
+    if transitions.empty:
+        return transitions.assign(seconds=[], open_seconds=[], next_stage=[], reached_success=[])
+    owner = transitions['owner_id'].to_numpy()
+    stage_ids = transitions['stage'].to_numpy(dtype=object)
+    # A record repeating the owner's stage continues the stay, also one begun before the range
+    entered = np.r_[True, (owner[1:] != owner[:-1]) | (stage_ids[1:] != stage_ids[:-1])]
+    frame = transitions[entered].reset_index(drop=True)
+
+    owner = frame['owner_id'].to_numpy()
+    at = frame['created_at'].to_numpy(dtype='int64')
+    stage_ids = frame['stage'].to_numpy(dtype=object)
+    ends = np.r_[owner[1:] == owner[:-1], False]
+    frame['seconds'] = np.where(ends, np.r_[at[1:], 0] - at, np.nan)
+    frame['open_seconds'] = np.where(ends, np.nan, now_ts - at)
+    frame['next_stage'] = np.where(ends, np.r_[stage_ids[1:], None], None)
+    # Latest success of every owner, taken before the range cut so later successes count
+    last_success = frame['created_at'].where(frame['semantic'] == 'S').groupby(frame['owner_id']).transform('max')
+    frame['reached_success'] = (last_success >= frame['created_at']).to_numpy()
+    return frame[(at >= start_ts) & (at < end_ts)].reset_index(drop=True)
+
+
+def stage_names(status_list: pd.DataFrame, kind: str) -> Dict[str, str]:
+    """
+    Stage ID -> name of the kind's entries of crm.status.list (LeadsService.get_status_list), in
+    pipeline order: lead statuses (ENTITY_ID STATUS) by SORT; deal stages of the main pipeline
+    (DEAL_STAGE) and then of every other pipeline (DEAL_STAGE_<category>, stage IDs C<category>:...)
+    """
+    entity_ids = status_list['ENTITY_ID'].astype(str)
+    if kind == 'lead':
+        stages = status_list[entity_ids == 'STATUS'].assign(pipeline=0)
+    else:
+        stages = status_list[entity_ids.str.match(r'^DEAL_STAGE(_\d+)?$')]
+        stages = stages.assign(pipeline=pd.to_numeric(
+            stages['ENTITY_ID'].str.extract(r'^DEAL_STAGE_(\d+)$', expand=False), errors='coerce'
+        ).fillna(0))
+    stages = stages.sort_values(['pipeline', 'SORT'], kind='stable').drop_duplicates('STATUS_ID')
+    return dict(zip(stages['STATUS_ID'].astype(str).tolist(), stages['NAME'].astype(str).tolist()))
+
+
+def _grouped(frame: pd.DataFrame, breakdown: Optional[str]) -> Tuple[pd.DataFrame, List[str]]:
+    """Stays with a `key` column (manager, '' if unknown or no breakdown) and the group keys"""
+    if breakdown == 'manager':
+        keys = frame['manager_id'].astype(object).where(frame['manager_id'].notna(), '')
+    else:
+        keys = ''
+    return frame.assign(key=keys), ['key', 'stage']
+
+
+def _ordered(totals: pd.DataFrame, names: Dict[str, str]) -> pd.DataFrame:
+    """Stages in pipeline order (`names`, unknown stages after them), most entered key first"""
+    position = {stage_id: index for index, stage_id in enumerate(names)}
+    totals = totals.reset_index()
+    totals['position'] = totals['stage'].map(position).fillna(len(position))
+    totals['stage_entered'] = totals.groupby('stage')['entered'].transform('sum')
+    return totals.sort_values(
+        ['position', 'stage_entered', 'stage', 'entered'], ascending=[True, False, True, False], kind='stable'
+    )
+
+
+def _head(row: Dict, breakdown: Optional[str], names: Dict[str, str], managers: Dict[int, str]) -> Dict:
+    item = {'stage': row['stage'], 'label': names.get(row['stage'], row['stage'])}
+    if breakdown == 'manager':
+        manager_id = None if row['key'] == '' else int(row['key'])
+        item.update({'manager_id': manager_id, 'manager': managers.get(manager_id)})
+    return item
+
+
+def _round(value, digits: int = 2) -> Optional[float]:
+    return None if pd.isna(value) else round(float(value), digits)
+
+
+@stage('stage_history')
+def time_in_status(stays_df: pd.DataFrame, breakdown: Optional[str] = None, users_df: Optional[pd.DataFrame] = None,
+                   names: Optional[Dict[str, str]] = None) -> Dict:
+    """Entered, exited and open stays per stage (and manager) with percentiles of the time spent, in hours"""
+    if stays_df.empty:
+        return {'breakdown': breakdown, 'stages': []}
+    names, managers = names or {}, manager_names(users_df)
+    frame, keys = _grouped(stays_df, breakdown)
+    final = frame['semantic'].isin(FINAL)
+    frame = frame.assign(
+        final=final,
+        exited=frame['seconds'].notna(),
+        waiting=frame['seconds'].isna() & ~final,
+        hours=frame['seconds'] / 3600,
+        open_hours=(frame['open_seconds'] / 3600).where(~final),
+    )
+
+    groups = frame.groupby(keys, sort=False)
+    totals = groups.agg(
+        entered=('exited', 'size'), exited=('exited', 'sum'), open=('waiting', 'sum'), final=('final', 'all'),
+        open_hours_median=('open_hours', 'median')
+    )
+    quantiles = groups['hours'].quantile(list(PERCENTILES.values())).unstack()
+    quantiles.columns = list(PERCENTILES)
+    totals = _ordered(totals.join(quantiles), names)
+
+    rows = []
+    for row in totals.to_dict('records'):
+        rows.append({
+            **_head(row, breakdown, names, managers),
+            'final': bool(row['final']),
+            'entered': int(row['entered']),
+            'exited': int(row['exited']),
+            'open': int(row['open']),
+            'hours': {name: _round(row[name]) for name in PERCENTILES},
+            'open_hours_median': _round(row['open_hours_median']),
+        })
+    return {'breakdown': breakdown, 'stages': rows}
+
+
+@stage('stage_history')
+def stage_conversion(stays_df: pd.DataFrame, breakdown: Optional[str] = None, users_df: Optional[pd.DataFrame] = None,
+                     names: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    Per stage (and manager): stays entered, where they moved next (share of entered) and the share of
+    owners that reached a success stage afterwards
+    """
+    if stays_df.empty:
+        return {'breakdown': breakdown, 'stages': []}
+    names, managers = names or {}, manager_names(users_df)
+    frame, keys = _grouped(stays_df, breakdown)
+
+    frame = frame.assign(moved=frame['next_stage'].notna(), succeeded=frame['reached_success'])
+
+    totals = frame.groupby(keys, sort=False).agg(
+        entered=('moved', 'size'), moved=('moved', 'sum'), succeeded=('succeeded', 'sum')
+    )
+    moves = frame[frame['moved']].groupby(keys + ['next_stage'], sort=False).size().rename('count').reset_index()
+    moves = moves.sort_values('count', ascending=False, kind='stable')
+    next_stages: Dict[Tuple, List[Dict]] = {}
+    for key, from_stage, to_stage, count in moves.itertuples(index=False, name=None):
+        next_stages.setdefault((key, from_stage), []).append({
+            'stage': to_stage, 'label': names.get(to_stage, to_stage), 'count': int(count)
+        })
+
+    rows = []
+    for row in _ordered(totals, names).to_dict('records'):
+        entered = int(row['entered'])
+        following = next_stages.get((row['key'], row['stage']), [])
+        for item in following:
+            item['rate'] = round(item['count'] / entered * 100, 2)
+        rows.append({
+            **_head(row, breakdown, names, managers),
+            'entered': entered,
+            'moved': int(row['moved']),
+            'success': int(row['succeeded']),
+            'success_rate': round(row['succeeded'] / entered * 100, 2),
+            'next': following,
+        })
+    return {'breakdown': breakdown, 'stages': rows}
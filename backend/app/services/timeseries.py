@@ -0,0 +1,235 @@
+"""
+Trend series over long horizons from daily aggregates.
+
+Every day is mapped to its period (the day itself, the Monday of its week or
+the first of its month) and the daily aggregates are summed per period,
+overall, per manager or per source. Reaction medians come from the merged
+per-day sketches of the period; they are per manager, so a source breakdown
+has none.
+
+The aggregate store keeps these per-period rows up to date whenever it
+saves days (see AggregateStore.refresh_rollups), so a series over two years
+is one indexed read; only the partial first and last periods of a range are
+summed from the stored days. The response is columnar, one array per metric
+aligned with `periods`:
+
+    {
+        'grain': 'weekly', 'breakdown': None,
+        'periods': ['2024-01-01', '2024-01-08', ...],  # period starts
+        'series': [{'key': None, 'label': 'Всього', 'leads': [...], 'sales': [...],
+                    'revenue': [...], 'conversion': [...], 'reaction_median': [...]}]
+    }
+
+The first and last periods cover only the days inside the range.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from ..core.telemetry import stage
+from .schema import manager_names
+from .sketches import QuantileSketch
+
+GRAINS = ('daily', 'weekly', 'monthly')
+
+BREAKDOWN_COLUMNS = {
+    'manager': 'ASSIGNED_BY_ID',
+    'source': 'UTM_SOURCE',
+}
+
+# Stored rows of the department totals use this dimension
+TOTAL = 'total'
+
+TOTAL_LABEL = "Всього"
+
+ROW_COLUMNS = ['period', 'key', 'leads', 'sales', 'revenue', 'reaction_median']
+
+
+def period_starts(days: pd.DatetimeIndex, grain: str) -> pd.Index:
+    """Start (YYYY-MM-DD) of the period of every day"""
+    if grain == 'daily':
+        starts = days
+    elif grain == 'weekly':
+        starts = days - pd.to_timedelta(days.dayofweek, unit='D')
+    elif grain == 'monthly':
+        starts = days.to_period('M').to_timestamp()
+    else:
+        raise ValueError(f"Unknown grain: {grain}. Use one of {', '.join(GRAINS)}")
+    return starts.strftime('%Y-%m-%d')
+
+
+def period_end(start: str, grain: str) -> str:
+    """Last day (YYYY-MM-DD) of the period starting at `start`"""
+    day = pd.Timestamp(start)
+    if grain == 'weekly':
+        day += pd.Timedelta(days=6)
+    elif grain == 'monthly':
+        day += pd.offsets.MonthEnd(0)
+    return day.strftime('%Y-%m-%d')
+
+
+def _median(sketches: pd.Series) -> Optional[float]:
+    return QuantileSketch.merged(sketches).quantile(0.5)
+
+
+def period_rows(merged: Dict[str, pd.DataFrame], grain: str, breakdown: Optional[str] = None) -> pd.DataFrame:
+    """Rows (period, key, leads, sales, revenue, reaction_median) of merged aggregates; key None for totals"""
+    leads = merged.get('leads', pd.DataFrame(columns=['day', 'ASSIGNED_BY_ID', 'UTM_SOURCE', 'number_of_leads']))
+    deals = merged.get('deals', pd.DataFrame(
+        columns=['day', 'ASSIGNED_BY_ID', 'UTM_SOURCE', 'number_of_contracts', 'contract_amount']
+    ))
+    reaction = merged.get('reaction', pd.DataFrame(columns=['day', 'ASSIGNED_BY_ID', 'sketch']))
+
+    days = pd.Index(pd.concat([leads['day'], deals['day'], reaction['day']]).unique())
+    period_of = pd.Series(period_starts(pd.DatetimeIndex(days), grain), index=days, dtype=object)
+    group = BREAKDOWN_COLUMNS.get(breakdown)
+    keys = ['period'] + ([group] if group else [])
+
+    parts = [
+        leads.assign(period=leads['day'].map(period_of)).groupby(keys, dropna=False)['number_of_leads']
+        .sum().rename('leads'),
+        deals.assign(period=deals['day'].map(period_of)).groupby(keys, dropna=False)[
+            ['number_of_contracts', 'contract_amount']
+        ].sum().rename(columns={'number_of_contracts': 'sales', 'contract_amount': 'revenue'}),
+    ]
+    if breakdown != 'source':
+        reaction = reaction.assign(period=reaction['day'].map(period_of))
+        parts.append(reaction.groupby(keys)['sketch'].agg(_median).astype('float64').rename('reaction_median'))
+
+    rows = pd.concat(parts, axis=1).reset_index()
+    rows = rows.rename(columns={group: 'key'}) if group else rows.assign(key=None)
+    rows = rows.reindex(columns=ROW_COLUMNS)
+    rows[['leads', 'sales', 'revenue']] = rows[['leads', 'sales', 'revenue']].fillna(0)
+    return rows
+
+
+def _values(matrix: np.ndarray, digits: Optional[int] = None) -> List[List]:
+    """JSON-ready rows: counts as int, other values rounded with NaN as None"""
+    if digits is None:
+        return np.nan_to_num(matrix).astype('int64').tolist()
+    return np.where(np.isnan(matrix), None, np.round(matrix, digits)).tolist()
+
+
+def render_series(rows: pd.DataFrame, periods: List[str], grain: str, breakdown: Optional[str] = None,
+                  users_df: Optional[pd.DataFrame] = None) -> Dict:
+    """Columnar series of period rows, largest series first"""
+    names = manager_names(users_df) if breakdown == 'manager' else {}
+
+    # Unknown sources (and the single totals series) are grouped under ''
+    keys = rows['key'].astype(object).where(rows['key'].notna(), '') if breakdown else ''
+    # Partial periods of one key (edges of the range) are summed; medians are never split
+    frame = rows.assign(key=keys).groupby(['key', 'period']).agg(
+        leads=('leads', 'sum'), sales=('sales', 'sum'), revenue=('revenue', 'sum'),
+        reaction_median=('reaction_median', 'first')
+    )
+    order = frame['leads'].groupby(level='key').sum().sort_values(ascending=False, kind='stable').index
+    if not breakdown:
+        order = pd.Index([''])
+
+    def matrix(column: str) -> np.ndarray:
+        return frame[column].unstack('period').reindex(index=order, columns=periods).to_numpy(dtype='float64')
+
+    leads, sales, revenue = matrix('leads'), matrix('sales'), matrix('revenue')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        conversion = np.where(leads > 0, np.nan_to_num(sales) / leads * 100, np.nan)
+    values = {
+        'leads': _values(leads),
+        'sales': _values(sales),
+        'revenue': _values(np.nan_to_num(revenue), 2),
+        'conversion': _values(conversion, 2),
+    }
+    if breakdown != 'source':
+        values['reaction_median'] = _values(matrix('reaction_median'), 1)
+
+    series = []
+    for index, key in enumerate(order):
+        if not breakdown:
+            key, label = None, TOTAL_LABEL
+        else:
+            key = None if key == '' else (int(key) if breakdown == 'manager' else key)
+            label = names.get(key, None if key is None else str(key))
+        series.append({'key': key, 'label': label, **{metric: table[index] for metric, table in values.items()}})
+
+    return {
+        'grain': grain,
+        'breakdown': breakdown,
+        'periods': periods,
+        'series': series
+    }
+
+
+def range_periods(start_date: str, end_date: str, grain: str) -> List[str]:
+    """Starts of the periods overlapping the range, in order"""
+    return list(dict.fromkeys(period_starts(pd.date_range(start_date, end_date), grain).tolist()))
+
+
+@stage('timeseries')
+def build_timeseries(merged: Dict[str, pd.DataFrame], start_date: str, end_date: str, grain: str = 'daily',
+                     breakdown: Optional[str] = None, users_df: Optional[pd.DataFrame] = None) -> Dict:
+    """Series of the range computed from merged aggregates (no stored rollups)"""
+    return render_series(
+        period_rows(merged, grain, breakdown), range_periods(start_date, end_date, grain), grain, breakdown, users_df
+    )
+
+
+@stage('timeseries')
+def stored_timeseries(store, start_date: str, end_date: str, grain: str = 'daily',
+                      breakdown: Optional[str] = None, users_df: Optional[pd.DataFrame] = None) -> Dict:
+    """Series of the range from the store's rollups; partial edge periods from its stored days"""
+    periods = range_periods(start_date, end_date, grain)
+    whole = [period for period in periods if period >= start_date and period_end(period, grain) <= end_date]
+
+    parts = []
+    if whole:
+        parts.append(store.load_rollups(grain, breakdown or TOTAL, whole[0], whole[-1]))
+    for period in periods:
+        if period in whole:
+            continue
+        edge_start, edge_end = max(period, start_date), min(period_end(period, grain), end_date)
+        parts.append(period_rows(store.load(edge_start, edge_end), grain, breakdown))
+
+    rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=ROW_COLUMNS)
+    return render_series(rows, periods, grain, breakdown, users_df)
+
+
+def affected_periods(days: List[str]) -> Dict[str, List[str]]:
+    """grain -> starts of the periods containing any of `days`"""
+    index = pd.DatetimeIndex(sorted(days))
+    return {grain: sorted(set(period_starts(index, grain))) for grain in GRAINS}
+
+
+def rollup_span(periods: Dict[str, List[str]]) -> List[str]:
+    """Every day of the given periods of all grains, sorted"""
+    days = set()
+    for grain, starts in periods.items():
+        for start in starts:
+            days.update(pd.date_range(start, period_end(start, grain)).strftime('%Y-%m-%d'))
+    return sorted(days)
+
+
+def rollup_rows(merged: Dict[str, pd.DataFrame], grain: str, periods: List[str]) -> List[tuple]:
+    """(period, dimension, key, leads, sales, revenue, reaction_median) rows of the given periods"""
+    rows = []
+    for dimension, breakdown in ((TOTAL, None), ('manager', 'manager'), ('source', 'source')):
+        frame = period_rows(merged, grain, breakdown)
+        frame = frame[frame['period'].isin(periods)]
+        for row in frame.itertuples(index=False):
+            rows.append((
+                row.period, dimension, '' if row.key is None or pd.isna(row.key) else str(row.key),
+                int(row.leads), int(row.sales), float(row.revenue),
+                None if pd.isna(row.reaction_median) else float(row.reaction_median)
+            ))
+    return rows
+
+
+def parse_rollups(rows: pd.DataFrame, dimension: str) -> pd.DataFrame:
+    """Stored rollup rows back into period rows"""
+    if dimension == TOTAL:
+        keys = None
+    elif dimension == 'manager':
+        keys = rows['key'].astype('int64')
+    else:
+        keys = rows['key'].replace('', None)
+    return rows.assign(key=keys).reindex(columns=ROW_COLUMNS)
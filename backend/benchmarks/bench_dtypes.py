@@ -0,0 +1,85 @@
+"""
+Memory/time comparison of untyped (object) frames vs schema-typed frames
+
+Usage (from backend/):
+    python -m benchmarks.bench_dtypes --days 90 --leads-per-day 400
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from app.services.leads_service import LeadsService
+from app.services.schema import apply_schema, LEAD_DTYPES, DEAL_DTYPES, USER_DTYPES
+from .synthetic import generate_leads, generate_deals, generate_users
+
+
+def _fake_reaction(leads_df: pd.DataFrame) -> pd.Series:
+    # calculate_working_hours is not under test here, a plain difference is enough
+    return leads_df['taken_in_work'] - leads_df['DATE_CREATE']
+
+
+def build_untyped(leads, deals, users):
+    """Frames as they were built before the typed schema step"""
+    leads_df = pd.DataFrame(leads)
+    leads_df['DATE_CREATE'] = pd.to_datetime(leads_df['DATE_CREATE'])
+    leads_df['taken_in_work'] = pd.to_datetime(leads_df['UF_CRM_1745414446'])
+    leads_df = leads_df.drop('UF_CRM_1745414446', axis=1)
+    leads_df['time_taken_in_work'] = _fake_reaction(leads_df)
+    deals_df = pd.DataFrame(deals)
+    users_df = pd.DataFrame(users)
+    users_df['FULL_NAME'] = users_df[['NAME', 'LAST_NAME', 'SECOND_NAME']].fillna('').agg(' '.join, axis=1).str.strip()
+    return leads_df, deals_df, users_df[['ID', 'FULL_NAME']]
+
+
+def build_typed(leads, deals, users):
+    """Frames built through the typed schema step"""
+    leads_df = apply_schema(pd.DataFrame(leads), LEAD_DTYPES)
+    leads_df = leads_df.rename(columns={'UF_CRM_1745414446': 'taken_in_work'})
+    leads_df['time_taken_in_work'] = _fake_reaction(leads_df)
+    deals_df = apply_schema(pd.DataFrame(deals), DEAL_DTYPES)
+    users_df = pd.DataFrame(users)
+    users_df['FULL_NAME'] = users_df[['NAME', 'LAST_NAME', 'SECOND_NAME']].fillna('').agg(' '.join, axis=1).str.strip()
+    return leads_df, deals_df, apply_schema(users_df[['ID', 'FULL_NAME']], USER_DTYPES)
+
+
+def memory_mb(*frames) -> float:
+    return sum(df.memory_usage(deep=True).sum() for df in frames) / 1024 / 1024
+
+
+def time_metrics(service: LeadsService, frames, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        service.calculate_metrics(*frames)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--leads-per-day', type=int, default=400)
+    parser.add_argument('--deals-per-day', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    start = datetime(2024, 1, 1)
+    leads = generate_leads(start, args.days, args.leads_per_day)
+    deals = generate_deals(start, args.days, args.deals_per_day)
+    users = generate_users()
+    service = LeadsService('bench.local', 1, '', '', '')
+
+    print(f'{len(leads)} leads, {len(deals)} deals over {args.days} days')
+    for name, builder in (('untyped', build_untyped), ('typed', build_typed)):
+        started = time.perf_counter()
+        frames = builder(leads, deals, users)
+        build_ms = (time.perf_counter() - started) * 1000
+        print(
+            f'{name:>8}: memory {memory_mb(*frames):7.2f} MB | '
+            f'build {build_ms:8.1f} ms | calculate_metrics {time_metrics(service, frames, args.repeat):7.1f} ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+End-to-end timing of /api/reports/* and /api/metrics/* against the local fake upstream
+
+Starts benchmarks.fake_upstream in a subprocess (its data does not count
+towards the API's memory), points the app at it and calls every endpoint
+in-process with a cold report cache. For each endpoint: wall time, a
+second (cached) call, upstream calls by method and peak RSS of the API
+process and of its report workers.
+
+Usage (from backend/):
+    python -m benchmarks.bench_e2e --leads 10000 --days 90
+    python -m benchmarks.bench_e2e --leads 500000 --days 365 --latency-ms 50 --rate 2
+    python -m benchmarks.bench_e2e --save-baseline benchmarks/baseline_e2e.json
+    python -m benchmarks.bench_e2e --baseline benchmarks/baseline_e2e.json   # exit 1 on regression
+"""
+
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from .fake_upstream import add_arguments
+
+# Upstream calls may not grow at all; time and memory within the tolerance,
+# plus an absolute slack so sub-second timings do not flap
+COMPARED = ('seconds', 'upstream_calls', 'peak_rss_mb')
+SLACK = {'seconds': 0.1, 'upstream_calls': 0, 'peak_rss_mb': 10}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def upstream_args(args) -> List[str]:
+    argv = ['--leads', str(args.leads), '--days', str(args.days), '--deals-ratio', str(args.deals_ratio),
+            '--latency-ms', str(args.latency_ms), '--rate', str(args.rate), '--burst', str(args.burst)]
+    if args.start:
+        argv += ['--start', args.start]
+    return argv
+
+
+def start_fake_upstream(args, timeout: float = 600) -> Tuple[subprocess.Popen, str]:
+    """Run the fake server in a subprocess; returns (process, base URL) once it answers"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.fake_upstream', '--port', str(port)] + upstream_args(args),
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('fake upstream exited')
+        try:
+            urllib.request.urlopen(f'{base_url}/_stats', timeout=1)
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('fake upstream did not start')
+
+
+def upstream_stats(base_url: str, reset: bool = False) -> Dict[str, int]:
+    if reset:
+        request = urllib.request.Request(f'{base_url}/_reset', data=b'', method='POST')
+        return json.load(urllib.request.urlopen(request))
+    return json.load(urllib.request.urlopen(f'{base_url}/_stats'))
+
+
+def configure_app(base_url: str, database_path: str):
+    """Environment for the API; must run before `app` is imported"""
+    os.environ.update({
+        'BITRIX24_DOMAIN': base_url,
+        'BITRIX24_USER_ID': '1',
+        'BITRIX24_TOKEN_LEADS': 'bench',
+        'BITRIX24_TOKEN_USERS': 'bench',
+        'BITRIX24_TOKEN_STATUS': 'bench',
+        'BITRIX24_TOKEN_DEALS': 'bench',
+        'BITRIX24_APP_TOKEN': '',
+        'FINMAP_API_KEY': 'bench',
+        'FINMAP_BASE_URL': f'{base_url}/v2.2',
+        'TELEGRAM_BOT_TOKEN': 'bench',
+        'TELEGRAM_AUTH_ENABLED': 'false',
+        'DATABASE_PATH': database_path,
+        'SNAPSHOT_PATH': '',
+        'ALERT_HISTORY_DAILY': 'false',  # no background evaluation while measuring
+    })
+
+
+def endpoints(yesterday: datetime) -> List[Tuple[str, str, Dict]]:
+    """(name, path, params) of every report and metrics endpoint, ending yesterday"""
+    day = yesterday.strftime('%Y-%m-%d')
+    week_start = (yesterday - timedelta(days=6)).strftime('%Y-%m-%d')
+    month_start = (yesterday - timedelta(days=29)).strftime('%Y-%m-%d')
+    previous_month = yesterday.replace(day=1) - timedelta(days=1)
+    return [
+        ('reports/daily', '/api/reports/daily', {'date': day}),
+        ('reports/weekly', '/api/reports/weekly', {'start_date': week_start, 'end_date': day}),
+        ('reports/monthly', '/api/reports/monthly', {'year': previous_month.year, 'month': previous_month.month}),
+        ('reports/custom-30d', '/api/reports/custom', {'start_date': month_start, 'end_date': day}),
+        ('metrics/leads', '/api/metrics/leads', {'date': day}),
+        ('metrics/sales', '/api/metrics/sales', {'date': day}),
+        ('metrics/conversion-30d', '/api/metrics/conversion', {'start_date': month_start, 'end_date': day}),
+        ('metrics/manager-30d', '/api/metrics/manager/100', {'start_date': month_start, 'end_date': day}),
+        ('metrics/timeseries-30d', '/api/metrics/timeseries',
+         {'start_date': month_start, 'end_date': day, 'grain': 'weekly', 'breakdown': 'manager'}),
+    ]
+
+
+def rss_mb() -> Tuple[float, float]:
+    """Peak RSS (MB) of this process and of its largest finished child"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+def run(args) -> Dict:
+    process, base_url = start_fake_upstream(args)
+    database = tempfile.NamedTemporaryFile(prefix='bench_e2e_', suffix='.db', delete=False).name
+    try:
+        configure_app(base_url, database)
+        from fastapi.testclient import TestClient
+        from app.core.cache import reference_cache, report_cache
+        from app.core.services import services
+        from app.main import app
+
+        results = {}
+        yesterday = datetime.now() - timedelta(days=1)
+        with TestClient(app) as client:
+            # Endpoint cost only: service modules are loaded before the first measurement
+            services.warm_up()
+            for name, path, params in endpoints(yesterday):
+                if args.only and not any(part in name for part in args.only):
+                    continue
+                report_cache.clear()
+                reference_cache.clear()
+                upstream_stats(base_url, reset=True)
+                started = time.perf_counter()
+                response = client.get(path, params=params)
+                seconds = time.perf_counter() - started
+                calls = upstream_stats(base_url)
+
+                started = time.perf_counter()
+                client.get(path, params=params)
+                cached_seconds = time.perf_counter() - started
+
+                peak, workers_peak = rss_mb()
+                results[name] = {
+                    'status': response.status_code,
+                    'seconds': round(seconds, 3),
+                    'cached_seconds': round(cached_seconds, 4),
+                    'upstream_calls': sum(
+                        count for method, count in calls.items()
+                        if not method.startswith('batch:') and method != 'QUERY_LIMIT_EXCEEDED'
+                    ),
+                    'upstream': calls,
+                    'response_kb': round(len(response.content) / 1024, 1),
+                    'peak_rss_mb': round(peak, 1),
+                    'workers_peak_rss_mb': round(workers_peak, 1),
+                }
+                print(f"{name:24} {response.status_code} {seconds:8.3f}s  cached {cached_seconds * 1000:7.1f}ms  "
+                      f"upstream {results[name]['upstream_calls']:5}  peak RSS {peak:7.1f} MB")
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+        os.remove(database)
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions against a baseline file"""
+    regressions = []
+    for name, base in baseline['results'].items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if current['status'] != base['status']:
+            regressions.append(f"{name}: status {base['status']} -> {current['status']}")
+        for metric in COMPARED:
+            limit = base[metric] if metric == 'upstream_calls' else base[metric] * (1 + tolerance)
+            limit = max(limit, base[metric] + SLACK[metric])
+            if current[metric] > limit:
+                regressions.append(f"{name}: {metric} {base[metric]} -> {current[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--only', nargs='*', help='run endpoints whose name contains any of these')
+    parser.add_argument('--baseline', help='compare with this baseline file')
+    parser.add_argument('--save-baseline', help='write results to this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative growth of time and memory')
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in ('leads', 'days', 'deals_ratio', 'latency_ms', 'rate', 'burst')}
+    results = run(args)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump({'config': config, 'created': datetime.now().isoformat(timespec='seconds'), 'results': results},
+                      baseline_file, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('config') != config:
+            print(f"Warning: baseline config {baseline.get('config')} differs from {config}")
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Peak memory of lead ingestion: list of dicts + DataFrame vs page-to-frame builder
+
+Usage (from backend/):
+    python -m benchmarks.bench_ingest --days 365 --leads-per-day 400
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from app.services.schema import apply_schema, build_frame, LEAD_DTYPES
+from .synthetic import iter_leads, paginate
+
+
+def pages(args):
+    # Round-trip through JSON so every page holds freshly decoded dicts, as requests does
+    for page in paginate(iter_leads(datetime(2024, 1, 1), args.days, args.leads_per_day)):
+        yield json.loads(json.dumps(page))
+
+
+def via_list(args) -> pd.DataFrame:
+    entities = []
+    for page in pages(args):
+        entities.extend(page)
+    return apply_schema(pd.DataFrame(entities), LEAD_DTYPES)
+
+
+def via_builder(args) -> pd.DataFrame:
+    return build_frame(pages(args), LEAD_DTYPES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--leads-per-day', type=int, default=400)
+    args = parser.parse_args()
+
+    for name, ingest in (('list', via_list), ('builder', via_builder)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        frame = ingest(args)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        frame_mb = frame.memory_usage(deep=True).sum() / 1024 / 1024
+        print(f'{name:>8}: {len(frame)} rows | frame {frame_mb:6.1f} MB | peak {peak / 1024 / 1024:7.1f} MB | {elapsed:5.1f} s')
+
+
+if __name__ == '__main__':
+    main()
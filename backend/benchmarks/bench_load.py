@@ -0,0 +1,329 @@
+"""
+Concurrent load test of the API against the local fake upstream
+
+Reproduces the rush of opens after the morning alert: N virtual Telegram
+users (each with its own signed initData, so per-user admission limits
+apply as in production) start within --ramp-seconds and keep picking a
+request from the mix until --duration is over:
+
+    daily    /api/reports/daily for yesterday
+    manager  /api/metrics/manager/{id} for yesterday, random manager
+    monthly  /api/reports/monthly for the current month
+    alerts   /api/alerts/
+
+Reports p50/p95/p99 latency per request kind and overall, throughput and
+status codes, and exits 1 when a budget is exceeded.
+
+The app runs in-process over httpx's ASGI transport (--workers sets
+REPORT_WORKERS, the report process pool; each configuration runs in a
+fresh subprocess), or, when uvicorn is installed, as a server with
+--server uvicorn (--workers sets uvicorn worker processes).
+
+Usage (from backend/):
+    python -m benchmarks.bench_load --users 50 --duration 30
+    python -m benchmarks.bench_load --users 100 --workers 1 4 --budget p95=2 --budget daily:p99=5
+    python -m benchmarks.bench_load --server uvicorn --workers 1 4 --mix daily=6 manager=3 alerts=1
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from .bench_e2e import configure_app, free_port, start_fake_upstream
+from .fake_upstream import add_arguments
+
+BOT_TOKEN = 'bench'
+MANAGERS = range(100, 140)  # user IDs served by the fake upstream
+DEFAULT_MIX = {'daily': 4, 'manager': 3, 'alerts': 2, 'monthly': 1}
+PERCENTILES = (50, 95, 99)
+
+
+def init_data(user_id: int) -> str:
+    """initData of a Telegram user, signed for BOT_TOKEN"""
+    fields = {
+        'auth_date': str(int(time.time())),
+        'query_id': f'bench{user_id}',
+        'user': json.dumps({'id': user_id, 'first_name': f'User{user_id}'}, separators=(',', ':')),
+    }
+    secret = hmac.new(key=b'WebAppData', msg=BOT_TOKEN.encode(), digestmod=hashlib.sha256).digest()
+    data_check_string = '\n'.join(f'{key}={value}' for key, value in sorted(fields.items()))
+    fields['hash'] = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def request_for(kind: str, rnd: random.Random, now: datetime) -> Tuple[str, Dict]:
+    yesterday = (now - timedelta(days=1)).strftime('%Y-%m-%d')
+    if kind == 'daily':
+        return '/api/reports/daily', {'date': yesterday}
+    if kind == 'manager':
+        return f'/api/metrics/manager/{rnd.choice(MANAGERS)}', {'start_date': yesterday, 'end_date': yesterday}
+    if kind == 'monthly':
+        return '/api/reports/monthly', {'year': now.year, 'month': now.month}
+    if kind == 'alerts':
+        return '/api/alerts/', {}
+    raise ValueError(f'Unknown request kind: {kind}')
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples: List[Tuple[str, int, float]], wall_seconds: float) -> Dict:
+    """Latency percentiles, throughput and statuses, overall and per request kind"""
+    def stats(rows):
+        latencies = sorted(seconds for _, _, seconds in rows)
+        statuses = Counter(str(status) for _, status, _ in rows)
+        errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+        return {
+            'requests': len(rows),
+            'rps': round(len(rows) / wall_seconds, 2) if wall_seconds else 0,
+            'error_rate': round(errors / len(rows), 4) if rows else 0,
+            'statuses': dict(sorted(statuses.items())),
+            **{f'p{p}': round(percentile(latencies, p), 4) for p in PERCENTILES},
+            'max': round(latencies[-1], 4) if latencies else 0,
+        }
+
+    kinds = sorted({kind for kind, _, _ in samples})
+    return {
+        'wall_seconds': round(wall_seconds, 2),
+        'all': stats(samples),
+        'kinds': {kind: stats([row for row in samples if row[0] == kind]) for kind in kinds},
+    }
+
+
+async def virtual_user(client, user_id: int, args, mix: Dict[str, float], deadline: float, samples: List):
+    rnd = random.Random(args.seed * 100003 + user_id)
+    headers = {'X-Telegram-Init-Data': init_data(user_id)}
+    kinds, weights = list(mix), list(mix.values())
+    await asyncio.sleep(rnd.uniform(0, args.ramp_seconds))
+    while time.monotonic() < deadline:
+        kind = rnd.choices(kinds, weights)[0]
+        path, params = request_for(kind, rnd, datetime.now())
+        started = time.perf_counter()
+        try:
+            response = await client.get(path, params=params, headers=headers)
+            status = response.status_code
+        except Exception as e:
+            print(f"[Load] {kind} failed: {str(e)}")
+            status = 599
+        samples.append((kind, status, time.perf_counter() - started))
+        if args.think_ms:
+            await asyncio.sleep(rnd.expovariate(1000 / args.think_ms))
+
+
+async def drive(client, args, mix: Dict[str, float]) -> Dict:
+    """Run every virtual user against `client` until the duration is over"""
+    samples: List[Tuple[str, int, float]] = []
+    started = time.monotonic()
+    deadline = started + args.ramp_seconds + args.duration
+    await asyncio.gather(*(
+        virtual_user(client, 1000 + user, args, mix, deadline, samples) for user in range(args.users)
+    ))
+    return summarize(samples, time.monotonic() - started)
+
+
+async def run_in_process(args, mix: Dict[str, float]) -> Dict:
+    import httpx
+    from app.main import app
+
+    # ASGITransport does not send lifespan events: run startup/shutdown here
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=args.timeout) as client:
+            return await drive(client, args, mix)
+
+
+async def run_against_server(base_url: str, args, mix: Dict[str, float]) -> Dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        return await drive(client, args, mix)
+
+
+def app_environment(upstream_url: str, workers: Optional[int] = None) -> Dict[str, str]:
+    """Environment of one app instance: fresh database, Telegram auth on (this process never imports the app)"""
+    database = tempfile.NamedTemporaryFile(prefix='bench_load_', suffix='.db', delete=False).name
+    configure_app(upstream_url, database)
+    env = {**os.environ, 'TELEGRAM_BOT_TOKEN': BOT_TOKEN, 'TELEGRAM_AUTH_ENABLED': 'true'}
+    if workers is not None:
+        env['REPORT_WORKERS'] = str(workers)
+    return env
+
+
+def run_configuration(args, upstream_url: str, workers: int, argv: List[str]) -> Dict:
+    """One configuration in a fresh process (in-process mode) or behind a fresh uvicorn"""
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if args.server == 'inprocess':
+        env = app_environment(upstream_url, workers)
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as result_file:
+            result_path = result_file.name
+        try:
+            # The app's own logging would bury the results: shown only with --verbose
+            subprocess.run(
+                [sys.executable, '-W', 'ignore', '-m', 'benchmarks.bench_load', *argv, '--child-result', result_path],
+                cwd=backend, env=env, check=True, stdout=None if args.verbose else subprocess.DEVNULL
+            )
+            with open(result_path) as result_file:
+                return json.load(result_file)
+        finally:
+            os.remove(result_path)
+            os.remove(env['DATABASE_PATH'])
+
+    env = app_environment(upstream_url)
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=backend, env=env, stdout=None if args.verbose else subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_for(base_url, server)
+        return asyncio.run(run_against_server(base_url, args, parse_mix(args.mix)))
+    finally:
+        server.terminate()
+        server.wait()
+        os.remove(env['DATABASE_PATH'])
+
+
+def wait_for(base_url: str, server: subprocess.Popen, timeout: float = 60):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('uvicorn exited')
+        try:
+            httpx.get(f'{base_url}/health', timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError('uvicorn did not start')
+
+
+def parse_mix(entries: Optional[List[str]]) -> Dict[str, float]:
+    if not entries:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for entry in entries:
+        kind, _, weight = entry.partition('=')
+        if kind not in DEFAULT_MIX:
+            raise SystemExit(f'Unknown request kind in --mix: {kind} (use {", ".join(DEFAULT_MIX)})')
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def parse_budgets(entries: Optional[List[str]]) -> List[Tuple[str, str, float]]:
+    """[kind:]metric=value entries as (kind or 'all', metric, limit)"""
+    budgets = []
+    for entry in entries or []:
+        target, _, value = entry.partition('=')
+        kind, _, metric = target.rpartition(':')
+        if metric not in {f'p{p}' for p in PERCENTILES} | {'max', 'rps', 'error_rate'} or not value:
+            raise SystemExit(f'Invalid --budget {entry} (e.g. p95=2, daily:p99=5, rps=20, error_rate=0.01)')
+        budgets.append((kind or 'all', metric, float(value)))
+    return budgets
+
+
+def check_budgets(result: Dict, budgets: List[Tuple[str, str, float]]) -> List[str]:
+    """Budget violations of one configuration; rps is a floor, everything else a ceiling"""
+    violations = []
+    for kind, metric, limit in budgets:
+        stats = result['all'] if kind == 'all' else result['kinds'].get(kind)
+        if stats is None:
+            continue
+        value = stats[metric]
+        if (value < limit) if metric == 'rps' else (value > limit):
+            violations.append(f"{kind} {metric} {value} (budget {limit})")
+    return violations
+
+
+def print_result(label: str, result: Dict):
+    print(f"\n{label}: {result['all']['requests']} requests in {result['wall_seconds']}s")
+    print(f"{'kind':10} {'requests':>8} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  statuses")
+    for kind, stats in [*result['kinds'].items(), ('all', result['all'])]:
+        print(f"{kind:10} {stats['requests']:8} {stats['rps']:7.2f} {stats['p50']:8.3f} {stats['p95']:8.3f} "
+              f"{stats['p99']:8.3f} {stats['max']:8.3f}  {stats['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--server', choices=('inprocess', 'uvicorn'), default='inprocess')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='configurations to compare (report workers in-process, uvicorn workers otherwise)')
+    parser.add_argument('--users', type=int, default=50, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load after the ramp')
+    parser.add_argument('--ramp-seconds', type=float, default=5, help='users start within this many seconds')
+    parser.add_argument('--think-ms', type=float, default=1000, help='mean pause between requests of a user')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mix', nargs='*', help=f'kind=weight (default {DEFAULT_MIX})')
+    parser.add_argument('--budget', action='append', help='[kind:]metric=limit, metric is p50/p95/p99/max/error_rate/rps')
+    parser.add_argument('--output', help='write all results as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the app's output")
+    parser.add_argument('--child-result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+    budgets = parse_budgets(args.budget)
+
+    if args.child_result:
+        result = asyncio.run(run_in_process(args, mix))
+        with open(args.child_result, 'w') as result_file:
+            json.dump(result, result_file)
+        return
+
+    if args.server == 'uvicorn' and importlib.util.find_spec('uvicorn') is None:
+        raise SystemExit('uvicorn is not installed; use --server inprocess')
+
+    process, upstream_url = start_fake_upstream(args)
+    results = {}
+    try:
+        for workers in args.workers:
+            results[workers] = run_configuration(args, upstream_url, workers, sys.argv[1:])
+            print_result(f"{args.server}, {workers} worker(s)", results[workers])
+    finally:
+        process.terminate()
+        process.wait()
+
+    if len(results) > 1:
+        print(f"\n{'workers':>7} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+        for workers, result in results.items():
+            stats = result['all']
+            print(f"{workers:7} {stats['rps']:7.2f} {stats['p50']:8.3f} {stats['p95']:8.3f} {stats['p99']:8.3f} "
+                  f"{stats['error_rate']:7.2%}")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'server': args.server, 'users': args.users, 'mix': mix, 'results': results}, output, indent=2)
+
+    violations = [f"{workers} worker(s): {line}" for workers, result in results.items()
+                  for line in check_budgets(result, budgets)]
+    for line in violations:
+        print(f"BUDGET EXCEEDED {line}")
+    if violations:
+        sys.exit(1)
+    if budgets:
+        print("All budgets met")
+
+
+if __name__ == '__main__':
+    main()
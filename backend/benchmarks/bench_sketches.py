@@ -0,0 +1,50 @@
+"""
+Accuracy of merged per-day reaction sketches vs exact pandas quantiles
+
+Usage (from backend/):
+    python -m benchmarks.bench_sketches --days 365 --leads-per-day 400
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from app.services.sketches import QuantileSketch
+
+
+def exact_trimmed_median(seconds: pd.Series) -> float:
+    lower_bound = seconds.quantile(0.01)
+    upper_bound = seconds.quantile(0.95)
+    return seconds[(seconds >= lower_bound) & (seconds <= upper_bound)].median()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--leads-per-day', type=int, default=400)
+    args = parser.parse_args()
+
+    rnd = np.random.default_rng(1)
+    days = [rnd.lognormal(mean=6.5, sigma=1.2, size=args.leads_per_day) for _ in range(args.days)]
+    # A share of leads is taken outside working hours and gets zero working time
+    for values in days:
+        values[rnd.random(len(values)) < 0.1] = 0
+
+    merged = QuantileSketch.merged(QuantileSketch().add(values) for values in days)
+    seconds = pd.Series(np.concatenate(days))
+
+    checks = {
+        'trimmed median': (exact_trimmed_median(seconds), merged.trimmed_median()),
+        'p50': (seconds.quantile(0.5), merged.quantile(0.5)),
+        'p90': (seconds.quantile(0.9), merged.quantile(0.9)),
+        'p95': (seconds.quantile(0.95), merged.quantile(0.95)),
+    }
+    print(f'{len(seconds)} values in {args.days} day sketches, {len(merged.buckets)} buckets after merge')
+    print(f'bound: {merged.relative_accuracy:.0%} relative to the sample at rank q*(n-1)')
+    for name, (exact, approx) in checks.items():
+        print(f'{name:>15}: exact {exact:10.1f} s | sketch {approx:10.1f} s | error {abs(approx - exact) / exact:.3%}')
+
+
+if __name__ == '__main__':
+    main()
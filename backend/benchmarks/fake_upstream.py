@@ -0,0 +1,336 @@
+"""
+Local stand-in for the Bitrix24 REST API and the Finmap API
+
+Serves synthetic data with Bitrix24 list semantics: 50 rows per page,
+`start`/`next`/`total`, `filter` with >=, <=, >, <, @ (in) and equality
+keys, `select`, and `batch` with PHP-style encoded commands.
+crm.stagehistory.list serves one table per entityTypeId (items in
+`result.items`), consistent with the leads and deals. Requests pass
+a leaky bucket (Bitrix24 default: 2 requests/s, burst 50) and get
+QUERY_LIMIT_EXCEEDED with HTTP 503 when it overflows. Finmap
+`operations/list` returns one income operation per deal.
+
+Call counts per method: GET /_stats, reset with POST /_reset.
+
+Usage (from backend/):
+    python -m benchmarks.fake_upstream --leads 100000 --days 90 --latency-ms 30 --rate 2 --burst 50
+Then point the API at it:
+    BITRIX24_DOMAIN=http://127.0.0.1:8900 FINMAP_BASE_URL=http://127.0.0.1:8900/v2.2 FINMAP_API_KEY=bench
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from .synthetic import generate_deals, generate_leads, generate_stage_history, generate_statuses, generate_users
+
+PAGE_SIZE = 50
+FILTER_KEY = re.compile(r'^(>=|<=|!=|>|<|@|!@|=)?(.+)$')
+
+
+class Table:
+    """Rows of one entity, sorted by a date field so range filters are two bisects"""
+
+    def __init__(self, rows: List[Dict], date_field: Optional[str] = None, selectable: bool = True):
+        self.date_field = date_field
+        # user.get and crm.status.list ignore `select` and return every field
+        self.selectable = selectable
+        if date_field:
+            rows = sorted(rows, key=lambda row: row.get(date_field) or '')
+            self.keys = [(row.get(date_field) or '')[:19] for row in rows]
+        self.rows = rows
+        self._cache: 'OrderedDict[str, List[Dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _candidates(self, b24_filter: Dict) -> Tuple[List[Dict], Dict]:
+        if not self.date_field:
+            return self.rows, b24_filter
+        rest = dict(b24_filter)
+        low, high = rest.pop(f'>={self.date_field}', None), rest.pop(f'<={self.date_field}', None)
+        start = bisect_left(self.keys, low[:19]) if low else 0
+        end = bisect_right(self.keys, high[:19]) if high else len(self.rows)
+        return self.rows[start:end], rest
+
+    def select(self, b24_filter: Optional[Dict]) -> List[Dict]:
+        """Matching rows in ID order; results are cached for the pages that follow"""
+        cache_key = json.dumps(b24_filter or {}, sort_keys=True, default=str)
+        with self._lock:
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                return self._cache[cache_key]
+
+        candidates, rest = self._candidates(b24_filter or {})
+        conditions = [_condition(key, value) for key, value in rest.items()]
+        result = [row for row in candidates if all(check(row) for check in conditions)]
+        result.sort(key=lambda row: int(row['ID']))
+
+        with self._lock:
+            self._cache[cache_key] = result
+            while len(self._cache) > 32:
+                self._cache.popitem(last=False)
+        return result
+
+
+def _comparable(row_value, value):
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.lstrip('-').isdigit() and str(row_value or '').lstrip('-').isdigit()):
+        return int(row_value or 0), int(value)
+    return str(row_value or '')[:19], str(value)[:19]
+
+
+def _condition(key: str, value):
+    op, field = FILTER_KEY.match(key).groups()
+    if op in ('@', '!@'):
+        values = {str(v) for v in (value if isinstance(value, list) else [value])}
+        return (lambda row: str(row.get(field)) in values) if op == '@' else (lambda row: str(row.get(field)) not in values)
+    if op in ('>=', '<=', '>', '<'):
+        compare = {'>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b, '>': lambda a, b: a > b, '<': lambda a, b: a < b}[op]
+        return lambda row: row.get(field) not in (None, '') and compare(*_comparable(row.get(field), value))
+    if op == '!=':
+        return lambda row: str(row.get(field)) != str(value)
+    return lambda row: str(row.get(field)) == str(value)
+
+
+def parse_php_query(query: str) -> Dict:
+    """`start=0&filter[>=DATE_CREATE]=...&select[]=ID` -> nested dict (batch commands)"""
+    params: Dict = {}
+    for raw_key, value in parse_qsl(query, keep_blank_values=True):
+        name, _, rest = raw_key.partition('[')
+        keys = [name] + re.findall(r'([^\[\]]*)\]', rest)
+        target = params
+        for key, next_key in zip(keys, keys[1:]):
+            container = [] if next_key == '' or next_key.isdigit() else {}
+            if isinstance(target, list):
+                target.append(container)
+                target = container
+            else:
+                target = target.setdefault(key, container)
+        if isinstance(target, list):
+            target.append(value)
+        else:
+            target[keys[-1]] = value
+    return params
+
+
+class LeakyBucket:
+    """Bitrix24 request limiter: `rate` requests/s drain a bucket of `burst` (0 = unlimited)"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.level = max(0.0, self.level - (now - self.updated) * self.rate)
+            self.updated = now
+            if self.level + 1 > self.burst:
+                return False
+            self.level += 1
+            return True
+
+
+class FakeUpstream:
+    """Data, limits and call counters shared by the request handlers"""
+
+    def __init__(self, leads: int, days: int, start: datetime, managers: int = 40,
+                 deals_ratio: float = 0.1, latency_ms: float = 0, rate: float = 0, burst: int = 50):
+        per_day = max(1, leads // days)
+        lead_rows = generate_leads(start, days, per_day, managers)
+        deal_rows = generate_deals(start, days, max(1, int(per_day * deals_ratio)), managers, max_lead_id=len(lead_rows))
+        self.tables = {
+            'crm.lead.list': Table(lead_rows, 'DATE_CREATE'),
+            'crm.deal.list': Table(deal_rows, 'CLOSEDATE'),
+            'user.get': Table(generate_users(managers), selectable=False),
+            'crm.status.list': Table(generate_statuses(), selectable=False),
+        }
+        for entity_type, records in generate_stage_history(lead_rows, deal_rows).items():
+            self.tables[f'crm.stagehistory.list:{entity_type}'] = Table(records)
+        self.operations = sorted(
+            (int(datetime.fromisoformat(deal['CLOSEDATE']).timestamp() * 1000), float(deal['OPPORTUNITY']), deal['ID'])
+            for deal in deal_rows
+        )
+        self.latency = latency_ms / 1000
+        self.bucket = LeakyBucket(rate, burst)
+        self.stats: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def list_method(self, method: str, params: Dict) -> Dict:
+        items = method == 'crm.stagehistory.list'
+        table = self.tables.get(f"{method}:{params.get('entityTypeId')}" if items else method)
+        if table is None:
+            return {'error': 'ERROR_METHOD_NOT_FOUND', 'error_description': f'Method {method} not found'}
+        rows = table.select(params.get('filter') or None)
+        start = int(params.get('start') or 0)
+        page = rows[start:start + PAGE_SIZE]
+        select = params.get('select')
+        if select and '*' not in select and table.selectable:
+            page = [{field: row.get(field) for field in select} for row in page]
+        response = {'result': {'items': page} if items else page, 'total': len(rows)}
+        if start + PAGE_SIZE < len(rows):
+            response['next'] = start + PAGE_SIZE
+        return response
+
+    def bitrix(self, method: str, params: Dict) -> Tuple[int, Dict]:
+        self.count(method)
+        if not self.bucket.admit():
+            self.count('QUERY_LIMIT_EXCEEDED')
+            return 503, {'error': 'QUERY_LIMIT_EXCEEDED', 'error_description': 'Too many requests'}
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'batch':
+            result, totals, nexts, errors = {}, {}, {}, {}
+            for key, command in (params.get('cmd') or {}).items():
+                name, _, query = command.partition('?')
+                self.count(f'batch:{name}')
+                response = self.list_method(name, parse_php_query(query))
+                if 'error' in response:
+                    errors[key] = response
+                    if params.get('halt') in (1, '1', True):
+                        break
+                    continue
+                result[key] = response['result']
+                totals[key] = response['total']
+                if 'next' in response:
+                    nexts[key] = response['next']
+            return 200, {'result': {'result': result, 'result_error': errors, 'result_total': totals, 'result_next': nexts}}
+        response = self.list_method(method, params)
+        return (400 if 'error' in response else 200), response
+
+    def finmap_operations(self, body: Dict) -> Dict:
+        self.count('finmap:operations/list')
+        if self.latency:
+            time.sleep(self.latency)
+        start = body.get('startDate', body.get('dateFrom', 0))
+        end = body.get('endDate', body.get('dateTo', 2 ** 62))
+        low = bisect_left(self.operations, (start,))
+        high = bisect_left(self.operations, (end,))
+        rows = self.operations[low:high]
+        if body.get('desc'):
+            rows = rows[::-1]
+        offset, limit = int(body.get('offset', 0)), int(body.get('limit', 100))
+        return {'list': [
+            {'id': f'op-{deal_id}', 'date': moment, 'type': 'income', 'companyCurrencySum': amount}
+            for moment, amount, deal_id in rows[offset:offset + limit]
+        ], 'total': len(rows)}
+
+
+def make_handler(upstream: FakeUpstream):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, payload: Dict):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> Dict:
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            if not raw:
+                return {}
+            if 'json' in (self.headers.get('Content-Type') or ''):
+                return json.loads(raw)
+            return parse_php_query(raw.decode())
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/_stats':
+                return self._send(200, upstream.stats)
+            method = url.path.rstrip('/').rsplit('/', 1)[-1]
+            status, payload = upstream.bitrix(method, parse_php_query(url.query))
+            self._send(status, payload)
+
+        def do_POST(self):
+            path = urlsplit(self.path).path.rstrip('/')
+            body = self._body()
+            if path == '/_reset':
+                upstream.reset()
+                return self._send(200, {'status': 'ok'})
+            if path.endswith('/operations/list'):
+                return self._send(200, upstream.finmap_operations(body))
+            if '/rest/' in path:
+                status, payload = upstream.bitrix(path.rsplit('/', 1)[-1], body)
+                return self._send(status, payload)
+            self._send(404, {'error': 'NOT_FOUND'})
+
+    return Handler
+
+
+def serve(upstream: FakeUpstream, host: str = '127.0.0.1', port: int = 8900) -> ThreadingHTTPServer:
+    """Start the server in a daemon thread"""
+    server = ThreadingHTTPServer((host, port), make_handler(upstream))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--leads', type=int, default=10000, help='total leads (1k-500k)')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--start', default=None, help='first day, YYYY-MM-DD (default: --days before today)')
+    parser.add_argument('--deals-ratio', type=float, default=0.1, help='won deals per lead')
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--rate', type=float, default=0, help='Bitrix24 requests/s (0 = no limit; portal default is 2)')
+    parser.add_argument('--burst', type=int, default=50)
+
+
+def from_args(args) -> FakeUpstream:
+    if args.start:
+        start = datetime.strptime(args.start, '%Y-%m-%d')
+    else:
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = datetime.fromordinal(today.toordinal() - args.days + 1)
+    return FakeUpstream(
+        args.leads, args.days, start, deals_ratio=args.deals_ratio,
+        latency_ms=args.latency_ms, rate=args.rate, burst=args.burst
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    upstream = from_args(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(upstream))
+    print(f"Fake Bitrix24/Finmap on http://{args.host}:{args.port} "
+          f"({len(upstream.tables['crm.lead.list'].rows)} leads, {len(upstream.tables['crm.deal.list'].rows)} deals, "
+          f"generated in {time.perf_counter() - started:.1f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Synthetic Bitrix24 payloads for offline benchmarks
+Rows have the same shape as crm.lead.list / crm.deal.list / user.get results
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+from zoneinfo import ZoneInfo
+
+KYIV = ZoneInfo('Europe/Kyiv')
+
+SOURCES = ['facebook', 'instagram', 'google', 'tiktok', 'site', 'referral', None]
+STATUSES = ['NEW', 'IN_PROCESS', 'PROCESSED', 'JUNK', 'CONVERTED', '1', '2', '3', '4', '5']
+CONTRACT_TYPES = ['1206', '1207']
+LEAD_SEMANTICS = {'CONVERTED': 'S', 'JUNK': 'F'}
+DEAL_STAGES = ['NEW', 'PREPARATION', 'EXECUTING']
+
+
+def _iso(moment: datetime) -> str:
+    return moment.replace(tzinfo=KYIV).isoformat(timespec='seconds')
+
+
+def generate_users(managers: int = 40) -> List[Dict]:
+    return [
+        {'ID': str(100 + i), 'NAME': f'Name{i}', 'LAST_NAME': f'Last{i}', 'SECOND_NAME': None}
+        for i in range(managers)
+    ]
+
+
+def generate_statuses() -> List[Dict]:
+    """Lead statuses and the main pipeline's deal stages; stage IDs repeat status IDs as in Bitrix24"""
+    entries = [('STATUS', status, f'Status {status}') for status in STATUSES]
+    entries += [('DEAL_STAGE', stage, f'Stage {stage}') for stage in DEAL_STAGES + ['WON', 'LOSE']]
+    return [
+        {'ID': str(i + 1), 'ENTITY_ID': entity_id, 'STATUS_ID': status_id, 'NAME': name, 'SORT': str((i + 1) * 10)}
+        for i, (entity_id, status_id, name) in enumerate(entries)
+    ]
+
+
+def iter_leads(start: datetime, days: int, per_day: int, managers: int = 40, seed: int = 1) -> Iterator[Dict]:
+    rnd = random.Random(seed)
+    lead_id = 1
+    for day in range(days):
+        day_start = start + timedelta(days=day)
+        for _ in range(per_day):
+            created = day_start + timedelta(seconds=rnd.randint(0, 86399))
+            taken = created + timedelta(seconds=int(rnd.expovariate(1 / 900))) if rnd.random() < 0.9 else None
+            yield {
+                'ID': str(lead_id),
+                'STATUS_ID': rnd.choice(STATUSES),
+                'ASSIGNED_BY_ID': str(100 + rnd.randrange(managers)),
+                'DATE_CREATE': _iso(created),
+                'UTM_SOURCE': rnd.choice(SOURCES),
+                'UF_CRM_1745414446': _iso(taken) if taken else '',
+            }
+            lead_id += 1
+
+
+def generate_leads(start: datetime, days: int, per_day: int, managers: int = 40, seed: int = 1) -> List[Dict]:
+    return list(iter_leads(start, days, per_day, managers, seed))
+
+
+def generate_deals(start: datetime, days: int, per_day: int, managers: int = 40, max_lead_id: int = 0, seed: int = 2) -> List[Dict]:
+    rnd = random.Random(seed)
+    deals = []
+    deal_id = 1
+    for day in range(days):
+        day_start = start + timedelta(days=day)
+        for _ in range(per_day):
+            closed = day_start + timedelta(seconds=rnd.randint(0, 86399))
+            deals.append({
+                'ID': str(deal_id),
+                'OPPORTUNITY': f'{rnd.randint(5, 200) * 1000}.00',
+                'ASSIGNED_BY_ID': str(100 + rnd.randrange(managers)),
+                'CLOSEDATE': _iso(closed),
+                'UTM_SOURCE': rnd.choice(SOURCES),
+                'UF_CRM_1695636781': rnd.choice(CONTRACT_TYPES),
+                'LEAD_ID': str(rnd.randint(1, max_lead_id)) if max_lead_id else None,
+                'STAGE_ID': 'WON',
+                'CATEGORY_ID': '0',
+            })
+            deal_id += 1
+    return deals
+
+
+def generate_stage_history(leads: List[Dict], deals: List[Dict], seed: int = 3) -> Dict[int, List[Dict]]:
+    """
+    crm.stagehistory.list records by entityTypeId: every lead moves from NEW to its STATUS_ID
+    (hours apart), every deal through the pipeline to WON at its CLOSEDATE (days apart)
+    """
+    rnd = random.Random(seed)
+    moves: List[Tuple[datetime, int, Dict]] = []
+    for lead in leads:
+        moment = datetime.fromisoformat(lead['DATE_CREATE'])
+        status = lead['STATUS_ID']
+        path = ['NEW'] + (['IN_PROCESS'] if status not in ('NEW', 'IN_PROCESS') and rnd.random() < 0.8 else [])
+        path += [status] if status != 'NEW' else []
+        for step, status_id in enumerate(path):
+            if step:
+                moment += timedelta(seconds=int(rnd.expovariate(1 / 21600)))
+            semantic = LEAD_SEMANTICS.get(status_id, 'P')
+            moves.append((moment, 1, {
+                'TYPE_ID': 1 if not step else (3 if semantic != 'P' else 2), 'OWNER_ID': lead['ID'],
+                'STATUS_ID': status_id, 'STATUS_SEMANTIC_ID': semantic,
+            }))
+    for deal in deals:
+        moment = datetime.fromisoformat(deal['CLOSEDATE'])
+        path = DEAL_STAGES[:rnd.randint(1, len(DEAL_STAGES))] + ['WON']
+        for step, stage_id in reversed(list(enumerate(path))):
+            moves.append((moment, 2, {
+                'TYPE_ID': 1 if not step else (3 if stage_id == 'WON' else 2), 'OWNER_ID': deal['ID'],
+                'CATEGORY_ID': deal['CATEGORY_ID'], 'STAGE_ID': stage_id,
+                'STAGE_SEMANTIC_ID': 'S' if stage_id == 'WON' else 'P',
+            }))
+            moment -= timedelta(seconds=int(rnd.expovariate(1 / 172800)))
+
+    # Record IDs grow with time, as in Bitrix24
+    moves.sort(key=lambda move: move[0])
+    history: Dict[int, List[Dict]] = {1: [], 2: []}
+    for record_id, (moment, entity_type, record) in enumerate(moves, start=1):
+        history[entity_type].append({'ID': str(record_id), 'CREATED_TIME': moment.isoformat(timespec='seconds'), **record})
+    return history
+
+
+def paginate(rows: Iterator[Dict], size: int = 50) -> Iterator[List[Dict]]:
+    """Group rows into Bitrix24-sized pages"""
+    page = []
+    for row in rows:
+        page.append(row)
+        if len(page) == size:
+            yield page
+            page = []
+    if page:
+        yield page
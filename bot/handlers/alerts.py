@@ -10,15 +10,17 @@ from telegram import Bot
 class AlertHandler:
     """Handler for sending alerts via Telegram"""
 
-    def __init__(self, bot_token: str, api_base_url: str):
+    def __init__(self, bot_token: str, api_base_url: str, service_token: str = ''):
         self.bot = Bot(token=bot_token)
         self.api_base_url = api_base_url
+        self.headers = {'X-Service-Token': service_token} if service_token else {}
 
     async def fetch_alerts(self) -> List[dict]:
         """Fetch current alerts from API"""
         try:
             response = requests.get(
                 f'{self.api_base_url}/api/alerts/',
+                headers=self.headers,
                 timeout=30
             )
 
@@ -10,9 +10,10 @@ from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 class NotificationHandler:
     """Handler for sending reports via Telegram"""
 
-    def __init__(self, bot_token: str, api_base_url: str, mini_app_url: str):
+    def __init__(self, bot_token: str, api_base_url: str, mini_app_url: str, service_token: str = ''):
         self.bot = Bot(token=bot_token)
         self.api_base_url = api_base_url
+        self.headers = {'X-Service-Token': service_token} if service_token else {}
         self.mini_app_url = mini_app_url
 
     async def send_daily_report(self, chat_ids: list, date: str = None):
@@ -24,6 +25,7 @@ class NotificationHandler:
             # Fetch report from API
             response = requests.get(
                 f'{self.api_base_url}/api/reports/daily?date={date}',
+                headers=self.headers,
                 timeout=30
             )
 
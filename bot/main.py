@@ -14,6 +14,9 @@ import requests
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 API_BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:8000')
 MINI_APP_URL = os.getenv('MINI_APP_URL', 'http://localhost:5173')
+# Must match SERVICE_TOKEN of the API
+API_SERVICE_TOKEN = os.getenv('API_SERVICE_TOKEN', '')
+API_HEADERS = {'X-Service-Token': API_SERVICE_TOKEN} if API_SERVICE_TOKEN else {}
 
 # Chat IDs for alerts (replace with your chat IDs)
 ALERT_CHAT_IDS = [727013047, 718885452, 6775209607, 1139941966, 332270956]
@@ -45,7 +48,7 @@ async def send_daily_alerts():
     """Send daily alerts to all chat IDs"""
     try:
         # Get alerts from API
-        response = requests.get(f'{API_BASE_URL}/api/alerts/', timeout=30)
+        response = requests.get(f'{API_BASE_URL}/api/alerts/', headers=API_HEADERS, timeout=30)
 
         if response.status_code == 200:
             data = response.json()
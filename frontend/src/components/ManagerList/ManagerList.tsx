@@ -19,7 +19,7 @@ export const ManagerList: React.FC<ManagerListProps> = ({ managers, onManagerCli
         <div
           key={index}
           className="manager-list__item"
-          onClick={() => onManagerClick?.(manager.ASSIGNED_BY_ID)}
+          onClick={() => onManagerClick?.(String(manager.ASSIGNED_BY_ID))}
         >
           <div className="manager-list__header">
             <span className="manager-list__name">👤 {manager.FULL_NAME}</span>
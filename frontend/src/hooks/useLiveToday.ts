@@ -0,0 +1,46 @@
+import { useEffect, useState } from 'react';
+import { liveTodayUrl } from '../services/api';
+import type { LiveManager, LiveToday } from '../types';
+
+// Applies a delta event: changed totals/managers are replaced, removed managers come as null
+const applyDelta = (current: LiveToday, delta: any): LiveToday => {
+  const managers: Record<string, LiveManager> = { ...current.managers };
+  Object.entries(delta.managers || {}).forEach(([id, manager]) => {
+    if (manager === null) {
+      delete managers[id];
+    } else {
+      managers[id] = manager as LiveManager;
+    }
+  });
+  return {
+    ...current,
+    version: delta.version,
+    totals: { ...current.totals, ...(delta.totals || {}) },
+    managers,
+    reactions: delta.reactions || current.reactions,
+  };
+};
+
+export const useLiveToday = (enabled = true) => {
+  const [data, setData] = useState<LiveToday | null>(null);
+  const [connected, setConnected] = useState(false);
+
+  useEffect(() => {
+    if (!enabled) return;
+    const source = new EventSource(liveTodayUrl());
+
+    source.onopen = () => setConnected(true);
+    source.onerror = () => setConnected(false);
+    source.addEventListener('snapshot', (event) => {
+      setData(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener('delta', (event) => {
+      const delta = JSON.parse((event as MessageEvent).data);
+      setData((current) => (current && current.date === delta.date ? applyDelta(current, delta) : current));
+    });
+
+    return () => source.close();
+  }, [enabled]);
+
+  return { data, connected };
+};
@@ -1,4 +1,5 @@
 import axios from 'axios';
+import WebApp from '@twa-dev/sdk';
 import type { DailyReport, WeeklyReport, MonthlyReport } from '../types';
 
 // API base URL - change this to your deployed backend URL
@@ -12,6 +13,14 @@ const api = axios.create({
   },
 });
 
+// Telegram Mini App auth: the backend verifies initData on every data endpoint
+api.interceptors.request.use((config) => {
+  if (WebApp.initData) {
+    config.headers['X-Telegram-Init-Data'] = WebApp.initData;
+  }
+  return config;
+});
+
 export const reportsApi = {
   // Get daily report
   getDaily: async (date?: string): Promise<DailyReport> => {
@@ -45,6 +54,23 @@ export const reportsApi = {
     });
     return response.data;
   },
+
+  // Get a period vs its baseline with deltas
+  getCompare: async (startDate: string, endDate: string, baseline: 'previous' | 'same_last_year' = 'previous') => {
+    const response = await api.get('/api/reports/compare', {
+      params: { start_date: startDate, end_date: endDate, baseline },
+    });
+    return response.data;
+  },
+
+  // Get several ranges at once (one upstream fetch of their days)
+  getBatch: async (
+    ranges: { start_date: string; end_date: string; label?: string }[],
+    sections: ('leads' | 'sales')[] = ['leads', 'sales'],
+  ) => {
+    const response = await api.post('/api/reports/batch', { ranges, sections });
+    return response.data;
+  },
 };
 
 export const metricsApi = {
@@ -74,6 +100,66 @@ export const metricsApi = {
     return response.data;
   },
 
+  // Get lead counts over two dimensions (sparse cells)
+  getHeatmap: async (startDate: string, endDate: string, rows = 'manager', columns = 'status') => {
+    const response = await api.get('/api/metrics/heatmap', {
+      params: { start_date: startDate, end_date: endDate, rows, columns },
+    });
+    return response.data;
+  },
+
+  // Get trend series (daily, weekly or monthly; optionally per manager or source)
+  getTimeseries: async (
+    startDate: string,
+    endDate: string,
+    grain: 'daily' | 'weekly' | 'monthly' = 'daily',
+    breakdown?: 'manager' | 'source',
+  ) => {
+    const params: any = { start_date: startDate, end_date: endDate, grain };
+    if (breakdown) params.breakdown = breakdown;
+    const response = await api.get('/api/metrics/timeseries', { params });
+    return response.data;
+  },
+
+  // Get lead -> deal conversion by lead creation cohort
+  getCohorts: async (
+    startDate: string,
+    endDate: string,
+    grain: 'daily' | 'weekly' | 'monthly' = 'monthly',
+    breakdown?: 'manager' | 'source',
+  ) => {
+    const params: any = { start_date: startDate, end_date: endDate, grain };
+    if (breakdown) params.breakdown = breakdown;
+    const response = await api.get('/api/metrics/cohorts', { params });
+    return response.data;
+  },
+
+  // Time spent in each lead status / deal stage, from stage history
+  getTimeInStatus: async (
+    startDate: string,
+    endDate: string,
+    kind: 'lead' | 'deal' = 'lead',
+    breakdown?: 'manager',
+  ) => {
+    const params: any = { start_date: startDate, end_date: endDate, kind };
+    if (breakdown) params.breakdown = breakdown;
+    const response = await api.get('/api/metrics/stages/time-in-status', { params });
+    return response.data;
+  },
+
+  // Stage-to-stage conversion, from stage history
+  getStageConversion: async (
+    startDate: string,
+    endDate: string,
+    kind: 'lead' | 'deal' = 'lead',
+    breakdown?: 'manager',
+  ) => {
+    const params: any = { start_date: startDate, end_date: endDate, kind };
+    if (breakdown) params.breakdown = breakdown;
+    const response = await api.get('/api/metrics/stages/conversion', { params });
+    return response.data;
+  },
+
   // Get manager detail
   getManagerDetail: async (managerId: string, startDate: string, endDate: string) => {
     const response = await api.get(`/api/metrics/manager/${managerId}`, {
@@ -83,4 +169,13 @@ export const metricsApi = {
   },
 };
 
+// Server-Sent Events stream of today's counters (initData as a query parameter: EventSource cannot set headers)
+export const liveTodayUrl = (): string => {
+  const url = new URL('/api/live/today', API_BASE_URL);
+  if (WebApp.initData) {
+    url.searchParams.set('init_data', WebApp.initData);
+  }
+  return url.toString();
+};
+
 export default api;
@@ -1,15 +1,19 @@
 export interface Manager {
-  ASSIGNED_BY_ID: string;
+  ASSIGNED_BY_ID: number;
   FULL_NAME: string;
   'CR%': number;
   number_of_leads: number;
   number_of_deals: number;
   time_taken_in_work?: string;
+  reaction_p90?: string;
+  reaction_p95?: string;
 }
 
 export interface LeadsMetrics {
   by_manager: Manager[];
   department_median: string | null;
+  department_p90?: string | null;
+  department_p95?: string | null;
   total_leads: number;
   total_deals: number;
 }
@@ -18,7 +22,22 @@ export interface LeadsDistribution {
   by_source: Record<string, number>;
   by_manager: Record<string, number>;
   by_status: Record<string, number>;
-  heatmap: Record<string, Record<string, number>>;
+  heatmap: Heatmap;
+}
+
+export type HeatmapDimension = 'manager' | 'status' | 'source' | 'hour' | 'weekday';
+
+export interface HeatmapAxis {
+  dimension: HeatmapDimension;
+  keys: (string | number)[];
+  labels: string[];
+}
+
+// Non-zero cells only: [row index, column index, count]
+export interface Heatmap {
+  rows: HeatmapAxis;
+  columns: HeatmapAxis;
+  cells: [number, number, number][];
 }
 
 export interface LeadsReport {
@@ -69,6 +88,35 @@ export interface Alert {
   timestamp: string;
 }
 
+export interface CacheInfo {
+  age_seconds: number;
+  generated_at: string;
+  stale: boolean;
+  refreshing: boolean;
+}
+
+export interface LiveManager {
+  name: string;
+  leads: number;
+  deals: number;
+  revenue: number;
+}
+
+export interface LiveReaction {
+  lead_id: number;
+  manager_id: number;
+  taken_at: string;
+  reaction_seconds: number | null;
+}
+
+export interface LiveToday {
+  version: number;
+  date: string;
+  totals: { leads: number; deals: number; revenue: number };
+  managers: Record<string, LiveManager>;
+  reactions: LiveReaction[];
+}
+
 export interface DailyReport {
   date: string;
   period: 'daily';
@@ -76,6 +124,7 @@ export interface DailyReport {
   sales: SalesReport;
   finmap: FinmapData;
   alerts: Alert[];
+  cache?: CacheInfo;
 }
 
 export interface WeeklyReport {
@@ -84,6 +133,7 @@ export interface WeeklyReport {
   period: 'weekly';
   leads: LeadsReport;
   sales: SalesReport;
+  cache?: CacheInfo;
 }
 
 export interface MonthlyReport {
@@ -94,6 +144,7 @@ export interface MonthlyReport {
   period: 'monthly';
   leads: LeadsReport;
   sales: SalesReport;
+  cache?: CacheInfo;
 }
 
 export type PeriodType = 'daily' | 'weekly' | 'monthly' | 'custom';